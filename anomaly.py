@@ -0,0 +1,200 @@
+# anomaly.py
+import threading
+import time
+from array import array
+
+import metrics
+
+ANOMALIES = metrics.counter("smart_classroom_sensor_anomalies_total", "被隔离的异常读数", ("reason",))
+QUARANTINED_SENSORS = metrics.gauge("smart_classroom_sensors_quarantined", "当前处于隔离状态的传感器数")
+
+# 异常原因编码（0表示正常）
+REASON_NONE = 0
+REASON_RANGE = 1     # 超出物理量程
+REASON_SPIKE = 2     # 偏离EWMA均值过多
+REASON_RATE = 3      # 变化速率过快
+REASON_FLATLINE = 4  # 读数长时间不变（传感器卡死）
+REASON_NAMES = {REASON_RANGE: "out_of_range", REASON_SPIKE: "spike",
+                REASON_RATE: "rate", REASON_FLATLINE: "flatline"}
+
+# 各类传感器的检测参数，None 表示不做该项检测
+DEFAULT_LIMITS = {
+    "temperature": {"min": -20, "max": 60, "max_rate": 0.5, "min_deviation": 3, "flatline_seconds": 6 * 3600},
+    "humidity": {"min": 0, "max": 100, "max_rate": 2, "min_deviation": 10, "flatline_seconds": 6 * 3600},
+    "light": {"min": 0, "max": 100000, "max_rate": None, "min_deviation": 300, "flatline_seconds": None},
+    "co2": {"min": 300, "max": 10000, "max_rate": 50, "min_deviation": 300, "flatline_seconds": 2 * 3600},
+    "pir": {"min": 0, "max": 1, "max_rate": None, "min_deviation": None, "flatline_seconds": None},
+}
+
+class SensorHealth:
+    """在线异常检测：每个传感器一个槽位，统计量保存在定长数组中（每个读数O(1)，不保留历史）
+    Welford 累计均值/方差用于报告，EWMA 均值/方差用于检测突变，另有变化速率和卡死检测"""
+
+    def __init__(self, config=None, capacity=1024):
+        config = config or {}
+        self.alpha = config.get("ewma_alpha", 0.1)
+        self.z_threshold = config.get("z_threshold", 4.0)
+        self.warmup = config.get("warmup", 20)
+        # 连续这么多次被判为突变后视为新的稳定水平（如开空调后温度下降），重置EWMA
+        self.max_consecutive = config.get("max_consecutive", 5)
+        self.limits = {sensor_type: dict(DEFAULT_LIMITS.get(sensor_type, {}), **overrides)
+                       for sensor_type, overrides in config.get("sensor_types", {}).items()}
+        for sensor_type, limits in DEFAULT_LIMITS.items():
+            self.limits.setdefault(sensor_type, dict(limits))
+
+        self._lock = threading.Lock()
+        self._slots = {}  # device_id -> 槽位
+        self._keys = []  # 槽位 -> (device_id, sensor_type)
+        self._params = []  # 槽位 -> 检测参数元组
+        self._size = 0
+        self._allocate(capacity)
+        QUARANTINED_SENSORS.set_function(self.quarantined_count)
+
+    # 状态数组：(属性名, array类型码)
+    FIELDS = (("_count_arr", "q"), ("_mean", "d"), ("_m2", "d"), ("_ewma", "d"), ("_ewvar", "d"),
+              ("_last", "d"), ("_last_ts", "d"), ("_accepted", "d"), ("_accepted_ts", "d"),
+              ("_changed_at", "d"), ("_anomalies", "q"), ("_streak", "q"), ("_reason", "b"))
+
+    def _allocate(self, capacity):
+        """按容量分配（或扩容）状态数组"""
+        for name, typecode in self.FIELDS:
+            values = getattr(self, name, None)
+            if values is None:
+                values = array(typecode)
+                setattr(self, name, values)
+            values.extend([0] * (capacity - len(values)))
+        self._capacity = capacity
+
+    def _slot(self, device_id, sensor_type):
+        slot = self._slots.get(device_id)
+        if slot is None:
+            if self._size == self._capacity:
+                self._allocate(self._capacity * 2)
+            slot = self._slots[device_id] = self._size
+            self._size += 1
+            self._keys.append((device_id, sensor_type))
+            limits = self.limits.get(sensor_type, {})
+            self._params.append((limits.get("min"), limits.get("max"), limits.get("max_rate"),
+                                 limits.get("min_deviation"), limits.get("flatline_seconds")))
+        return slot
+
+    def check(self, device_id, sensor_type, value, ts=None):
+        """检测一个读数，正常返回True；异常时返回False（调用方应隔离该读数）"""
+        ts = time.time() if ts is None else ts
+        with self._lock:
+            slot = self._slot(device_id, sensor_type)
+            reason = self._evaluate(slot, value, ts)
+        if reason:
+            ANOMALIES.labels(reason=REASON_NAMES[reason]).inc()
+        return not reason
+
+    def _evaluate(self, slot, value, ts):
+        low, high, max_rate, min_deviation, flatline_seconds = self._params[slot]
+        count = self._count_arr[slot]
+        last = self._last[slot]
+        # 变化速率相对最后一个被接受的读数计算，被隔离的突变值不会连带隔离下一个正常读数
+        accepted = self._accepted[slot]
+        elapsed = ts - self._accepted_ts[slot]
+
+        # 1. 物理量程：超出量程的读数不参与统计
+        if (low is not None and value < low) or (high is not None and value > high):
+            return self._flag(slot, REASON_RANGE)
+
+        reason = REASON_NONE
+        if count:
+            # 2. 卡死：读数在 flatline_seconds 内完全不变
+            if value != last:
+                self._changed_at[slot] = ts
+            elif flatline_seconds is not None and ts - self._changed_at[slot] > flatline_seconds:
+                reason = REASON_FLATLINE
+            # 3. 变化速率
+            if not reason and max_rate is not None and elapsed > 0 and \
+                    abs(value - accepted) / elapsed > max_rate:
+                reason = REASON_RATE
+            # 4. 突变：偏离EWMA均值超过 z_threshold 个标准差（且超过最小偏差）
+            if not reason and min_deviation is not None and count >= self.warmup:
+                deviation = abs(value - self._ewma[slot])
+                if deviation > min_deviation and deviation * deviation > \
+                        self.z_threshold * self.z_threshold * self._ewvar[slot]:
+                    reason = REASON_SPIKE
+        else:
+            self._changed_at[slot] = ts
+            self._ewma[slot] = value
+
+        self._last[slot] = value
+        self._last_ts[slot] = ts
+        if reason and (reason != REASON_SPIKE or self._streak[slot] + 1 < self.max_consecutive):
+            return self._flag(slot, reason)
+        if reason == REASON_SPIKE:
+            # 持续偏离：认为是真实的水平变化，从新水平重新估计方差
+            self._ewma[slot] = value
+            self._ewvar[slot] = 0.0
+
+        # 正常读数：更新 Welford 和 EWMA 统计量
+        self._accepted[slot] = value
+        self._accepted_ts[slot] = ts
+        count += 1
+        self._count_arr[slot] = count
+        delta = value - self._mean[slot]
+        self._mean[slot] += delta / count
+        self._m2[slot] += delta * (value - self._mean[slot])
+        diff = value - self._ewma[slot]
+        increment = self.alpha * diff
+        self._ewma[slot] += increment
+        self._ewvar[slot] = (1 - self.alpha) * (self._ewvar[slot] + diff * increment)
+        self._streak[slot] = 0
+        self._reason[slot] = REASON_NONE
+        return REASON_NONE
+
+    def _flag(self, slot, reason):
+        self._anomalies[slot] += 1
+        self._streak[slot] += 1
+        self._reason[slot] = reason
+        return reason
+
+    def quarantined_count(self):
+        return sum(1 for slot in range(self._size) if self._reason[slot])
+
+    def status(self, device_id):
+        """单个传感器的健康状态，未见过的传感器返回None"""
+        slot = self._slots.get(device_id)
+        if slot is None:
+            return None
+        with self._lock:
+            return self._describe(slot)
+
+    def _describe(self, slot):
+        device_id, sensor_type = self._keys[slot]
+        count = self._count_arr[slot]
+        reason = self._reason[slot]
+        if reason:
+            status = "quarantined"
+        elif count < self.warmup:
+            status = "warming_up"
+        else:
+            status = "ok"
+        return {
+            "device_id": device_id,
+            "sensor_type": sensor_type,
+            "status": status,
+            "reason": REASON_NAMES.get(reason),
+            "samples": count,
+            "mean": round(self._mean[slot], 3),
+            "std": round((self._m2[slot] / (count - 1)) ** 0.5, 3) if count > 1 else None,
+            "ewma": round(self._ewma[slot], 3),
+            "last_value": self._last[slot],
+            "last_seen": self._last_ts[slot] or None,
+            "anomalies": self._anomalies[slot],
+        }
+
+    def report(self, only_unhealthy=False, limit=None):
+        """所有传感器的健康状态；only_unhealthy=True 时只返回被隔离的传感器"""
+        results = []
+        with self._lock:
+            for slot in range(self._size):
+                if only_unhealthy and not self._reason[slot]:
+                    continue
+                results.append(self._describe(slot))
+                if limit is not None and len(results) >= limit:
+                    break
+        return results
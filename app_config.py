@@ -0,0 +1,18 @@
+# app_config.py
+import json
+import os
+
+# 默认配置文件路径（相对项目根目录，与启动目录无关）
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config", "config.json")
+
+def load_config(path=None):
+    """读取配置文件，文件不存在或为空时返回空字典"""
+    path = path or CONFIG_PATH
+    try:
+        with open(path, encoding="utf-8") as f:
+            content = f.read()
+    except FileNotFoundError:
+        return {}
+    if not content.strip():
+        return {}
+    return json.loads(content)
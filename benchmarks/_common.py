@@ -0,0 +1,47 @@
+# benchmarks/_common.py
+import os
+import sys
+import tempfile
+import time
+
+# 让基准测试可以直接导入项目根目录下的模块
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+def temp_db_path(name="bench.db"):
+    """每次运行使用独立的临时数据库，不影响 data/ 下的数据"""
+    return os.path.join(tempfile.mkdtemp(prefix="smart_classroom_bench_"), name)
+
+def rate(fn, count):
+    """执行 fn() count 次，返回每秒次数"""
+    start = time.perf_counter()
+    for _ in range(count):
+        fn()
+    elapsed = time.perf_counter() - start
+    return round(count / elapsed, 1)
+
+def latency_stats(samples):
+    """把秒为单位的延迟样本汇总成毫秒统计"""
+    if not samples:
+        return {"count": 0}
+    values = sorted(samples)
+    
+    def pct(p):
+        return round(values[min(len(values) - 1, int(len(values) * p / 100))] * 1000, 3)
+    
+    return {
+        "count": len(values),
+        "mean_ms": round(sum(values) / len(values) * 1000, 3),
+        "p50_ms": pct(50),
+        "p99_ms": pct(99),
+    }
+
+def measure(fn, repeat):
+    """执行 fn() repeat 次，返回每次的耗时样本（秒）"""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
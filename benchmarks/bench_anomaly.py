@@ -0,0 +1,29 @@
+# benchmarks/bench_anomaly.py
+import random
+
+from _common import latency_stats, measure
+
+from anomaly import SensorHealth
+
+TYPES = (("temperature", 24, 0.3), ("humidity", 55, 2), ("light", 500, 50),
+         ("co2", 800, 20), ("pir", 0, 0))
+
+def run(args):
+    """异常检测：一个tick内检测 health_sensors 个传感器各一个读数的耗时"""
+    rng = random.Random(0)
+    sensors = [(f"sensor{i}",) + TYPES[i % len(TYPES)] for i in range(args.health_sensors)]
+    health = SensorHealth(capacity=len(sensors))
+    tick = [0]
+    
+    def run_tick():
+        tick[0] += 1
+        ts = tick[0] * 5.0
+        for device_id, sensor_type, mean, std in sensors:
+            value = float(rng.randint(0, 1)) if sensor_type == "pir" else rng.gauss(mean, std)
+            health.check(device_id, sensor_type, value, ts)
+    
+    stats = latency_stats(measure(run_tick, min(args.repeat, 10)))
+    stats["sensors"] = len(sensors)
+    stats["readings_per_sec"] = round(len(sensors) / (stats["mean_ms"] / 1000), 1)
+    stats["quarantined"] = health.quarantined_count()
+    return stats
@@ -0,0 +1,66 @@
+# benchmarks/bench_api.py
+import os
+import threading
+import time
+import urllib.request
+
+from _common import latency_stats, temp_db_path
+
+ROUTES = ("/api/sensor_data", "/api/devices", "/api/history")
+
+def start_server():
+    """在临时目录中导入web_server（数据库写到临时目录），用werkzeug在随机端口启动"""
+    from werkzeug.serving import make_server
+    
+    os.chdir(os.path.dirname(temp_db_path()))
+    import web_server
+    
+    server = make_server("127.0.0.1", 0, web_server.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, web_server
+
+def bench_route(base_url, route, clients, requests_per_client):
+    """clients 个并发客户端各请求 requests_per_client 次，返回延迟统计"""
+    samples = []
+    lock = threading.Lock()
+    
+    def client():
+        local = []
+        for _ in range(requests_per_client):
+            start = time.perf_counter()
+            with urllib.request.urlopen(base_url + route) as response:
+                response.read()
+            local.append(time.perf_counter() - start)
+        with lock:
+            samples.extend(local)
+    
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    
+    stats = latency_stats(samples)
+    stats["requests_per_sec"] = round(len(samples) / elapsed, 1)
+    return stats
+
+def run(args):
+    server, web_server = start_server()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+    
+    # 准备一些历史数据
+    if web_server.db:
+        for i in range(1000):
+            web_server.db.save_sensor_data("co2_sensor1", "co2", 400 + i % 1000, "ppm")
+        web_server.db.flush()
+    
+    results = {}
+    try:
+        for route in ROUTES:
+            results[route] = bench_route(base_url, route, args.clients, args.requests)
+    finally:
+        server.shutdown()
+    results["clients"] = args.clients
+    return results
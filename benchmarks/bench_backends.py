@@ -0,0 +1,73 @@
+# benchmarks/bench_backends.py
+import random
+from datetime import datetime, timedelta
+
+from _common import latency_stats, measure, temp_db_path
+
+from database import Database
+from device_registry import DeviceRegistry
+from storage import NarrowBackend, WideBackend
+
+ROOMS = 20
+SENSOR_TYPES = ("temperature", "humidity", "light", "co2", "pir")
+
+def make_registry():
+    """合成注册表：ROOMS 个教室，每个教室一套5种传感器"""
+    registry = DeviceRegistry()
+    for r in range(ROOMS):
+        for sensor_type in SENSOR_TYPES:
+            registry.register("sensor", {"id": f"room{r}_{sensor_type}", "type": sensor_type,
+                                         "room": f"room{r}"})
+    return registry
+
+def make_snapshots(count, seed=0):
+    """count 个快照：每5秒一轮，每轮每个教室一个快照"""
+    rng = random.Random(seed)
+    base = datetime.now() - timedelta(seconds=5 * count // ROOMS)
+    snapshots = []
+    for i in range(count):
+        timestamp = base + timedelta(seconds=5 * (i // ROOMS))
+        snapshots.append((timestamp, f"room{i % ROOMS}", {
+            "temperature": round(rng.uniform(18, 30), 1),
+            "humidity": rng.randint(40, 75),
+            "light": rng.randint(0, 1000),
+            "co2": rng.randint(400, 1500),
+            "pir": rng.choice((0, 1)),
+        }))
+    return snapshots
+
+def bench_backend(backend, snapshots, repeat):
+    """写入速率和两种范围查询的耗时"""
+    results = {}
+    start = datetime.now()
+    for i in range(0, len(snapshots), 500):
+        backend.write_snapshots(snapshots[i:i + 500])
+    backend.flush()
+    results["write_snapshots_per_sec"] = round(len(snapshots) / (datetime.now() - start).total_seconds(), 1)
+
+    # 单个传感器类型、全部教室的最近1/4时间范围
+    first, last = snapshots[0][0], snapshots[-1][0]
+    range_start = last - (last - first) / 4
+    results["query_type_range"] = latency_stats(measure(
+        lambda: sum(1 for _ in backend.query_range("co2", start=range_start)), repeat))
+    # 单个教室、单个传感器类型的全部时间范围
+    results["query_room_range"] = latency_stats(measure(
+        lambda: sum(1 for _ in backend.query_range("temperature", room="room3")), repeat))
+    return results
+
+def run(args):
+    snapshots = make_snapshots(args.backend_snapshots)
+    registry = make_registry()
+    results = {}
+
+    db = Database(temp_db_path(), flush_interval=0, max_pending=len(snapshots) * len(SENSOR_TYPES))
+    narrow = NarrowBackend(db, registry)
+    results["narrow"] = bench_backend(narrow, snapshots, args.repeat)
+    db.close()
+
+    wide = WideBackend(temp_db_path())
+    results["wide"] = bench_backend(wide, snapshots, args.repeat)
+    wide.close()
+
+    results["snapshots"] = len(snapshots)
+    return results
@@ -0,0 +1,72 @@
+# benchmarks/bench_control.py
+import random
+
+from _common import latency_stats, measure, rate
+
+from control_logic import ControlLogic, np
+
+def random_sensor_data(rng):
+    return {
+        "temperature": round(22 + rng.uniform(-3, 8), 1),
+        "humidity": rng.randint(40, 75),
+        "light": rng.randint(0, 1000),
+        "co2": rng.randint(400, 1500),
+        "pir": rng.choice([0, 0, 0, 1]),
+    }
+
+def bench_scalar(count):
+    """auto_control_logic / 增量评估 / scene_mode_control 的规则评估速率"""
+    rng = random.Random(0)
+    samples = [random_sensor_data(rng) for _ in range(1000)]
+    logic = ControlLogic()
+    
+    results = {}
+    index = [0]
+    
+    def auto():
+        logic.auto_control_logic(samples[index[0] % 1000])
+        index[0] += 1
+    
+    results["auto_control_logic_per_sec"] = rate(auto, count)
+    
+    # 增量评估：只有一个传感器变化时，只评估依赖它的规则组
+    def incremental():
+        logic.auto_control_changes(samples[index[0] % 1000], now=0, changed=("co2",))
+        index[0] += 1
+    
+    results["auto_control_incremental_per_sec"] = rate(incremental, count)
+    for mode in ("lecture", "exam", "energy"):
+        results[f"scene_{mode}_per_sec"] = rate(
+            lambda: logic.scene_mode_control(mode, samples[0]), count)
+    return results
+
+def bench_batch(rooms, repeat=20):
+    """auto_control_batch 单次tick耗时，并与单教室接口逐一核对结果"""
+    if np is None:
+        return {"skipped": "未安装NumPy"}
+    rng = np.random.default_rng(0)
+    light = rng.integers(0, 1000, rooms)
+    pir = rng.integers(0, 2, rooms)
+    co2 = rng.integers(400, 1500, rooms)
+    temperature = np.round(rng.uniform(19, 30, rooms), 1)
+    logic = ControlLogic()
+    
+    codes = logic.auto_control_batch(light, pir, co2, temperature)
+    mismatches = 0
+    for i in range(rooms):
+        sensor_data = {"light": int(light[i]), "pir": int(pir[i]),
+                       "co2": int(co2[i]), "temperature": float(temperature[i])}
+        if logic.auto_control_logic(sensor_data) != logic.expand_batch_commands(codes, i):
+            mismatches += 1
+    
+    stats = latency_stats(measure(
+        lambda: logic.auto_control_batch(light, pir, co2, temperature), repeat))
+    stats["rooms"] = rooms
+    stats["parity_mismatches"] = mismatches
+    return stats
+
+def run(args):
+    return {
+        "scalar": bench_scalar(args.evals),
+        "batch": bench_batch(args.batch_rooms),
+    }
@@ -0,0 +1,57 @@
+# benchmarks/bench_query_cache.py
+import random
+import time
+from datetime import datetime, timedelta
+
+from _common import latency_stats, measure, temp_db_path
+
+from database import Database
+from query_cache import QueryCache
+
+SENSOR_TYPES = ("temperature", "humidity", "light", "co2", "pir")
+
+def fill(db, rows, seed=0):
+    """最近一天内均匀分布的 rows 行数据"""
+    rng = random.Random(seed)
+    now = datetime.now()
+    step = 86400 / rows
+    readings = [(f"{SENSOR_TYPES[i % 5]}_{i % 20}", SENSOR_TYPES[i % 5], rng.uniform(0, 1000), None,
+                 now - timedelta(seconds=step * (rows - i))) for i in range(rows)]
+    for i in range(0, rows, 10000):
+        db.save_sensor_batch(readings[i:i + 10000])
+    db.flush()
+
+def dashboard_refresh(reads):
+    """一次仪表盘刷新：每日摘要 + 每种传感器的最近数据和分钟汇总"""
+    reads.get_daily_summary()
+    for sensor_type in SENSOR_TYPES:
+        reads.query_recent_data(sensor_type, limit=100)
+        reads.query_rollup("minute", sensor_type, limit=120)
+
+def run_ticks(db, reads, dashboards, ticks):
+    """每个tick写入一批新数据，然后 dashboards 个仪表盘各刷新一次，返回每次刷新的耗时样本"""
+    samples = []
+    for _ in range(ticks):
+        db.save_sensor_batch([(f"{t}_0", t, 1.0, None, None) for t in SENSOR_TYPES])
+        db.flush()
+        samples += measure(lambda: dashboard_refresh(reads), dashboards)
+    return samples
+
+def run(args):
+    db = Database(temp_db_path(), flush_interval=0, max_pending=args.inserts)
+    fill(db, args.inserts)
+    dashboards = args.dashboards
+    ticks = 3
+
+    results = {}
+    started = time.perf_counter()
+    results["uncached_refresh"] = latency_stats(run_ticks(db, db, dashboards, ticks))
+    results["uncached_refreshes_per_sec"] = round(dashboards * ticks / (time.perf_counter() - started), 1)
+
+    cache = QueryCache(db)
+    started = time.perf_counter()
+    results["cached_refresh"] = latency_stats(run_ticks(db, cache, dashboards, ticks))
+    results["cached_refreshes_per_sec"] = round(dashboards * ticks / (time.perf_counter() - started), 1)
+    results["dashboards"] = dashboards
+    db.close()
+    return results
@@ -0,0 +1,85 @@
+# benchmarks/bench_storage.py
+import random
+import sqlite3
+from datetime import datetime, timedelta
+
+from _common import latency_stats, measure, temp_db_path
+
+from database import Database
+
+SENSORS = (("temp1", "temperature", "°C"), ("humi1", "humidity", "%"),
+           ("light_sensor1", "light", "lux"), ("co2_sensor1", "co2", "ppm"),
+           ("pir1", "pir", ""))
+
+def bench_inserts(count):
+    """save_sensor_data / save_control_command 的写入速率（包含最后一次flush）"""
+    results = {}
+    
+    db = Database(temp_db_path())
+    start = datetime.now()
+    for i in range(count):
+        device_id, sensor_type, unit = SENSORS[i % len(SENSORS)]
+        db.save_sensor_data(device_id, sensor_type, i % 1000, unit)
+    db.close()
+    results["save_sensor_data_per_sec"] = round(count / (datetime.now() - start).total_seconds(), 1)
+    
+    db = Database(temp_db_path())
+    start = datetime.now()
+    for i in range(count):
+        db.save_control_command("fan1", "on" if i % 2 else "off", "基准测试")
+    db.close()
+    results["save_control_command_per_sec"] = round(count / (datetime.now() - start).total_seconds(), 1)
+    
+    return results
+
+def populate(db_path, rows, seed=0):
+    """直接批量写入 rows 行合成数据（每5秒一组5个传感器），然后重算汇总表"""
+    db = Database(db_path, flush_interval=0)
+    rng = random.Random(seed)
+    ticks = rows // len(SENSORS)
+    base = datetime.now() - timedelta(seconds=5 * ticks)
+    conn = sqlite3.connect(db_path)
+    chunk = []
+    for tick in range(ticks):
+        ts = (base + timedelta(seconds=5 * tick)).isoformat(" ")
+        for device_id, sensor_type, unit in SENSORS:
+            chunk.append((ts, device_id, sensor_type, rng.uniform(0, 1500), unit))
+        if len(chunk) >= 100000:
+            with conn:
+                conn.executemany('''
+                    INSERT INTO sensor_data (timestamp, device_id, sensor_type, value, unit)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', chunk)
+            chunk = []
+    if chunk:
+        with conn:
+            conn.executemany('''
+                INSERT INTO sensor_data (timestamp, device_id, sensor_type, value, unit)
+                VALUES (?, ?, ?, ?, ?)
+            ''', chunk)
+    conn.close()
+    db.rebuild_rollups()
+    return db, base
+
+def bench_queries(rows, repeat=50):
+    """在 rows 行数据上测 query_recent_data / get_daily_summary 的延迟"""
+    db, base = populate(temp_db_path(f"query_{rows}.db"), rows)
+    day = (base + (datetime.now() - base) / 2).date()
+    results = {
+        "query_recent_data_by_type": latency_stats(
+            measure(lambda: db.query_recent_data("co2", limit=100), repeat)),
+        "query_recent_data_all": latency_stats(
+            measure(lambda: db.query_recent_data(limit=100), repeat)),
+        "get_daily_summary": latency_stats(
+            measure(lambda: db.get_daily_summary(day), repeat)),
+        "query_rollup_hour": latency_stats(
+            measure(lambda: db.query_rollup("hour", "temperature", limit=168), repeat)),
+    }
+    db.close()
+    return results
+
+def run(args):
+    results = {"inserts": bench_inserts(args.inserts)}
+    for rows in args.rows:
+        results[f"queries_{rows}_rows"] = bench_queries(rows, args.repeat)
+    return results
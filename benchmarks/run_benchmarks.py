@@ -0,0 +1,135 @@
+# benchmarks/run_benchmarks.py
+"""离线基准测试：写入、规则评估、查询、存储布局和API热点路径
+
+    python benchmarks/run_benchmarks.py --output results.json
+    python benchmarks/run_benchmarks.py --quick --baseline results.json
+"""
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+
+from _common import ROOT
+
+import bench_anomaly
+import bench_api
+import bench_backends
+import bench_control
+import bench_query_cache
+import bench_storage
+
+SUITES = {
+    "storage": bench_storage,
+    "control": bench_control,
+    "backends": bench_backends,
+    "anomaly": bench_anomaly,
+    "cache": bench_query_cache,
+    "api": bench_api,
+}
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+def flatten(data, prefix=""):
+    """把嵌套结果展开成 {"a.b.c": 数值}，便于与基线逐项比较"""
+    items = {}
+    for key, value in data.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            items.update(flatten(value, name + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            items[name] = value
+    return items
+
+def higher_is_better(metric):
+    return metric.endswith("_per_sec")
+
+def compare(results, baseline, threshold):
+    """与基线比较，返回退化超过阈值的指标列表"""
+    current = flatten(results["results"])
+    previous = flatten(baseline["results"])
+    regressions = []
+    print(f"\n{'指标':<60} {'基线':>12} {'当前':>12} {'变化':>8}")
+    for metric in sorted(current):
+        if metric not in previous or not (metric.endswith("_per_sec") or metric.endswith("_ms")):
+            continue
+        old, new = previous[metric], current[metric]
+        if not old:
+            continue
+        change = (new - old) / old
+        worse = -change if higher_is_better(metric) else change
+        flag = "  <-- 退化" if worse > threshold else ""
+        if flag:
+            regressions.append(metric)
+        print(f"{metric:<60} {old:>12} {new:>12} {change:>+7.1%}{flag}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="智慧教室基准测试")
+    parser.add_argument("--only", default=",".join(SUITES), help="要运行的套件，逗号分隔")
+    parser.add_argument("--rows", default="1000000,10000000", help="查询测试的数据量，逗号分隔")
+    parser.add_argument("--inserts", type=int, default=100000, help="写入测试的行数")
+    parser.add_argument("--repeat", type=int, default=50, help="每个查询的重复次数")
+    parser.add_argument("--evals", type=int, default=100000, help="规则评估次数")
+    parser.add_argument("--batch-rooms", type=int, default=10000, help="批量规则评估的教室数")
+    parser.add_argument("--backend-snapshots", type=int, default=200000, help="存储布局测试的快照数")
+    parser.add_argument("--health-sensors", type=int, default=100000, help="异常检测测试的传感器数")
+    parser.add_argument("--dashboards", type=int, default=200, help="查询缓存测试每个tick刷新的仪表盘数")
+    parser.add_argument("--clients", type=int, default=16, help="API测试的并发客户端数")
+    parser.add_argument("--requests", type=int, default=100, help="每个客户端的请求数")
+    parser.add_argument("--quick", action="store_true", help="小数据量快速运行")
+    parser.add_argument("--output", help="结果JSON输出路径")
+    parser.add_argument("--baseline", help="用于比较的基线结果JSON")
+    parser.add_argument("--threshold", type=float, default=0.10, help="判定退化的相对阈值")
+    args = parser.parse_args()
+    
+    if args.quick:
+        args.rows = "100000"
+        args.inserts = 20000
+        args.repeat = 20
+        args.evals = 20000
+        args.backend_snapshots = 20000
+        args.health_sensors = 20000
+        args.dashboards = 50
+        args.clients = 4
+        args.requests = 25
+    args.rows = [int(r) for r in args.rows.split(",") if r]
+    
+    results = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "commit": git_commit(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "args": {k: v for k, v in vars(args).items() if k not in ("output", "baseline")},
+        },
+        "results": {},
+    }
+    for name in args.only.split(","):
+        print(f"运行基准测试: {name}")
+        started = time.perf_counter()
+        results["results"][name] = SUITES[name].run(args)
+        print(f"  完成，用时 {time.perf_counter() - started:.1f}s")
+    
+    print(json.dumps(results["results"], ensure_ascii=False, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存: {args.output}")
+    
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} 项指标退化超过 {args.threshold:.0%}")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
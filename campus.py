@@ -0,0 +1,183 @@
+# campus.py
+"""校园层次汇总：配置文件 devices.buildings 定义 楼栋 -> 楼层 -> 教室
+
+    "buildings": [{"id": "A", "name": "教学楼A",
+                   "floors": [{"id": "A-1", "name": "A栋1层", "rooms": ["room101"]}]}]
+
+每个节点保存子树的累计值（读数之和与计数、有人的教室数、运行中的执行器数），
+读数到达时只把差值沿祖先链加上去，不从教室重新汇总
+"""
+import json
+import threading
+
+import metrics
+from energy import ACTIVE_STATUSES
+
+CAMPUS_OCCUPIED = metrics.gauge("smart_classroom_campus_occupied_rooms", "全校有人的教室数")
+
+# 配置中没有归属楼层的教室挂在这个虚拟楼栋/楼层下
+UNASSIGNED = "unassigned"
+
+class Node:
+    """层次中的一个节点（校园/楼栋/楼层/教室），保存子树的累计值：
+    各类传感器最新读数之和与上报的教室数、有人的教室数、执行器总数和运行中的执行器数"""
+    __slots__ = ("id", "kind", "name", "parent", "children", "sums", "counts", "rooms",
+                 "occupied", "actuators", "active", "values")
+
+    def __init__(self, node_id, kind, name=None, parent=None):
+        self.id = node_id
+        self.kind = kind
+        self.name = name or node_id
+        self.parent = parent
+        self.children = []
+        self.sums = {}
+        self.counts = {}
+        self.rooms = 0
+        self.occupied = 0
+        self.actuators = 0
+        self.active = 0
+        self.values = {}  # 仅教室节点：各传感器的最新读数
+        if parent is not None:
+            parent.children.append(self)
+
+    def path(self):
+        """从自身到根节点"""
+        node = self
+        while node is not None:
+            yield node
+            node = node.parent
+
+    def summary(self):
+        data = {
+            "id": self.id,
+            "kind": self.kind,
+            "name": self.name,
+            "rooms": self.rooms,
+            "occupied_rooms": self.occupied,
+            "occupancy_rate": round(self.occupied / self.rooms, 3) if self.rooms else None,
+            "actuators": self.actuators,
+            "active_actuators": self.active,
+            "averages": {sensor_type: round(total / self.counts[sensor_type], 2)
+                         for sensor_type, total in self.sums.items() if self.counts[sensor_type]},
+        }
+        if self.kind == "room":
+            data["values"] = dict(self.values)
+        return data
+
+class CampusAggregator:
+    """校园 -> 楼栋 -> 楼层 -> 教室 的实时汇总：读数或执行器状态变化时，
+    只把差值（新值-旧值）加到教室及其上级节点，O(层数)，不从叶子重新计算；
+    概览只遍历楼栋和楼层，耗时与教室数无关"""
+
+    def __init__(self, registry):
+        self.registry = registry
+        self._lock = threading.Lock()
+        self.root = Node("campus", "campus", "校园")
+        self._nodes = {"campus": self.root}
+        self._rooms = {}  # room -> 教室节点
+        self._actuator_status = {}  # device_id -> 是否运行中
+        self.version = 0
+        self._overview = (-1, None)  # (版本, JSON字节)
+        for building in registry.buildings:
+            building_node = self._add(building["id"], "building", building.get("name"), self.root)
+            for floor in building.get("floors", ()):
+                floor_node = self._add(floor["id"], "floor", floor.get("name"), building_node)
+                for room in floor.get("rooms", ()):
+                    self._add_room(room, floor_node)
+        for actuator in registry.actuators():
+            self.update_actuator(actuator.id, actuator.status)
+        CAMPUS_OCCUPIED.set_function(lambda: self.root.occupied)
+
+    def _add(self, node_id, kind, name, parent):
+        if node_id in self._nodes:
+            raise ValueError(f"层次节点ID重复: {node_id}")
+        node = self._nodes[node_id] = Node(node_id, kind, name, parent)
+        return node
+
+    def _add_room(self, room, floor_node):
+        node = self._rooms[room] = Node(room, "room", room, floor_node)
+        for ancestor in node.path():
+            ancestor.rooms += 1
+        return node
+
+    def _room_node(self, room):
+        """教室节点；配置中没有的教室放到未分配楼层下（调用方持有锁）"""
+        node = self._rooms.get(room)
+        if node is None:
+            floor = self._nodes.get(UNASSIGNED + "-floor")
+            if floor is None:
+                building = self._add(UNASSIGNED, "building", "未分配", self.root)
+                floor = self._add(UNASSIGNED + "-floor", "floor", "未分配", building)
+            node = self._add_room(room, floor)
+        return node
+
+    def update_room(self, room, values):
+        """合并一个教室的读数（可以只含变化的字段），把差值累加到各级节点"""
+        if room is None:
+            return
+        with self._lock:
+            node = self._room_node(room)
+            changed = False
+            for sensor_type, value in values.items():
+                if not isinstance(value, (int, float)):
+                    continue
+                old = node.values.get(sensor_type)
+                if old == value:
+                    continue
+                node.values[sensor_type] = value
+                delta = value if old is None else value - old
+                added = 1 if old is None else 0
+                occupied = (bool(value) - bool(old)) if sensor_type == "pir" else 0
+                for ancestor in node.path():
+                    ancestor.sums[sensor_type] = ancestor.sums.get(sensor_type, 0) + delta
+                    if added:
+                        ancestor.counts[sensor_type] = ancestor.counts.get(sensor_type, 0) + 1
+                    ancestor.occupied += occupied
+                changed = True
+            if changed:
+                self.version += 1
+
+    def update_actuator(self, device_id, status):
+        """执行器状态变化：运行中的执行器数按差值调整"""
+        device = self.registry.get(device_id)
+        if device is None or not device.room:
+            return
+        active = status in ACTIVE_STATUSES
+        with self._lock:
+            previous = self._actuator_status.get(device_id)
+            if previous == active:
+                return
+            self._actuator_status[device_id] = active
+            node = self._room_node(device.room)
+            added = 1 if previous is None else 0
+            delta = int(active) - int(bool(previous))
+            for ancestor in node.path():
+                ancestor.actuators += added
+                ancestor.active += delta
+            self.version += 1
+
+    def overview_json(self):
+        """(版本, 概览JSON字节)：校园和各楼栋、楼层的汇总，按版本缓存"""
+        with self._lock:
+            version, body = self._overview
+            if version != self.version:
+                body = json.dumps({
+                    "success": True,
+                    "campus": self.root.summary(),
+                    "buildings": [dict(building.summary(),
+                                       floors=[floor.summary() for floor in building.children])
+                                  for building in self.root.children],
+                }, ensure_ascii=False).encode("utf-8")
+                self._overview = (self.version, body)
+            return self.version, body
+
+    def node(self, node_id):
+        """某个节点的汇总和直接下级的汇总（楼层列出教室，教室附带最新读数），不存在时返回None"""
+        with self._lock:
+            node = self._nodes.get(node_id) or self._rooms.get(node_id)
+            if node is None:
+                return None
+            data = node.summary()
+            data["parent"] = node.parent.id if node.parent is not None else None
+            data["children"] = [child.summary() for child in node.children]
+            return data
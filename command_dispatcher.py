@@ -0,0 +1,312 @@
+# command_dispatcher.py
+"""执行器命令分发：命令先入队立即返回命令id，后台线程合并、批量发布到设备的 control/<id> 主题
+
+    python command_dispatcher.py --commands 20000 --devices 2000
+
+- 合并：同一设备还没发出的命令被新命令取代（状态 superseded），窗口 coalesce_window 秒
+- 批量：每次唤醒最多取 batch_size 条，在锁外连续发布
+- 确认：设备在 <mqtt_topic>/ack 发布 {"id": 命令id}；require_ack 时收到确认才更新设备状态，
+  超过 ack_timeout 未确认则重发，最多 max_retries 次后记为 failed
+- 没有Broker（publish 为 None，模拟模式）时命令在分发时直接生效
+"""
+import argparse
+import heapq
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import metrics
+from device_registry import default_registry
+
+DISPATCH_COMMANDS = metrics.counter("smart_classroom_dispatch_commands_total",
+                                    "命令分发结果", ("result",))
+DISPATCH_PENDING = metrics.gauge("smart_classroom_dispatch_pending", "等待发送和等待确认的命令数")
+DISPATCH_ACK_SECONDS = metrics.histogram("smart_classroom_dispatch_ack_seconds",
+                                         "命令从提交到设备确认的耗时（秒）")
+
+# 设备确认主题：<执行器主题>/ack，如 control/light1/ack
+ACK_SUFFIX = "/ack"
+
+class Command:
+    """一条执行器命令及其分发状态：queued -> sent -> acked/applied，或 superseded/failed"""
+    __slots__ = ("id", "device_id", "command", "params", "reason", "source", "topic", "status",
+                 "attempts", "created_at", "sent_at", "done_at", "error")
+
+    def __init__(self, device_id, command, params, reason, source, topic):
+        self.id = uuid.uuid4().hex[:12]
+        self.device_id = device_id
+        self.command = command
+        self.params = params
+        self.reason = reason
+        self.source = source
+        self.topic = topic
+        self.status = "queued"
+        self.attempts = 0
+        self.created_at = time.time()
+        self.sent_at = None
+        self.done_at = None
+        self.error = None
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__ if name != "topic"}
+
+class CommandDispatcher:
+    def __init__(self, publish=None, registry=None, config=None, on_applied=None):
+        config = config or {}
+        # publish(topic, payload)：MQTTClient.publish；None 表示没有Broker
+        self.publish = publish
+        self.registry = registry or default_registry()
+        # 命令生效时的回调 on_applied(command)（更新设备状态、能耗等），在分发线程中调用
+        self.on_applied = on_applied
+        self.coalesce_window = config.get("coalesce_window", 0.05)
+        self.batch_size = config.get("batch_size", 500)
+        self.require_ack = config.get("require_ack", False)
+        self.ack_timeout = config.get("ack_timeout", 5.0)
+        self.max_retries = config.get("max_retries", 3)
+        self.history_size = config.get("history_size", 10000)
+
+        self._cond = threading.Condition()
+        self._pending = OrderedDict()  # device_id -> 未发送的命令（每个设备只保留最新的一条）
+        self._oldest_pending = None
+        self._in_flight = {}  # 命令id -> 等待确认的命令
+        self._deadlines = []  # (确认截止时间, 命令id) 小顶堆
+        self._history = OrderedDict()  # 命令id -> 命令（最近 history_size 条，供状态查询）
+        self._stop = threading.Event()
+        self._thread = None
+        DISPATCH_PENDING.set_function(lambda: len(self._pending) + len(self._in_flight))
+
+    def submit(self, device_id, command, params=None, reason=None, source="auto"):
+        """命令入队，立即返回命令id（不等待发布和确认）"""
+        device = self.registry.get(device_id)
+        if device is None or device.kind != "actuator":
+            raise ValueError(f"未知执行器: {device_id}")
+        cmd = Command(device_id, command, params, reason, source, device.mqtt_topic)
+        with self._cond:
+            previous = self._pending.pop(device_id, None)
+            if previous is not None:
+                self._finish(previous, "superseded")
+                DISPATCH_COMMANDS.labels(result="superseded").inc()
+            self._pending[device_id] = cmd
+            if self._oldest_pending is None:
+                self._oldest_pending = time.monotonic()
+            self._remember(cmd)
+            self._cond.notify()
+        return cmd.id
+
+    def get(self, command_id):
+        with self._cond:
+            cmd = self._history.get(command_id)
+            return cmd.to_dict() if cmd is not None else None
+
+    def _remember(self, cmd):
+        """记录到有界的历史中（调用方持有锁）"""
+        self._history[cmd.id] = cmd
+        while len(self._history) > self.history_size:
+            self._history.popitem(last=False)
+
+    def _finish(self, cmd, status, error=None):
+        cmd.status = status
+        cmd.done_at = time.time()
+        cmd.error = error
+
+    # ============ 确认 ============
+    def handle_message(self, topic, payload):
+        """MQTT消息回调：处理设备确认 {"id": 命令id, "ok": true/false, "error": ...}"""
+        try:
+            data = json.loads(payload)
+            command_id = data["id"]
+        except (ValueError, KeyError, TypeError):
+            return
+        with self._cond:
+            cmd = self._in_flight.pop(command_id, None)
+            if cmd is None:
+                cmd = self._history.get(command_id)
+                # 不需要确认的命令发布时已经生效，这里只记录确认
+                if cmd is not None and cmd.status == "sent":
+                    cmd.status = "acked"
+                    DISPATCH_ACK_SECONDS.observe(time.time() - cmd.created_at)
+                return
+        if data.get("ok", True):
+            self._finish(cmd, "acked")
+            DISPATCH_COMMANDS.labels(result="acked").inc()
+            DISPATCH_ACK_SECONDS.observe(cmd.done_at - cmd.created_at)
+            self._apply(cmd)
+        else:
+            self._finish(cmd, "failed", data.get("error", "设备拒绝执行"))
+            DISPATCH_COMMANDS.labels(result="rejected").inc()
+
+    def _apply(self, cmd):
+        if self.on_applied is not None:
+            try:
+                self.on_applied(cmd)
+            except Exception as e:
+                print(f"命令生效回调出错: {e}")
+
+    # ============ 分发线程 ============
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """停止分发线程，队列中剩余的命令先发出"""
+        self._stop.set()
+        with self._cond:
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+            self._thread = None
+        self.dispatch_once(force=True)
+
+    def _loop(self):
+        while not self._stop.is_set():
+            with self._cond:
+                if not self._pending:
+                    timeout = self._deadlines[0][0] - time.monotonic() if self._deadlines else None
+                    self._cond.wait(None if timeout is None else max(timeout, 0))
+                    if self._stop.is_set():
+                        break
+                oldest = self._oldest_pending
+            # 等满合并窗口，让同一设备紧接着的新命令取代旧命令
+            if oldest is not None:
+                delay = oldest + self.coalesce_window - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            try:
+                self.dispatch_once()
+            except Exception as e:
+                print(f"命令分发出错: {e}")
+
+    def dispatch_once(self, force=False):
+        """发出一批命令并处理确认超时，返回发出的命令数"""
+        with self._cond:
+            batch = []
+            while self._pending and (force or len(batch) < self.batch_size):
+                batch.append(self._pending.popitem(last=False)[1])
+            if not self._pending:
+                self._oldest_pending = None
+        for cmd in batch:
+            self._send(cmd)
+        self._check_timeouts()
+        return len(batch)
+
+    def _send(self, cmd):
+        cmd.attempts += 1
+        cmd.sent_at = time.time()
+        if self.publish is None:
+            self._finish(cmd, "applied")
+            DISPATCH_COMMANDS.labels(result="applied").inc()
+            self._apply(cmd)
+            return
+        payload = json.dumps({"id": cmd.id, "command": cmd.command, "params": cmd.params})
+        if self.require_ack:
+            # 先登记再发布：确认可能在 publish 返回之前到达
+            with self._cond:
+                self._in_flight[cmd.id] = cmd
+                heapq.heappush(self._deadlines,
+                               (time.monotonic() + self.ack_timeout * cmd.attempts, cmd.id))
+            cmd.status = "sent"
+        try:
+            self.publish(cmd.topic, payload)
+        except Exception as e:
+            cmd.error = str(e)
+            DISPATCH_COMMANDS.labels(result="publish_error").inc()
+            if not self.require_ack:
+                self._finish(cmd, "failed", str(e))
+            # 需要确认时由超时重试处理
+            return
+        DISPATCH_COMMANDS.labels(result="sent").inc()
+        if not self.require_ack:
+            cmd.status = "sent"
+            self._apply(cmd)
+
+    def _check_timeouts(self):
+        """确认超时的命令重发（退避：第n次等待 n*ack_timeout），超过次数记为失败；
+        已有同设备的新命令排队时不再重发"""
+        now = time.monotonic()
+        retries = []
+        with self._cond:
+            while self._deadlines and self._deadlines[0][0] <= now:
+                _, command_id = heapq.heappop(self._deadlines)
+                cmd = self._in_flight.pop(command_id, None)
+                if cmd is None:
+                    continue
+                if cmd.device_id in self._pending:
+                    self._finish(cmd, "superseded")
+                    DISPATCH_COMMANDS.labels(result="superseded").inc()
+                elif cmd.attempts > self.max_retries:
+                    self._finish(cmd, "failed", cmd.error or "确认超时")
+                    DISPATCH_COMMANDS.labels(result="timeout").inc()
+                else:
+                    retries.append(cmd)
+        for cmd in retries:
+            DISPATCH_COMMANDS.labels(result="retried").inc()
+            self._send(cmd)
+
+    def stats(self):
+        with self._cond:
+            statuses = {}
+            for cmd in self._history.values():
+                statuses[cmd.status] = statuses.get(cmd.status, 0) + 1
+            return {"pending": len(self._pending), "in_flight": len(self._in_flight),
+                    "history": statuses}
+
+# ============ 压测 ============
+def benchmark(commands=20000, devices=2000, require_ack=True):
+    """用进程内模拟Broker和自动确认的模拟设备，测提交速率和端到端分发吞吐"""
+    from device_registry import DeviceRegistry
+    from fake_broker import FakeBroker
+    from mqtt_client import MQTTClient
+
+    registry = DeviceRegistry()
+    for i in range(devices):
+        registry.register("actuator", {"id": f"light{i}", "type": "light", "room": f"room{i // 4}",
+                                       "mqtt_topic": f"control/light{i}", "status": "off"})
+    broker = FakeBroker()
+    server = MQTTClient(registry=registry, client=broker.client())
+    server.connect()
+    device_side = broker.client()
+
+    def on_device_message(client, userdata, message):
+        data = json.loads(message.payload)
+        client.publish(message.topic + ACK_SUFFIX, json.dumps({"id": data["id"]}))
+
+    device_side.on_message = on_device_message
+    device_side.connect()
+    device_side.subscribe("control/+")
+
+    applied = []
+    dispatcher = CommandDispatcher(server.publish, registry,
+                                   {"require_ack": require_ack, "history_size": commands},
+                                   on_applied=applied.append)
+    server.add_topic_handler("control/+" + ACK_SUFFIX, dispatcher.handle_message)
+    server.subscribe("control/+" + ACK_SUFFIX)
+    dispatcher.start()
+
+    started = time.perf_counter()
+    for i in range(commands):
+        dispatcher.submit(f"light{i % devices}", "on" if (i // devices) % 2 == 0 else "off")
+    submitted = time.perf_counter() - started
+    while len(applied) + dispatcher.stats()["history"].get("superseded", 0) < commands:
+        time.sleep(0.005)
+    elapsed = time.perf_counter() - started
+    dispatcher.stop()
+    return {
+        "commands": commands,
+        "submit_per_sec": round(commands / submitted, 1),
+        "dispatched_per_sec": round(commands / elapsed, 1),
+        "applied": len(applied),
+        "superseded": commands - len(applied),
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="执行器命令分发压测（进程内模拟Broker）")
+    parser.add_argument("--commands", type=int, default=20000)
+    parser.add_argument("--devices", type=int, default=2000)
+    parser.add_argument("--no-ack", action="store_true", help="不等待设备确认")
+    args = parser.parse_args()
+    print(json.dumps(benchmark(args.commands, args.devices, not args.no_ack), ensure_ascii=False, indent=2))
@@ -1,64 +1,103 @@
  # src/control_logic.py
 import time
+import threading
+
+import metrics
+# 命令编码从 rule_engine 导入，保留在本模块的命名空间，兼容原有的导入方式
+from rule_engine import (CMD_NONE, CMD_ON, CMD_OFF, CMD_OPEN, CMD_CLOSE,  # noqa: F401
+                         COMMAND_NAMES, RulePlan, np)
+
+CONTROL_SECONDS = metrics.histogram("smart_classroom_control_evaluation_seconds",
+                                    "控制规则评估耗时（秒）", ("method",))
 
 class ControlLogic:
-    def __init__(self, device_manager=None):
+    def __init__(self, device_manager=None, actuator_policies=None, rules=None):
         self.device_manager = device_manager
         self.scene_mode = "auto"  # auto, lecture, exam, energy
         
-    def auto_control_logic(self, sensor_data):
-        """基于规则的自动控制"""
-        commands = []
-        
-        # 安全获取数据，避免KeyError
-        light = sensor_data.get('light', 0)
-        pir = sensor_data.get('pir', 0)
-        co2 = sensor_data.get('co2', 0)
-        temperature = sensor_data.get('temperature', 25)
+        # 编译后的规则（来自配置文件 rules 段，缺省时使用 rule_engine.DEFAULT_RULES；
+        # 也可以直接传入编译好的 RulePlan，多个实例共用）
+        self.rules = rules if isinstance(rules, RulePlan) else RulePlan(rules)
+        # 需要重新评估的设备（被最短驻留时间挡住的命令、外部下发的命令）
+        self._dirty = set()
         
-        # 光照控制
-        if light < 300 and pir == 1:
-            commands.append({"device": "light1", "command": "on", "reason": "光照不足且有人"})
-        elif light > 500 or pir == 0:
-            commands.append({"device": "light1", "command": "off", "reason": "光照充足或无人"})
+        # 每个执行器的滞回带宽和最短驻留时间（秒），如 {"fan1": {"hysteresis": 50, "min_dwell": 60}}
+        self.actuator_policies = actuator_policies or {}
+        # 每个执行器最后一次下发的命令：device -> (command, 下发时间)
+        self.device_state = {}
+        self._state_lock = threading.Lock()
         
-        # 空气质量控制
-        if co2 > 1000:
-            commands.append({"device": "fan1", "command": "on", "reason": "CO2浓度过高"})
-        elif co2 < 800:
-            commands.append({"device": "fan1", "command": "off", "reason": "CO2浓度正常"})
+    def _band(self, device, command):
+        """命令会改变设备状态时返回该设备的滞回带宽，否则为0"""
+        state = self.device_state.get(device)
+        if state is None or state[0] == command:
+            return 0
+        return self.actuator_policies.get(device, {}).get("hysteresis", 0)
         
-        # 温度控制
-        if temperature > 26:
-            commands.append({"device": "ac1", "command": "on", "temp": 25, "reason": "温度过高"})
-        elif temperature < 22:
-            commands.append({"device": "ac1", "command": "off", "reason": "温度适宜"})
-        
-        # 窗帘控制
-        if light > 800:
-            commands.append({"device": "curtain1", "command": "close", "reason": "光线过强"})
-        elif light < 200:
-            commands.append({"device": "curtain1", "command": "open", "reason": "需要更多光线"})
-        
-        return commands
+    def load_rules(self, rules):
+        """重新编译规则并整体替换（热加载），编译失败时抛出异常、旧规则不变"""
+        plan = RulePlan(rules)
+        with self._state_lock:
+            self.rules = plan
+            self._dirty.update(plan.devices)
+    
+    @metrics.timed(CONTROL_SECONDS.labels(method="auto_control_logic"))
+    def auto_control_logic(self, sensor_data):
+        """基于规则的自动控制（评估全部设备组）"""
+        return self.rules.evaluate(sensor_data, self._band)
+    
+    def filter_transitions(self, commands, now=None):
+        """去重：只保留会改变设备状态、且已超过最短驻留时间的命令，并记录新状态"""
+        if now is None:
+            now = time.time()
+        transitions = []
+        with self._state_lock:
+            for cmd in commands:
+                device = cmd["device"]
+                state = self.device_state.get(device)
+                if state is not None:
+                    if state[0] == cmd["command"]:
+                        continue
+                    min_dwell = self.actuator_policies.get(device, {}).get("min_dwell", 0)
+                    if now - state[1] < min_dwell:
+                        # 读数不再变化时也要在驻留时间过后重新评估
+                        self._dirty.add(device)
+                        continue
+                self.device_state[device] = (cmd["command"], now)
+                transitions.append(cmd)
+        return transitions
+    
+    @metrics.timed(CONTROL_SECONDS.labels(method="auto_control_changes"))
+    def auto_control_changes(self, sensor_data, now=None, changed=None):
+        """自动控制，只返回真正的状态变化；
+        changed 为本次变化的传感器类型时，只评估依赖这些传感器的设备组（以及待重新评估的设备）"""
+        plan = self.rules
+        groups = None
+        if changed is not None:
+            with self._state_lock:
+                dirty, self._dirty = self._dirty, set()
+            groups = plan.groups_for(changed, dirty)
+        return self.filter_transitions(plan.evaluate(sensor_data, self._band, groups), now)
+    
+    def record_command(self, device, command, now=None):
+        """记录外部（手动或场景）下发的命令，使去重和驻留时间计算保持一致"""
+        with self._state_lock:
+            self.device_state[device] = (command, time.time() if now is None else now)
+            self._dirty.add(device)
     
+    @metrics.timed(CONTROL_SECONDS.labels(method="scene_mode_control"))
     def scene_mode_control(self, mode, sensor_data):
         """场景模式控制"""
-        commands = []
-        
-        if mode == "lecture":  # 上课模式
-            commands.append({"device": "light1", "command": "on"})
-            commands.append({"device": "ac1", "command": "on", "temp": 24})
-            
-        elif mode == "exam":  # 考试模式
-            commands.append({"device": "light1", "command": "on"})
-            commands.append({"device": "fan1", "command": "off"})
-            
-        elif mode == "energy":  # 节能模式
-            pir = sensor_data.get('pir', 0)
-            if pir == 0:  # 无人
-                commands.append({"device": "light1", "command": "off"})
-                commands.append({"device": "ac1", "command": "off"})
-                commands.append({"device": "fan1", "command": "off"})
-                
-        return commands
\ No newline at end of file
+        return self.rules.scene_commands(mode, sensor_data)
+
+    @metrics.timed(CONTROL_SECONDS.labels(method="auto_control_batch"))
+    def auto_control_batch(self, light, pir, co2, temperature, **columns):
+        """批量自动控制：输入N个教室的传感器列数组（规则用到的其他传感器通过关键字传入），
+        返回形状为 (len(self.rules.devices), N) 的规则编号数组（0为不动作，用 expand_batch_commands 展开），
+        规则和滞回带宽（来自 device_state）与 auto_control_logic 相同"""
+        columns.update(light=light, pir=pir, co2=co2, temperature=temperature)
+        return self.rules.evaluate_batch(columns, len(light), self._band)
+    
+    def expand_batch_commands(self, codes, index):
+        """把批量结果中第index个教室的命令展开成 auto_control_logic 的格式"""
+        return self.rules.expand_batch(codes, index)
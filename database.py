@@ -1,22 +1,125 @@
 # src/database.py
 import sqlite3
 import json
-from datetime import datetime
+import math
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from datetime import datetime, date as date_type, timedelta
 import os
 
+import metrics
+
+DB_SECONDS = metrics.histogram("smart_classroom_db_operation_seconds", "数据库操作耗时（秒）", ("operation",))
+DB_ROWS_WRITTEN = metrics.counter("smart_classroom_db_rows_written_total", "写入管道提交的行数", ("table",))
+DB_QUEUE_DEPTH = metrics.gauge("smart_classroom_db_queue_depth", "写入队列中尚未提交的行数")
+DB_ROWS_DROPPED = metrics.counter("smart_classroom_db_rows_dropped_total", "写入管道丢弃的行数",
+                                  ("table", "reason"))
+
+# 汇总表粒度 -> (表名, 时间桶格式)
+ROLLUP_TABLES = {
+    "minute": ("sensor_rollup_minute", "%Y-%m-%d %H:%M"),
+    "hour": ("sensor_rollup_hour", "%Y-%m-%d %H"),
+    "day": ("sensor_rollup_day", "%Y-%m-%d"),
+}
+
+def _to_timestamp(value):
+    """把datetime/date/字符串统一成与存储格式一致的时间字符串，便于范围比较"""
+    if isinstance(value, datetime):
+        return value.isoformat(" ")
+    if isinstance(value, date_type):
+        return value.isoformat() + " 00:00:00"
+    return str(value)
+
+def _to_datetime(value):
+    """把写入的时间统一成datetime（接受datetime/date/ISO字符串/epoch秒），无法识别时抛出异常"""
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, date_type):
+        return datetime.combine(value, datetime.min.time())
+    if isinstance(value, str):
+        return datetime.fromisoformat(value)
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return datetime.fromtimestamp(value)
+    raise TypeError(f"无法识别的时间: {value!r}")
+
+def _optional_str(value):
+    return None if value is None else str(value)
+
+def normalize_sensor_row(row):
+    """校验并规范一行传感器数据 (timestamp, device_id, sensor_type, value, unit)，
+    数值必须是有限的数字；不合法时抛出 ValueError/TypeError"""
+    timestamp, device_id, sensor_type, value, unit = row
+    if value is not None:
+        value = float(value)
+        if not math.isfinite(value):
+            raise ValueError(f"非有限数值: {value}")
+    return (_to_datetime(timestamp), _optional_str(device_id), _optional_str(sensor_type), value,
+            _optional_str(unit))
+
+def normalize_control_row(row):
+    """校验并规范一行控制记录 (timestamp, device_id, command, reason)"""
+    timestamp, device_id, command, reason = row
+    return (_to_datetime(timestamp), _optional_str(device_id), _optional_str(command),
+            _optional_str(reason))
+
+def rename_legacy_wide_table(conn):
+    """旧版宽表（temperature/humidity/...列）改名保留，避免与窄表结构冲突"""
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(sensor_data)")]
+    if columns and "sensor_type" not in columns:
+        conn.execute("ALTER TABLE sensor_data RENAME TO sensor_data_legacy_wide")
+        conn.commit()
+        print("检测到旧版宽表 sensor_data，已改名为 sensor_data_legacy_wide")
+
 class Database:
-    def __init__(self, db_path="data/sensor_data.db"):
+    def __init__(self, db_path="data/sensor_data.db", batch_size=500,
+                 flush_interval=1.0, max_pending=10000, dead_letter_size=1000):
         # 确保data目录存在
         os.makedirs(os.path.dirname(db_path), exist_ok=True)
         
         self.db_path = db_path
+        
+        # 写入管道：所有写操作共用一个长连接（持有 _write_lock 时使用）+ 有界内存队列，批量提交
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max(max_pending, batch_size)
+        self._writer = None
+        self._write_lock = threading.RLock()
+        self._pending_lock = threading.Lock()
+        self._pending_sensor = []
+        self._pending_control = []
+        self._oldest_pending = None
+        # 刷新因数据库暂时不可用失败后，在这个时间之前不再由写入方触发刷新（交给后台线程重试）
+        self._retry_after = 0.0
+        self.dropped_rows = 0
+        # 单独写入仍然失败的行：(表名, 行, 错误)，只保留最近 dead_letter_size 条
+        self.dead_letters = deque(maxlen=dead_letter_size)
+        self._closed = threading.Event()
+        # 写入提交后的回调（如查询缓存失效），参数为 (传感器类型集合, 日期集合)
+        self._write_listeners = []
+        
         self._init_database()
+        DB_QUEUE_DEPTH.set_function(self.pending_count)
+        
+        self._flusher = None
+        if flush_interval and flush_interval > 0:
+            self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+            self._flusher.start()
         
     def _init_database(self):
         """初始化数据库表"""
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
         
+        # 增量回收空闲页（新建数据库时生效，已有数据库由迁移v2转换）
+        cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        
+        # WAL模式：读写互不阻塞，批量提交时fsync次数更少
+        cursor.execute("PRAGMA journal_mode=WAL")
+        
+        rename_legacy_wide_table(conn)
+        
         # 创建传感器数据表
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS sensor_data (
@@ -52,64 +155,514 @@ class Database:
         ''')
         
         conn.commit()
+        self._migrate(conn)
         conn.close()
         print(f"数据库初始化完成: {self.db_path}")
     
-    def save_sensor_data(self, device_id, sensor_type, value, unit=None):
-        """保存传感器数据"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+    # ============ 结构迁移 ============
+    def _migrate(self, conn):
+        """按 PRAGMA user_version 依次执行未完成的迁移"""
+        migrations = [
+            self._migration_indexes_and_rollups,
+            self._migration_incremental_vacuum,
+            self._migration_energy_daily_totals,
+        ]
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for number, migration in enumerate(migrations, start=1):
+            if version >= number:
+                continue
+            with conn:
+                migration(conn)
+                conn.execute(f"PRAGMA user_version = {number}")
+            print(f"数据库迁移完成: v{number} {migration.__doc__}")
+    
+    def _migration_indexes_and_rollups(self, conn):
+        """时间/类型覆盖索引与分钟/小时/天汇总表"""
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_sensor_data_type_time
+            ON sensor_data (sensor_type, timestamp, value)
+        ''')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_sensor_data_device_time
+            ON sensor_data (device_id, timestamp, value)
+        ''')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_sensor_data_time
+            ON sensor_data (timestamp)
+        ''')
         
-        cursor.execute('''
-            INSERT INTO sensor_data (timestamp, device_id, sensor_type, value, unit)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (datetime.now(), device_id, sensor_type, value, unit))
+        for table, _ in ROLLUP_TABLES.values():
+            conn.execute(f'''
+                CREATE TABLE IF NOT EXISTS {table} (
+                    bucket TEXT NOT NULL,
+                    sensor_type VARCHAR(20) NOT NULL,
+                    device_id VARCHAR(50) NOT NULL,
+                    count INTEGER NOT NULL,
+                    sum REAL NOT NULL,
+                    min REAL,
+                    max REAL,
+                    PRIMARY KEY (bucket, sensor_type, device_id)
+                ) WITHOUT ROWID
+            ''')
         
-        conn.commit()
-        conn.close()
+        # 用已有原始数据回填汇总表
+        self._rebuild_rollups(conn)
+    
+    def _migration_incremental_vacuum(self, conn):
+        """启用 auto_vacuum=INCREMENTAL（已有数据库需要一次完整VACUUM）"""
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            conn.commit()
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.execute("VACUUM")
+    
+    def _migration_energy_daily_totals(self, conn):
+        """能耗表增加 room 列，(date, device_id) 唯一，按教室/日期的覆盖索引"""
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(energy_consumption)")]
+        if "room" not in columns:
+            conn.execute("ALTER TABLE energy_consumption ADD COLUMN room VARCHAR(50)")
+        # 合并同一设备同一天的重复记录，再建唯一索引
+        conn.execute('''
+            UPDATE energy_consumption SET
+                power_consumed = (SELECT SUM(e.power_consumed) FROM energy_consumption e
+                                  WHERE e.date = energy_consumption.date
+                                    AND e.device_id IS energy_consumption.device_id),
+                duration = (SELECT SUM(e.duration) FROM energy_consumption e
+                            WHERE e.date = energy_consumption.date
+                              AND e.device_id IS energy_consumption.device_id)
+            WHERE id IN (SELECT MIN(id) FROM energy_consumption GROUP BY date, device_id
+                         HAVING COUNT(*) > 1)
+        ''')
+        conn.execute('''
+            DELETE FROM energy_consumption
+            WHERE id NOT IN (SELECT MIN(id) FROM energy_consumption GROUP BY date, device_id)
+        ''')
+        conn.execute('''
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_energy_date_device
+            ON energy_consumption (date, device_id)
+        ''')
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_energy_room_date
+            ON energy_consumption (room, date, power_consumed, duration)
+        ''')
+    
+    @staticmethod
+    def _rebuild_rollups(conn):
+        """根据原始数据重算汇总表（时间字符串前缀即时间桶），原始数据已清理的时间桶保持不变。
+        保留策略按传感器类型删除某个时间之前的原始数据，所以每类传感器最早的剩余读数所在的时间桶
+        可能只剩一部分：这个桶只在汇总表中还没有时补上（INSERT OR IGNORE），之后的桶原始数据完整，
+        整体重算替换（INSERT OR REPLACE）；更早的桶没有原始数据，不会被改动"""
+        for table, prefix_len in (("sensor_rollup_minute", 16),
+                                  ("sensor_rollup_hour", 13),
+                                  ("sensor_rollup_day", 10)):
+            for conflict, compare in (("REPLACE", ">"), ("IGNORE", "=")):
+                conn.execute(f'''
+                    INSERT OR {conflict} INTO {table} (bucket, sensor_type, device_id, count, sum, min, max)
+                    SELECT substr(s.timestamp, 1, {prefix_len}), s.sensor_type, COALESCE(s.device_id, ''),
+                           COUNT(*), SUM(s.value), MIN(s.value), MAX(s.value)
+                    FROM sensor_data s
+                    JOIN (SELECT sensor_type, MIN(timestamp) AS first FROM sensor_data
+                          WHERE sensor_type IS NOT NULL GROUP BY sensor_type) oldest
+                      ON oldest.sensor_type = s.sensor_type
+                    WHERE s.value IS NOT NULL
+                      AND substr(s.timestamp, 1, {prefix_len}) {compare} substr(oldest.first, 1, {prefix_len})
+                    GROUP BY 1, 2, 3
+                ''')
+    
+    def rebuild_rollups(self):
+        """写入队列中的数据后重算汇总表（批量导入原始数据后使用）"""
+        self.flush()
+        with self.writer() as conn, conn:
+            self._rebuild_rollups(conn)
+        self.notify_written()
+    
+    # ============ 写入管道 ============
+    @contextmanager
+    def writer(self):
+        """独占写入连接：with db.writer() as conn，期间其他写操作（包括批量刷新）等待"""
+        with self._write_lock:
+            yield self._writer_connection()
+    
+    def _writer_connection(self):
+        """获取写入长连接（首次使用时创建）；写操作互相串行，调用方持有 _write_lock，
+        因此不论有多少线程写入，都只有这一个连接"""
+        if self._writer is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._writer = conn
+        return self._writer
+    
+    def _enqueue(self, table, rows):
+        """校验后放入内存队列（在锁内取队列，避免与flush交换队列时丢数据），达到批量大小时立即刷新；
+        不合法的行丢弃并计数，队列超过 max_pending 时丢弃最旧的行"""
+        if self._closed.is_set():
+            raise RuntimeError("数据库已关闭")
+        normalize = normalize_sensor_row if table == "sensor_data" else normalize_control_row
+        valid = []
+        for row in rows:
+            try:
+                valid.append(normalize(row))
+            except (TypeError, ValueError) as e:
+                self._drop(table, [row], "invalid", e)
+        if not valid:
+            return
+        with self._pending_lock:
+            queue = self._pending_sensor if table == "sensor_data" else self._pending_control
+            queue.extend(valid)
+            self._trim_pending()
+            if self._oldest_pending is None:
+                self._oldest_pending = time.monotonic()
+            pending = len(self._pending_sensor) + len(self._pending_control)
+        if pending >= self.batch_size and time.monotonic() >= self._retry_after:
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                # 数据已放回队列，由后台线程重试，写入方不因数据库暂时不可用而失败
+                print(f"批量写入失败，稍后重试: {e}")
+    
+    def _trim_pending(self):
+        """两个队列合计超过 max_pending 时丢弃最旧的行，先丢传感器数据（调用方持有锁）"""
+        overflow = len(self._pending_sensor) + len(self._pending_control) - self.max_pending
+        if overflow <= 0:
+            return
+        dropped = min(overflow, len(self._pending_sensor))
+        if dropped:
+            del self._pending_sensor[:dropped]
+            self._count_dropped("sensor_data", dropped, "overflow")
+        if overflow > dropped:
+            del self._pending_control[:overflow - dropped]
+            self._count_dropped("control_history", overflow - dropped, "overflow")
+    
+    def _count_dropped(self, table, count, reason):
+        self.dropped_rows += count
+        DB_ROWS_DROPPED.labels(table=table, reason=reason).inc(count)
+    
+    def _drop(self, table, rows, reason, error):
+        """丢弃无法写入的行：计数并放入死信队列"""
+        self._count_dropped(table, len(rows), reason)
+        for row in rows:
+            self.dead_letters.append((table, row, str(error)))
+        print(f"丢弃 {len(rows)} 行 {table} 数据（{reason}）: {error}")
+    
+    @metrics.timed(DB_SECONDS.labels(operation="flush"))
+    def flush(self):
+        """把队列中的数据在一个事务内用executemany写入，返回写入行数。
+        数据库暂时不可用（OperationalError）时数据放回队列并抛出异常；
+        其他错误视为个别行的问题，改为逐行写入，仍然失败的行进入死信队列"""
+        with self._write_lock:
+            with self._pending_lock:
+                sensor_rows, self._pending_sensor = self._pending_sensor, []
+                control_rows, self._pending_control = self._pending_control, []
+                self._oldest_pending = None
+            if not sensor_rows and not control_rows:
+                return 0
+            
+            conn = self._writer_connection()
+            try:
+                self._write_rows(conn, sensor_rows, control_rows)
+            except sqlite3.OperationalError:
+                # 写入失败：数据放回队列头部，超出上限的最旧数据丢弃并计数
+                self._requeue(sensor_rows, control_rows)
+                self._retry_after = time.monotonic() + (self.flush_interval or 1.0)
+                raise
+            except Exception:
+                sensor_rows, control_rows = self._write_rows_isolated(conn, sensor_rows, control_rows)
+            self._retry_after = 0.0
+            DB_ROWS_WRITTEN.labels(table="sensor_data").inc(len(sensor_rows))
+            DB_ROWS_WRITTEN.labels(table="control_history").inc(len(control_rows))
+            if sensor_rows:
+                self.notify_written({row[2] for row in sensor_rows},
+                                    {row[0].strftime("%Y-%m-%d") for row in sensor_rows})
+            return len(sensor_rows) + len(control_rows)
+    
+    def _write_rows(self, conn, sensor_rows, control_rows):
+        """在一个事务内写入原始数据、汇总表和控制记录"""
+        with conn:
+            if sensor_rows:
+                conn.executemany('''
+                    INSERT INTO sensor_data (timestamp, device_id, sensor_type, value, unit)
+                    VALUES (?, ?, ?, ?, ?)
+                ''', sensor_rows)
+                self._update_rollups(conn, sensor_rows)
+            if control_rows:
+                conn.executemany('''
+                    INSERT INTO control_history (timestamp, device_id, command, reason)
+                    VALUES (?, ?, ?, ?)
+                ''', control_rows)
+    
+    def _write_rows_isolated(self, conn, sensor_rows, control_rows):
+        """整批写入失败后逐行写入（每行一个事务），返回写入成功的 (传感器行, 控制行)；
+        失败的行进入死信队列，不再重试，避免一行坏数据卡住整个管道"""
+        written = ([], [])
+        for table, rows, done in (("sensor_data", sensor_rows, written[0]),
+                                  ("control_history", control_rows, written[1])):
+            for i, row in enumerate(rows):
+                try:
+                    if table == "sensor_data":
+                        self._write_rows(conn, [row], [])
+                    else:
+                        self._write_rows(conn, [], [row])
+                except sqlite3.OperationalError:
+                    # 逐行写入时数据库变得不可用：剩余的行放回队列
+                    remaining = rows[i:]
+                    if table == "sensor_data":
+                        self._requeue(remaining, control_rows)
+                    else:
+                        self._requeue([], remaining)
+                    return written
+                except Exception as e:
+                    self._drop(table, [row], "dead_letter", e)
+                else:
+                    done.append(row)
+        return written
+    
+    def add_write_listener(self, callback):
+        """注册写入回调 callback(sensor_types, days)，在写入事务提交后调用"""
+        self._write_listeners.append(callback)
+    
+    def notify_written(self, sensor_types=None, days=None):
+        """通知已提交的数据变化；sensor_types/days 为 None 表示影响所有类型/日期"""
+        for callback in self._write_listeners:
+            callback(sensor_types, days)
+    
+    def _update_rollups(self, conn, sensor_rows):
+        """在同一事务内增量更新汇总表：先在内存中按时间桶聚合，再批量upsert"""
+        for table, fmt in ROLLUP_TABLES.values():
+            buckets = defaultdict(lambda: [0, 0.0, None, None])
+            for timestamp, device_id, sensor_type, value, _ in sensor_rows:
+                if value is None or sensor_type is None:
+                    continue
+                agg = buckets[(timestamp.strftime(fmt), sensor_type, device_id or "")]
+                agg[0] += 1
+                agg[1] += value
+                agg[2] = value if agg[2] is None else min(agg[2], value)
+                agg[3] = value if agg[3] is None else max(agg[3], value)
+            if not buckets:
+                continue
+            conn.executemany(f'''
+                INSERT INTO {table} (bucket, sensor_type, device_id, count, sum, min, max)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (bucket, sensor_type, device_id) DO UPDATE SET
+                    count = count + excluded.count,
+                    sum = sum + excluded.sum,
+                    min = MIN(min, excluded.min),
+                    max = MAX(max, excluded.max)
+            ''', [key + tuple(agg) for key, agg in buckets.items()])
+    
+    def _requeue(self, sensor_rows, control_rows):
+        """刷新失败时把数据放回队列，保证队列有界"""
+        with self._pending_lock:
+            self._pending_sensor = sensor_rows + self._pending_sensor
+            self._pending_control = control_rows + self._pending_control
+            self._trim_pending()
+            if self._oldest_pending is None:
+                self._oldest_pending = time.monotonic()
+    
+    def _flush_loop(self):
+        """后台刷新线程：队列中最旧的数据超过flush_interval时刷新"""
+        while not self._closed.wait(self.flush_interval / 2):
+            oldest = self._oldest_pending
+            if oldest is None or time.monotonic() - oldest < self.flush_interval:
+                continue
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"批量写入失败: {e}")
+    
+    def pending_count(self):
+        """队列中尚未写入的行数"""
+        with self._pending_lock:
+            return len(self._pending_sensor) + len(self._pending_control)
+    
+    def close(self):
+        """停止后台刷新，写入剩余数据并关闭写入连接"""
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        if self._flusher is not None:
+            self._flusher.join(timeout=5)
+        self.flush()
+        with self._write_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+    
+    def save_sensor_data(self, device_id, sensor_type, value, unit=None, timestamp=None):
+        """保存传感器数据（进入写入队列，批量提交）"""
+        self._enqueue("sensor_data",
+                      [(timestamp or datetime.now(), device_id, sensor_type, value, unit)])
+    
+    def save_sensor_batch(self, readings):
+        """批量保存传感器数据，readings 为 (device_id, sensor_type, value, unit, timestamp) 序列"""
+        now = datetime.now()
+        self._enqueue("sensor_data", [
+            (timestamp or now, device_id, sensor_type, value, unit)
+            for device_id, sensor_type, value, unit, timestamp in readings
+        ])
     
     def save_control_command(self, device_id, command, reason=None):
-        """保存控制命令"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO control_history (timestamp, device_id, command, reason)
-            VALUES (?, ?, ?, ?)
-        ''', (datetime.now(), device_id, command, reason))
-        
-        conn.commit()
-        conn.close()
+        """保存控制命令（进入写入队列，批量提交）"""
+        self._enqueue("control_history",
+                      [(datetime.now(), device_id, command, reason)])
     
-    def query_recent_data(self, sensor_type=None, limit=100):
-        """查询最近的数据"""
+    @metrics.timed(DB_SECONDS.labels(operation="save_energy_totals"))
+    def save_energy_totals(self, rows):
+        """累加设备日能耗，rows 为 (date, device_id, room, Wh, 秒数)，一个事务内批量写入"""
+        with self.writer() as conn, conn:
+            conn.executemany('''
+                INSERT INTO energy_consumption (date, device_id, room, power_consumed, duration)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (date, device_id) DO UPDATE SET
+                    room = excluded.room,
+                    power_consumed = power_consumed + excluded.power_consumed,
+                    duration = duration + excluded.duration
+            ''', rows)
+        DB_ROWS_WRITTEN.labels(table="energy_consumption").inc(len(rows))
+    
+    @metrics.timed(DB_SECONDS.labels(operation="query_recent_data"))
+    def query_recent_data(self, sensor_type=None, limit=100, start=None, end=None):
+        """查询最近的数据（可按时间范围过滤，走 (sensor_type, timestamp) 索引）"""
         conn = sqlite3.connect(self.db_path)
         conn.row_factory = sqlite3.Row
         cursor = conn.cursor()
         
+        conditions = []
+        params = []
         if sensor_type:
-            cursor.execute('''
-                SELECT * FROM sensor_data 
-                WHERE sensor_type = ? 
-                ORDER BY timestamp DESC 
-                LIMIT ?
-            ''', (sensor_type, limit))
-        else:
-            cursor.execute('''
-                SELECT * FROM sensor_data 
-                ORDER BY timestamp DESC 
-                LIMIT ?
-            ''', (limit,))
+            conditions.append("sensor_type = ?")
+            params.append(sensor_type)
+        if start is not None:
+            conditions.append("timestamp >= ?")
+            params.append(_to_timestamp(start))
+        if end is not None:
+            conditions.append("timestamp < ?")
+            params.append(_to_timestamp(end))
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        
+        cursor.execute(f'''
+            SELECT * FROM sensor_data 
+            {where}
+            ORDER BY timestamp DESC 
+            LIMIT ?
+        ''', (*params, limit))
         
         rows = cursor.fetchall()
         conn.close()
         
         return [dict(row) for row in rows]
     
+    def iter_history(self, sensor_type=None, device_id=None, start=None, end=None,
+                     after=None, order="asc", limit=None, chunk_size=1000):
+        """按 (timestamp, id) 顺序流式读取原始数据，不把结果整体载入内存
+        （耗时包含调用方处理每行的时间，因此不计入 DB_SECONDS）
+        after 为上一页最后一行的 (timestamp, id)，用于键集分页；逐行产出
+        (id, timestamp, device_id, sensor_type, value, unit)。
+        参数在调用时立即检查（不等到开始迭代），非法时抛出 ValueError"""
+        if order not in ("asc", "desc"):
+            raise ValueError(f"不支持的排序: {order}")
+        if limit is not None and (isinstance(limit, bool) or not isinstance(limit, int) or limit <= 0):
+            raise ValueError(f"limit 必须是正整数: {limit!r}")
+        if isinstance(chunk_size, bool) or not isinstance(chunk_size, int) or chunk_size <= 0:
+            raise ValueError(f"chunk_size 必须是正整数: {chunk_size!r}")
+        conditions = []
+        params = []
+        if sensor_type:
+            conditions.append("sensor_type = ?")
+            params.append(sensor_type)
+        if device_id:
+            conditions.append("device_id = ?")
+            params.append(device_id)
+        if start is not None:
+            conditions.append("timestamp >= ?")
+            params.append(_to_timestamp(start))
+        if end is not None:
+            conditions.append("timestamp < ?")
+            params.append(_to_timestamp(end))
+        if after is not None:
+            conditions.append("(timestamp, id) > (?, ?)" if order == "asc" else "(timestamp, id) < (?, ?)")
+            params.extend(after)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        direction = "ASC" if order == "asc" else "DESC"
+        sql = f'''
+            SELECT id, timestamp, device_id, sensor_type, value, unit
+            FROM sensor_data
+            {where}
+            ORDER BY timestamp {direction}, id {direction}
+        '''
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        return self._iter_rows(sql, params, chunk_size)
+    
+    def _iter_rows(self, sql, params, chunk_size):
+        """在独立连接上执行查询，按 chunk_size 分批取出并逐行产出"""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            cursor = conn.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            conn.close()
+    
+    def time_bounds(self, sensor_type=None, device_id=None, start=None, end=None):
+        """数据的最早/最晚时间（走索引，不扫描全表）"""
+        conditions = []
+        params = []
+        if sensor_type:
+            conditions.append("sensor_type = ?")
+            params.append(sensor_type)
+        if device_id:
+            conditions.append("device_id = ?")
+            params.append(device_id)
+        if start is not None:
+            conditions.append("timestamp >= ?")
+            params.append(_to_timestamp(start))
+        if end is not None:
+            conditions.append("timestamp < ?")
+            params.append(_to_timestamp(end))
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        
+        conn = sqlite3.connect(self.db_path)
+        first = conn.execute(f"SELECT MIN(timestamp) FROM sensor_data {where}", params).fetchone()[0]
+        last = conn.execute(f"SELECT MAX(timestamp) FROM sensor_data {where}", params).fetchone()[0]
+        conn.close()
+        return first, last
+    
+    def list_series(self, sensor_type=None, device_id=None, start=None, end=None):
+        """时间范围内出现过的 (device_id, sensor_type) 序列（读取天汇总表）"""
+        conditions = []
+        params = []
+        if sensor_type:
+            conditions.append("sensor_type = ?")
+            params.append(sensor_type)
+        if device_id:
+            conditions.append("device_id = ?")
+            params.append(device_id)
+        if start is not None:
+            conditions.append("bucket >= ?")
+            params.append(_to_timestamp(start)[:10])
+        if end is not None:
+            conditions.append("bucket <= ?")
+            params.append(_to_timestamp(end)[:10])
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        
+        conn = sqlite3.connect(self.db_path)
+        rows = conn.execute(f'''
+            SELECT DISTINCT device_id, sensor_type FROM sensor_rollup_day {where}
+            ORDER BY device_id, sensor_type
+        ''', params).fetchall()
+        conn.close()
+        return rows
+    
+    @metrics.timed(DB_SECONDS.labels(operation="get_daily_summary"))
     def get_daily_summary(self, date=None):
-        """获取每日摘要"""
+        """获取每日摘要（读取天汇总表，不扫描原始数据）"""
         if date is None:
             date = datetime.now().date()
+        day = _to_timestamp(date)[:10]
         
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
@@ -117,16 +670,113 @@ class Database:
         cursor.execute('''
             SELECT 
                 sensor_type,
-                COUNT(*) as count,
-                AVG(value) as avg_value,
-                MIN(value) as min_value,
-                MAX(value) as max_value
-            FROM sensor_data 
-            WHERE DATE(timestamp) = ?
+                SUM(count) as count,
+                SUM(sum) / SUM(count) as avg_value,
+                MIN(min) as min_value,
+                MAX(max) as max_value
+            FROM sensor_rollup_day 
+            WHERE bucket = ?
             GROUP BY sensor_type
-        ''', (date,))
+        ''', (day,))
         
         result = cursor.fetchall()
         conn.close()
         
-        return result
\ No newline at end of file
+        return result
+    
+    @metrics.timed(DB_SECONDS.labels(operation="query_energy"))
+    def query_energy(self, start=None, end=None, room=None, by_device=False):
+        """按教室和日期汇总能耗（走 (room, date) 覆盖索引），
+        by_device=True 时再按设备细分；返回 Wh 和通电秒数"""
+        conditions = []
+        params = []
+        if room:
+            conditions.append("room = ?")
+            params.append(room)
+        if start is not None:
+            conditions.append("date >= ?")
+            params.append(self._bucket(start, "%Y-%m-%d"))
+        if end is not None:
+            conditions.append("date < ?")
+            params.append(self._bucket(end, "%Y-%m-%d"))
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        group = "room, date, device_id" if by_device else "room, date"
+        
+        conn = sqlite3.connect(self.db_path)
+        conn.row_factory = sqlite3.Row
+        cursor = conn.cursor()
+        
+        cursor.execute(f'''
+            SELECT {group},
+                   SUM(power_consumed) as energy_wh,
+                   SUM(duration) as duration
+            FROM energy_consumption
+            {where}
+            GROUP BY {group}
+            ORDER BY {group}
+        ''', params)
+        
+        rows = cursor.fetchall()
+        conn.close()
+        
+        return [dict(row) for row in rows]
+    
+    @metrics.timed(DB_SECONDS.labels(operation="query_rollup"))
+    def query_rollup(self, granularity="minute", sensor_type=None, start=None, end=None,
+                     device_id=None, limit=1000):
+        """查询汇总数据（用于仪表盘图表），返回按时间桶升序的 count/avg/min/max"""
+        if granularity not in ROLLUP_TABLES:
+            raise ValueError(f"不支持的汇总粒度: {granularity}")
+        table, fmt = ROLLUP_TABLES[granularity]
+        
+        conditions = []
+        params = []
+        if sensor_type:
+            conditions.append("sensor_type = ?")
+            params.append(sensor_type)
+        if device_id:
+            conditions.append("device_id = ?")
+            params.append(device_id)
+        if start is not None:
+            conditions.append("bucket >= ?")
+            params.append(self._bucket(start, fmt))
+        if end is not None:
+            conditions.append("bucket < ?")
+            params.append(self._bucket(end, fmt))
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        
+        conn = sqlite3.connect(self.db_path)
+        conn.row_factory = sqlite3.Row
+        cursor = conn.cursor()
+        
+        # 取最近的limit个时间桶，再按时间升序返回
+        cursor.execute(f'''
+            SELECT * FROM (
+                SELECT 
+                    bucket,
+                    sensor_type,
+                    SUM(count) as count,
+                    SUM(sum) / SUM(count) as avg_value,
+                    MIN(min) as min_value,
+                    MAX(max) as max_value
+                FROM {table}
+                {where}
+                GROUP BY bucket, sensor_type
+                ORDER BY bucket DESC
+                LIMIT ?
+            ) ORDER BY bucket
+        ''', (*params, limit))
+        
+        rows = cursor.fetchall()
+        conn.close()
+        
+        return [dict(row) for row in rows]
+    
+    @staticmethod
+    def _bucket(value, fmt):
+        """把时间参数转换成汇总表的时间桶字符串"""
+        if isinstance(value, datetime):
+            return value.strftime(fmt)
+        if isinstance(value, date_type):
+            return datetime.combine(value, datetime.min.time()).strftime(fmt)
+        return str(value)
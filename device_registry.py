@@ -0,0 +1,173 @@
+# device_registry.py
+import json
+import threading
+from collections import defaultdict
+
+from app_config import load_config
+
+# 执行器的默认初始状态
+DEFAULT_STATUS = {"curtain": "closed"}
+
+class Device:
+    """设备记录（__slots__ 紧凑表示，5万设备时内存可控）"""
+    __slots__ = ("id", "kind", "type", "location", "room", "mqtt_topic", "status", "extra")
+    
+    def __init__(self, kind, id, type, location=None, room=None, mqtt_topic=None,
+                 status=None, **extra):
+        self.kind = kind  # sensor / actuator
+        self.id = id
+        self.type = type
+        self.location = location
+        self.room = room
+        self.mqtt_topic = mqtt_topic
+        if status is None and kind == "actuator":
+            status = DEFAULT_STATUS.get(type, "off")
+        self.status = status
+        self.extra = extra
+    
+    def to_dict(self):
+        """转换成 /api/devices 使用的字典格式"""
+        data = {"id": self.id, "type": self.type, "location": self.location}
+        if self.room is not None:
+            data["room"] = self.room
+        if self.mqtt_topic is not None:
+            data["mqtt_topic"] = self.mqtt_topic
+        if self.kind == "actuator":
+            data["status"] = self.status
+        data.update(self.extra)
+        return data
+    
+    def __repr__(self):
+        return f"Device({self.kind}, {self.id!r}, {self.type!r}, status={self.status!r})"
+
+class DeviceRegistry:
+    """设备注册表：按ID、MQTT主题、类型、位置、教室建立索引，查找O(1)"""
+    
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._by_id = {}
+        self._by_topic = {}
+        self._by_type = defaultdict(list)      # (kind, type) -> [Device]
+        self._by_location = defaultdict(list)  # location -> [Device]
+        self._by_room = defaultdict(list)      # room -> [Device]
+        self._sensors = []
+        self._actuators = []
+        # 教室的上级层次：[{"id", "name", "floors": [{"id", "name", "rooms": [...]}]}]
+        self.buildings = []
+        # 状态每变化一次版本号加1，序列化缓存按版本失效
+        self.version = 0
+        self._cache_version = -1
+        self._cache_dict = None
+        self._cache_json = None
+    
+    @classmethod
+    def from_config(cls, config=None):
+        """从配置文件的 devices 段加载设备"""
+        if config is None:
+            config = load_config()
+        registry = cls()
+        devices = config.get("devices", {})
+        for record in devices.get("sensors", []):
+            registry.register("sensor", record)
+        for record in devices.get("actuators", []):
+            registry.register("actuator", record)
+        registry.buildings = devices.get("buildings", [])
+        return registry
+    
+    def register(self, kind, record):
+        """注册一个设备，record 为配置中的设备字典"""
+        device = Device(kind, **record)
+        with self._lock:
+            if device.id in self._by_id:
+                raise ValueError(f"设备ID重复: {device.id}")
+            self._by_id[device.id] = device
+            if device.mqtt_topic:
+                self._by_topic[device.mqtt_topic] = device
+            self._by_type[(kind, device.type)].append(device)
+            self._by_location[device.location].append(device)
+            self._by_room[device.room].append(device)
+            (self._sensors if kind == "sensor" else self._actuators).append(device)
+            self.version += 1
+        return device
+    
+    def __len__(self):
+        return len(self._by_id)
+    
+    def __contains__(self, device_id):
+        return device_id in self._by_id
+    
+    def get(self, device_id):
+        return self._by_id.get(device_id)
+    
+    def by_topic(self, topic):
+        return self._by_topic.get(topic)
+    
+    def by_type(self, type, kind=None):
+        if kind is not None:
+            return list(self._by_type.get((kind, type), ()))
+        return (list(self._by_type.get(("sensor", type), ())) +
+                list(self._by_type.get(("actuator", type), ())))
+    
+    def by_location(self, location):
+        return list(self._by_location.get(location, ()))
+    
+    def by_room(self, room):
+        return list(self._by_room.get(room, ()))
+    
+    def rooms(self):
+        return list(self._by_room)
+    
+    def sensors(self):
+        return list(self._sensors)
+    
+    def actuators(self):
+        return list(self._actuators)
+    
+    def update_status(self, device_id, status):
+        """线程安全地更新执行器状态，返回状态是否发生变化"""
+        with self._lock:
+            device = self._by_id.get(device_id)
+            if device is None or device.status == status:
+                return False
+            device.status = status
+            self.version += 1
+            return True
+    
+    def to_dict(self):
+        """{"sensors": [...], "actuators": [...]}，按版本缓存，调用方不应修改返回值"""
+        with self._lock:
+            self._refresh_cache()
+            return self._cache_dict
+    
+    def to_json(self):
+        """to_dict() 的JSON字符串，按版本缓存"""
+        with self._lock:
+            self._refresh_cache()
+            return self._cache_json
+    
+    def versioned_json(self):
+        """(版本号, to_json())，在同一把锁内读取，保证两者一致"""
+        with self._lock:
+            self._refresh_cache()
+            return self._cache_version, self._cache_json
+    
+    def _refresh_cache(self):
+        if self._cache_version == self.version:
+            return
+        self._cache_dict = {
+            "sensors": [d.to_dict() for d in self._sensors],
+            "actuators": [d.to_dict() for d in self._actuators],
+        }
+        self._cache_json = json.dumps(self._cache_dict, ensure_ascii=False)
+        self._cache_version = self.version
+
+_default_registry = None
+_default_lock = threading.Lock()
+
+def default_registry():
+    """进程内共享的设备注册表（首次调用时从配置文件加载）"""
+    global _default_registry
+    with _default_lock:
+        if _default_registry is None:
+            _default_registry = DeviceRegistry.from_config()
+        return _default_registry
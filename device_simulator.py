@@ -1,15 +1,29 @@
 # device_simulator.py
-import paho.mqtt.client as mqtt
+import argparse
+import asyncio
 import json
+import math
+import os
+import tempfile
 import time
 import random
+import zlib
 from datetime import datetime
 
+try:
+    import paho.mqtt.client as mqtt
+except ImportError:  # 进程内模式不需要paho
+    mqtt = None
+
+from energy import rated_power
+
 class VirtualDevice:
-    def __init__(self, device_id, device_type):
+    def __init__(self, device_id, device_type, extra=None):
         self.device_id = device_id
         self.device_type = device_type
         self.status = "off"
+        # 开启时上报的功率与能耗统计使用同一个额定功率（配置 power_watts 或类型默认值）
+        self.power = rated_power(device_type, extra)
         
     def simulate_sensor_data(self):
         """模拟各种传感器数据"""
@@ -29,9 +43,243 @@ class VirtualDevice:
         """模拟执行器控制"""
         if command == "on":
             self.status = "on"
-            return {"status": "success", "power": random.randint(10, 100)}
+            return {"status": "success", "power": self.power}
         elif command == "off":
             self.status = "off"
             return {"status": "success", "power": 0}
         return {"status": "error"}
-    
\ No newline at end of file
+
+# ============ 压测负载生成 ============
+SENSOR_TYPES = ("temperature", "humidity", "light", "co2", "pir")
+SENSOR_UNITS = {"temperature": "°C", "humidity": "%", "light": "lux", "co2": "ppm", "pir": ""}
+
+# 上课时段（小时）
+CLASS_PERIODS = ((8, 12), (14, 18), (19, 21))
+
+class ClassroomModel:
+    """单个教室的相关信号模型：
+    光照随昼夜变化，占用按课表随机，CO2随人数累积并通风衰减，温度受日照和人数影响"""
+    
+    def __init__(self, room_id, seed=0, capacity=50):
+        # 每个教室独立的确定性随机数，与其他教室的数量和顺序无关
+        self.rng = random.Random(zlib.crc32(room_id.encode()) ^ seed)
+        self.room_id = room_id
+        self.capacity = capacity
+        self.occupants = 0
+        self.co2 = 420.0
+        self.window_factor = self.rng.uniform(0.6, 1.0)  # 朝向/窗户大小
+        self.ventilation = self.rng.uniform(0.0005, 0.002)  # 每秒换气比例
+        self.last_ts = None
+    
+    def _in_class(self, hour):
+        return any(start <= hour < end for start, end in CLASS_PERIODS)
+    
+    def step(self, sim_ts):
+        """推进到模拟时间 sim_ts（秒），返回各类传感器读数"""
+        dt = 0 if self.last_ts is None else max(0.0, sim_ts - self.last_ts)
+        self.last_ts = sim_ts
+        local = datetime.fromtimestamp(sim_ts)
+        hour = local.hour + local.minute / 60
+        rng = self.rng
+        
+        # 占用：上课时段人数在容量附近波动，课间和夜间逐渐清空
+        if self._in_class(hour):
+            target = int(self.capacity * rng.uniform(0.5, 1.0))
+        else:
+            target = 0 if rng.random() < 0.9 else rng.randint(1, 5)
+        self.occupants += int(round((target - self.occupants) * min(1.0, dt / 300)))
+        
+        # CO2：每人每秒约增加0.02 ppm（约200m³的教室），通风按比例向室外浓度衰减
+        self.co2 += dt * (self.occupants * 0.02 - self.ventilation * (self.co2 - 420))
+        self.co2 = max(400.0, self.co2)
+        
+        # 光照：白天正弦曲线 × 云量扰动，夜间只有灯光以外的背景光
+        daylight = max(0.0, math.sin(math.pi * (hour - 6) / 12))
+        light = 1000 * daylight * self.window_factor * rng.uniform(0.7, 1.0) + rng.uniform(0, 20)
+        
+        temperature = 21 + 4 * daylight + self.occupants * 0.05 + rng.gauss(0, 0.2)
+        humidity = 45 + self.occupants * 0.2 - 5 * daylight + rng.gauss(0, 1)
+        pir = 1 if self.occupants > 0 and rng.random() > 0.05 else 0
+        
+        return {
+            "temperature": round(temperature, 1),
+            "humidity": round(humidity),
+            "light": round(light),
+            "co2": round(self.co2),
+            "pir": pir,
+        }
+
+class MQTTPublisher:
+    """通过真实MQTT Broker发布"""
+    
+    def __init__(self, host="localhost", port=1883):
+        from mqtt_client import create_paho_client
+        self.client = create_paho_client()
+        self.client.connect(host, port)
+        self.client.loop_start()
+    
+    def publish(self, topic, payload):
+        self.client.publish(topic, payload)
+    
+    def close(self):
+        self.client.loop_stop()
+        self.client.disconnect()
+
+class BrokerPublisher:
+    """直接发布到进程内模拟Broker（驱动进程内的接入服务）"""
+    
+    def __init__(self, broker):
+        self.broker = broker
+    
+    def publish(self, topic, payload):
+        self.broker.publish(topic, payload)
+    
+    def close(self):
+        pass
+
+class LoadGenerator:
+    """模拟大量教室，每个教室N个传感器，按固定间隔发布读数，支持抖动和突发"""
+    
+    def __init__(self, publisher, rooms=1000, sensors_per_room=5, interval=5.0,
+                 jitter=0.0, burst_probability=0.0, burst_size=10, seed=0,
+                 time_scale=1.0, start_time=None):
+        self.publisher = publisher
+        self.rooms = [f"room{i:05d}" for i in range(rooms)]
+        self.sensors_per_room = sensors_per_room
+        self.interval = interval
+        self.jitter = jitter
+        self.burst_probability = burst_probability
+        self.burst_size = burst_size
+        self.seed = seed
+        # 虚拟时钟：每个教室从 start_time（加上初始相位）开始，每次上报推进一个上报间隔（含抖动）× time_scale，
+        # 与墙上时间和调度快慢无关——相同的 seed 和 start_time 产生相同的读数序列。
+        # time_scale=60 表示每个上报间隔对应模拟的60倍时长，便于观察昼夜变化
+        self.time_scale = time_scale
+        self.start_time = time.time() if start_time is None else start_time
+        self.models = {room: ClassroomModel(room, seed) for room in self.rooms}
+        self.published = 0
+        self._wall_start = None
+    
+    def _sensors(self, room):
+        """教室内的传感器列表：(device_id, sensor_type)，超过5个时按类型循环编号"""
+        return [(f"{room}-{SENSOR_TYPES[k % len(SENSOR_TYPES)]}{k // len(SENSOR_TYPES) + 1}",
+                 SENSOR_TYPES[k % len(SENSOR_TYPES)])
+                for k in range(self.sensors_per_room)]
+    
+    def _publish_room(self, room, sensors, readings):
+        now = time.time()
+        for device_id, sensor_type in sensors:
+            payload = json.dumps({
+                "device_id": device_id,
+                "sensor_type": sensor_type,
+                "room": room,
+                "value": readings[sensor_type],
+                "unit": SENSOR_UNITS[sensor_type],
+                "ts": now,
+            })
+            self.publisher.publish(f"sensor/{room}/{sensor_type}", payload)
+        self.published += len(sensors)
+    
+    async def _run_room(self, room, deadline):
+        model = self.models[room]
+        rng = model.rng
+        sensors = self._sensors(room)
+        # 初始相位均匀分布，避免所有教室在同一时刻发布
+        phase = rng.uniform(0, self.interval)
+        sim_ts = self.start_time + phase * self.time_scale
+        await asyncio.sleep(min(phase, max(0.0, deadline - time.time())))
+        while time.time() < deadline:
+            self._publish_room(room, sensors, model.step(sim_ts))
+            if self.burst_probability and rng.random() < self.burst_probability:
+                # 突发：同一时刻连续上报（如设备重连补发）
+                for _ in range(self.burst_size):
+                    self._publish_room(room, sensors, model.step(sim_ts))
+            delay = self.interval
+            if self.jitter:
+                delay += rng.uniform(-self.jitter, self.jitter)
+            delay = max(0.0, delay)
+            sim_ts += delay * self.time_scale
+            await asyncio.sleep(min(delay, max(0.0, deadline - time.time())))
+    
+    async def run(self, duration):
+        """运行duration秒，返回发布统计"""
+        self._wall_start = time.time()
+        deadline = self._wall_start + duration
+        await asyncio.gather(*(self._run_room(room, deadline) for room in self.rooms))
+        elapsed = time.time() - self._wall_start
+        return {
+            "rooms": len(self.rooms),
+            "sensors": len(self.rooms) * self.sensors_per_room,
+            "published": self.published,
+            "elapsed_s": round(elapsed, 3),
+            "rate": round(self.published / elapsed, 1),
+        }
+
+async def run_in_process(args):
+    """进程内模式：负载直接驱动接入服务（模拟Broker + IngestService + 可选数据库）"""
+    from database import Database
+    from device_registry import DeviceRegistry
+    from fake_broker import FakeBroker
+    from ingest_service import IngestService
+    from mqtt_client import MQTTClient
+    
+    broker = FakeBroker()
+    client = MQTTClient(registry=DeviceRegistry(), client=broker.client())
+    client.connect()
+    db = None
+    if not args.no_db:
+        db_path = args.db or os.path.join(tempfile.mkdtemp(), "loadgen.db")
+        db = Database(db_path)
+    service = IngestService(client, db=db)
+    await service.start(["sensor/#"])
+    
+    generator = make_generator(args, BrokerPublisher(broker))
+    report = await generator.run(args.duration)
+    await service.stop()
+    report["ingest"] = service.stats.to_dict()
+    if db is not None:
+        db.close()
+    return report
+
+def make_generator(args, publisher):
+    return LoadGenerator(
+        publisher, rooms=args.rooms, sensors_per_room=args.sensors,
+        interval=args.interval, jitter=args.jitter,
+        burst_probability=args.burst_prob, burst_size=args.burst_size,
+        seed=args.seed, time_scale=args.time_scale, start_time=parse_start_time(args.start_time))
+
+def parse_start_time(value):
+    """--start-time：ISO时间（如 2026-09-07T08:00）或epoch秒，缺省为当前时间"""
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="智慧教室负载生成器")
+    parser.add_argument("--rooms", type=int, default=1000)
+    parser.add_argument("--sensors", type=int, default=5, help="每个教室的传感器数量")
+    parser.add_argument("--interval", type=float, default=5.0, help="每个传感器的上报间隔（秒）")
+    parser.add_argument("--jitter", type=float, default=0.5, help="上报间隔的随机抖动（秒）")
+    parser.add_argument("--burst-prob", type=float, default=0.0, help="每次上报触发突发的概率")
+    parser.add_argument("--burst-size", type=int, default=10, help="一次突发额外上报的次数")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--time-scale", type=float, default=1.0, help="模拟时钟倍速")
+    parser.add_argument("--start-time", help="模拟时钟起点（ISO时间或epoch秒）；与 --seed 一起固定时读数可复现")
+    parser.add_argument("--duration", type=float, default=30.0, help="运行时长（秒）")
+    parser.add_argument("--mode", choices=("mqtt", "inprocess"), default="inprocess")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--db", help="进程内模式的数据库路径（默认临时文件）")
+    parser.add_argument("--no-db", action="store_true", help="进程内模式不写数据库")
+    args = parser.parse_args()
+    
+    if args.mode == "mqtt":
+        publisher = MQTTPublisher(args.host, args.port)
+        report = asyncio.run(make_generator(args, publisher).run(args.duration))
+        publisher.close()
+    else:
+        report = asyncio.run(run_in_process(args))
+    print(json.dumps(report, ensure_ascii=False, indent=2))
@@ -0,0 +1,100 @@
+# downsample.py
+"""时间序列降采样（流式，内存占用与数据总量无关）
+
+两种模式都按时间把 [start, end) 等分成桶，输入必须按时间升序：
+- minmax: 每个桶输出最小值和最大值两个点，保留尖峰
+- lttb:   Largest-Triangle-Three-Buckets，每个桶选一个视觉上最重要的点，
+          只需缓存当前桶和下一个桶
+"""
+
+def _bucket_index(t, start, width, buckets):
+    return min(buckets - 1, max(0, int((t - start) / width)))
+
+def minmax(points, start, end, max_points):
+    """points 为按时间升序的 (t, value, ...) 元组，每个桶产出最小/最大值点，共不超过 max_points 个"""
+    buckets = max(1, max_points // 2)
+    width = max((end - start) / buckets, 1e-9)
+    current = None
+    low = high = None
+    for point in points:
+        index = _bucket_index(point[0], start, width, buckets)
+        if index != current:
+            if low is not None:
+                yield from _ordered(low, high)
+            current = index
+            low = high = point
+            continue
+        if point[1] < low[1]:
+            low = point
+        if point[1] > high[1]:
+            high = point
+    if low is not None:
+        yield from _ordered(low, high)
+
+def _ordered(low, high):
+    if low is high:
+        yield low
+    elif low[0] <= high[0]:
+        yield low
+        yield high
+    else:
+        yield high
+        yield low
+
+def lttb(points, start, end, max_points):
+    """points 为按时间升序的 (t, value, ...) 元组，产出不超过 max_points 个点
+    第一个和最后一个点总是保留"""
+    if max_points < 3:
+        yield from minmax(points, start, end, max(max_points, 2))
+        return
+    buckets = max_points - 2
+    width = max((end - start) / buckets, 1e-9)
+    iterator = iter(points)
+    first = next(iterator, None)
+    if first is None:
+        return
+    yield first
+    
+    selected = first
+    current, current_index = [], None
+    pending, pending_index = [], None
+    last = first
+    
+    for point in iterator:
+        last = point
+        index = _bucket_index(point[0], start, width, buckets)
+        if current_index is None:
+            current, current_index = [point], index
+        elif index == current_index:
+            current.append(point)
+        elif pending_index is None or index == pending_index:
+            pending.append(point)
+            pending_index = index
+        else:
+            # 下一个桶已完整：用它的平均点作为第三个顶点，从当前桶里选点
+            selected = _pick(selected, current, pending)
+            yield selected
+            current, current_index = pending, pending_index
+            pending, pending_index = [point], index
+    
+    if pending:
+        selected = _pick(selected, current, pending)
+        yield selected
+        current = pending
+    if current:
+        # 最后一个桶：以最后一个点作为第三个顶点选点，再输出最后一个点
+        if len(current) > 1:
+            yield _pick(selected, current[:-1], [last])
+        yield last
+
+def _pick(previous, bucket, following):
+    """选出与前一个已选点、下一个桶平均点构成三角形面积最大的点"""
+    avg_t = sum(p[0] for p in following) / len(following)
+    avg_v = sum(p[1] for p in following) / len(following)
+    best, best_area = bucket[0], -1.0
+    pt, pv = previous[0], previous[1]
+    for point in bucket:
+        area = abs((pt - avg_t) * (point[1] - pv) - (pt - point[0]) * (avg_v - pv))
+        if area > best_area:
+            best, best_area = point, area
+    return best
@@ -0,0 +1,176 @@
+# energy.py
+import threading
+import time
+from datetime import datetime, timedelta
+
+import metrics
+
+ENERGY_WH = metrics.counter("smart_classroom_energy_wh_total", "累计能耗（Wh）", ("room",))
+ENERGY_FLUSHES = metrics.counter("smart_classroom_energy_flushes_total", "能耗日累计写库次数")
+
+# 没有配置 power_watts 的执行器按类型取额定功率（W）；窗帘只在动作时耗电，忽略不计
+DEFAULT_POWER = {"light": 400, "fan": 60, "ac": 1500}
+
+# 处于这些状态时计为耗电
+ACTIVE_STATUSES = {"on"}
+
+def rated_power(device_type, extra=None):
+    """执行器额定功率（W）：设备配置（extra）中的 power_watts 优先，其次按类型默认值"""
+    if extra and "power_watts" in extra:
+        return extra["power_watts"]
+    return DEFAULT_POWER.get(device_type, 0)
+
+def _split_by_day(start, end):
+    """把 [start, end) 时间段（epoch秒）按自然日切开，生成 (日期, 秒数)"""
+    while start < end:
+        day = datetime.fromtimestamp(start).date()
+        next_day = time.mktime((day + timedelta(days=1)).timetuple())
+        stop = min(end, next_day)
+        yield day.isoformat(), stop - start
+        start = stop
+
+def merge_totals(data, rows, start=None, room=None, by_device=False):
+    """把未写库的累计行 (date, device_id, room, Wh, 秒数) 合并进 Database.query_energy 的结果
+    （按相同的 room/start 条件过滤、相同的分组键累加），返回按分组键排序的新列表"""
+    keys = ("room", "date", "device_id") if by_device else ("room", "date")
+    merged = {tuple(item[key] for key in keys): dict(item) for item in data}
+    for day, device_id, row_room, wh, seconds in rows:
+        if (room and row_room != room) or (start is not None and day < str(start)):
+            continue
+        group = (row_room, day, device_id)[:len(keys)]
+        item = merged.get(group)
+        if item is None:
+            item = merged[group] = dict(zip(keys, group), energy_wh=0.0, duration=0.0)
+        item["energy_wh"] = (item["energy_wh"] or 0) + wh
+        item["duration"] = (item["duration"] or 0) + seconds
+    return sorted(merged.values(),
+                  key=lambda item: tuple("" if item[key] is None else item[key] for key in keys))
+
+class EnergyAccountant:
+    """增量能耗统计：根据执行器开关状态变化记录通电区间，在线累加 功率×时长，
+    按 (日期, 设备) 在内存中累计后批量写入 energy_consumption，不回扫 control_history"""
+
+    def __init__(self, db, registry, config=None):
+        config = config or {}
+        self.db = db
+        self.registry = registry
+        self.flush_interval = config.get("flush_interval", 60)
+        self._lock = threading.Lock()
+        # 写库期间持有：查询时在这个锁内读数据库和内存累计值，同一份能耗不会被算两次或漏算
+        self._flush_lock = threading.Lock()
+        self._on_since = {}  # device_id -> (开始时间, 功率W)
+        self._pending = {}  # (date, device_id) -> [Wh, 秒]
+        self._stop = threading.Event()
+        self._thread = None
+
+    def power_of(self, device_id):
+        """执行器额定功率（W），见 rated_power"""
+        device = self.registry.get(device_id)
+        if device is None:
+            return 0
+        return rated_power(device.type, device.extra)
+
+    def seed_from_registry(self, now=None):
+        """启动时按注册表中的当前状态开始计时"""
+        for actuator in self.registry.actuators():
+            self.record_transition(actuator.id, actuator.status, now=now)
+
+    def record_transition(self, device_id, status, power=None, now=None):
+        """记录一次状态变化；power 为设备上报的实际功率（W），缺省时用额定功率"""
+        now = time.time() if now is None else now
+        with self._lock:
+            running = self._on_since.pop(device_id, None)
+            if running is not None:
+                self._accrue(device_id, running[0], now, running[1])
+            if status in ACTIVE_STATUSES:
+                if power is None:
+                    power = running[1] if running is not None else self.power_of(device_id)
+                self._on_since[device_id] = (now, power)
+
+    def _accrue(self, device_id, start, end, power, pending=None):
+        """把一个通电区间计入各自然日的累计值（默认计入 _pending，调用方持有锁）"""
+        pending = self._pending if pending is None else pending
+        for day, seconds in _split_by_day(start, end):
+            totals = pending.setdefault((day, device_id), [0.0, 0.0])
+            totals[0] += power * seconds / 3600
+            totals[1] += seconds
+
+    def checkpoint(self, now=None):
+        """把仍在通电的区间结算到 now，区间从 now 重新开始（跨天时按天拆分）"""
+        now = time.time() if now is None else now
+        with self._lock:
+            for device_id, (start, power) in self._on_since.items():
+                if now > start:
+                    self._accrue(device_id, start, now, power)
+                    self._on_since[device_id] = (now, power)
+
+    def _rows(self, pending):
+        """(date, device_id) -> [Wh, 秒] 转换成 (date, device_id, room, Wh, 秒数) 行"""
+        rows = []
+        for (day, device_id), (wh, seconds) in pending.items():
+            device = self.registry.get(device_id)
+            rows.append((day, device_id, device.room if device is not None else None, wh, seconds))
+        return rows
+
+    def unflushed(self, now=None):
+        """尚未写库的累计值（仍在通电的区间算到 now），不改变内部状态；返回 (date, device_id, room, Wh, 秒数) 行"""
+        now = time.time() if now is None else now
+        with self._lock:
+            pending = {key: list(totals) for key, totals in self._pending.items()}
+            for device_id, (start, power) in self._on_since.items():
+                if now > start:
+                    self._accrue(device_id, start, now, power, pending)
+        return self._rows(pending)
+
+    def query(self, query, now=None):
+        """执行数据库查询 query()，同时取得尚未写库的累计值，返回 (查询结果, 未写库行)；
+        两者在写库锁内读取，一份能耗要么已在数据库中，要么在未写库行中"""
+        with self._flush_lock:
+            return query(), self.unflushed(now)
+
+    def flush(self, now=None):
+        """结算并批量写入日累计，返回写入的行数"""
+        with self._flush_lock:
+            self.checkpoint(now)
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return 0
+
+            rows = self._rows(pending)
+            try:
+                self.db.save_energy_totals(rows)
+            except Exception:
+                # 写库失败时放回内存，下次一起写入
+                with self._lock:
+                    for key, (wh, seconds) in pending.items():
+                        totals = self._pending.setdefault(key, [0.0, 0.0])
+                        totals[0] += wh
+                        totals[1] += seconds
+                raise
+        for _, _, room, wh, _ in rows:
+            ENERGY_WH.labels(room=room or "").inc(wh)
+        ENERGY_FLUSHES.inc()
+        return len(rows)
+
+    def start(self):
+        """启动后台定时写库线程"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """停止后台线程并写入剩余的累计值"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+            self._thread = None
+        self.flush()
+
+    def _loop(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"能耗统计写库出错: {e}")
@@ -0,0 +1,50 @@
+# event_stream.py
+import json
+import threading
+from collections import deque
+
+class EventHub:
+    """SSE事件中心：后台循环发布增量事件，每个连接按 Last-Event-ID 读取"""
+    
+    def __init__(self, history_size=256):
+        self._events = deque(maxlen=history_size)  # (id, event, data)
+        self._condition = threading.Condition()
+        self._last_id = 0
+    
+    @property
+    def last_id(self):
+        return self._last_id
+    
+    def publish(self, event, data):
+        """发布一个事件并唤醒所有等待的连接，返回事件ID"""
+        payload = json.dumps(data, ensure_ascii=False)
+        with self._condition:
+            self._last_id += 1
+            self._events.append((self._last_id, event, payload))
+            self._condition.notify_all()
+            return self._last_id
+    
+    def events_since(self, last_id):
+        """返回ID大于last_id的事件；历史已被覆盖（断线太久）时返回None"""
+        with self._condition:
+            return self._collect(last_id)
+    
+    def wait_for_events(self, last_id, timeout=15):
+        """阻塞等待新事件，超时返回空列表；历史已被覆盖时返回None"""
+        with self._condition:
+            if self._last_id <= last_id:
+                self._condition.wait(timeout)
+            return self._collect(last_id)
+    
+    def _collect(self, last_id):
+        if last_id > self._last_id:
+            return None
+        if last_id == self._last_id:
+            return []
+        if not self._events or self._events[0][0] > last_id + 1:
+            return None
+        return [e for e in self._events if e[0] > last_id]
+
+def format_sse(event_id, event, payload):
+    """按SSE协议格式化一条消息"""
+    return f"id: {event_id}\nevent: {event}\ndata: {payload}\n\n"
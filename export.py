@@ -0,0 +1,238 @@
+# export.py
+"""传感器历史数据列式导出：按 (timestamp, id) 顺序流式读取，按天和传感器类型分区写入
+
+    python export.py --out exports/2026-09 --start 2026-09-01 --end 2026-10-01
+    python export.py --out exports/co2 --sensor-type co2 --format npz
+
+Parquet（需要 pyarrow）：<out>/date=YYYY-MM-DD/sensor_type=<类型>/part-00000.parquet，
+每 chunk_size 行一个行组；没有 pyarrow 时写 NumPy .npz（压缩），每 chunk_size 行一个文件。
+内存占用只与 chunk_size 和当天的传感器类型数有关，与导出总行数无关。
+"""
+import argparse
+import json
+import os
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import metrics
+
+try:
+    import numpy as np
+except ImportError:  # 列式导出需要NumPy
+    np = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # 没有pyarrow时使用npz格式
+    pa = None
+    pq = None
+
+EXPORT_ROWS = metrics.counter("smart_classroom_export_rows_total", "列式导出的行数", ("format",))
+
+# 列名 -> (NumPy类型, Arrow类型名)；sensor_type 和日期是分区键，不重复存储
+SCHEMA = (
+    ("id", "int64", "int64"),
+    ("timestamp", "datetime64[us]", "timestamp[us]"),
+    ("device_id", "str", "string"),
+    ("value", "float64", "float64"),
+    ("unit", "str", "string"),
+)
+
+def available_formats():
+    formats = []
+    if pq is not None:
+        formats.append("parquet")
+    if np is not None:
+        formats.append("npz")
+    return formats
+
+def _columns(rows):
+    """把一批 (id, timestamp, device_id, value, unit) 行转换成带类型的NumPy列"""
+    ids, timestamps, devices, values, units = zip(*rows)
+    return {
+        "id": np.array(ids, dtype=np.int64),
+        "timestamp": np.array(timestamps, dtype="datetime64[us]"),
+        "device_id": np.array([d or "" for d in devices], dtype=str),
+        "value": np.array([np.nan if v is None else v for v in values], dtype=np.float64),
+        "unit": np.array([u or "" for u in units], dtype=str),
+    }
+
+class _Partition:
+    """一个 (日期, 传感器类型) 分区：缓冲最多 chunk_size 行，满了就写出一块"""
+
+    def __init__(self, directory, fmt, chunk_size, compression):
+        self.directory = directory
+        self.fmt = fmt
+        self.chunk_size = chunk_size
+        self.compression = compression
+        self.rows = []
+        self.files = []
+        self.row_count = 0
+        self._writer = None
+        os.makedirs(directory, exist_ok=True)
+
+    def add(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        columns = _columns(self.rows)
+        count = len(self.rows)
+        self.rows = []
+        if self.fmt == "parquet":
+            table = pa.table({name: pa.array(columns[name], type=pa.type_for_alias(arrow_type))
+                              for name, _, arrow_type in SCHEMA})
+            if self._writer is None:
+                path = os.path.join(self.directory, "part-00000.parquet")
+                self._writer = pq.ParquetWriter(path, table.schema, compression=self.compression)
+                self.files.append(path)
+            self._writer.write_table(table, row_group_size=self.chunk_size)
+        else:
+            path = os.path.join(self.directory, f"part-{len(self.files):05d}.npz")
+            np.savez_compressed(path, **columns)
+            self.files.append(path)
+        self.row_count += count
+        EXPORT_ROWS.labels(format=self.fmt).inc(count)
+
+    def close(self):
+        self.flush()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+def export_history(db, out_dir, start=None, end=None, sensor_type=None, fmt="auto",
+                   chunk_size=100000, compression="zstd", progress=None):
+    """把 sensor_data 导出成按天/传感器类型分区的列式文件，返回清单（也写入 manifest.json）
+    progress(rows) 每写出一块调用一次"""
+    if np is None:
+        raise RuntimeError("列式导出需要安装NumPy")
+    if fmt == "auto":
+        fmt = "parquet" if pq is not None else "npz"
+    if fmt not in available_formats():
+        raise ValueError(f"不支持的导出格式: {fmt}（可用: {', '.join(available_formats())}）")
+
+    started = time.time()
+    partitions = {}  # sensor_type -> _Partition，只保留当天的分区
+    finished = []
+    current_day = None
+    total = 0
+
+    def close_day():
+        for partition in partitions.values():
+            partition.close()
+            finished.append(partition)
+        partitions.clear()
+
+    # 按时间顺序读取：同一天的数据连续出现，换天时关闭前一天的所有分区
+    for row_id, timestamp, device_id, row_type, value, unit in db.iter_history(
+            sensor_type=sensor_type, start=start, end=end, chunk_size=chunk_size):
+        day = timestamp[:10]
+        if day != current_day:
+            close_day()
+            current_day = day
+        partition = partitions.get(row_type)
+        if partition is None:
+            directory = os.path.join(out_dir, f"date={day}", f"sensor_type={row_type}")
+            partition = partitions[row_type] = _Partition(directory, fmt, chunk_size, compression)
+        partition.add((row_id, timestamp, device_id, value, unit))
+        total += 1
+        if progress is not None and total % chunk_size == 0:
+            progress(total)
+    close_day()
+
+    manifest = {
+        "format": fmt,
+        "compression": compression if fmt == "parquet" else "deflate",
+        "schema": {name: (arrow_type if fmt == "parquet" else numpy_type)
+                   for name, numpy_type, arrow_type in SCHEMA},
+        "partition_keys": ["date", "sensor_type"],
+        "start": str(start) if start is not None else None,
+        "end": str(end) if end is not None else None,
+        "sensor_type": sensor_type,
+        "rows": total,
+        "files": [
+            {"path": os.path.relpath(path, out_dir), "rows": partition.row_count}
+            for partition in finished for path in partition.files
+        ],
+        "elapsed_s": round(time.time() - started, 3),
+    }
+    os.makedirs(out_dir, exist_ok=True)
+    with open(os.path.join(out_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return manifest
+
+class ExportJobs:
+    """后台导出任务（API使用）：每个任务一个线程，输出到 base_dir/<任务id>"""
+
+    def __init__(self, db, base_dir="data/exports", max_running=1):
+        self.db = db
+        self.base_dir = base_dir
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._slots = threading.Semaphore(max_running)
+
+    def submit(self, **options):
+        job_id = uuid.uuid4().hex[:12]
+        job = {
+            "id": job_id,
+            "status": "queued",
+            "options": options,
+            "rows": 0,
+            "out_dir": os.path.join(self.base_dir, job_id),
+            "created_at": datetime.now().isoformat(),
+        }
+        with self._lock:
+            self._jobs[job_id] = job
+        threading.Thread(target=self._run, args=(job,), daemon=True).start()
+        return dict(job)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def _run(self, job):
+        # 同时运行的导出任务数受限，避免和写入管道争抢磁盘
+        with self._slots:
+            job["status"] = "running"
+
+            def progress(rows):
+                job["rows"] = rows
+
+            try:
+                manifest = export_history(self.db, job["out_dir"], progress=progress, **job["options"])
+            except Exception as e:
+                job["status"] = "failed"
+                job["error"] = str(e)
+                return
+            job["rows"] = manifest["rows"]
+            job["files"] = len(manifest["files"])
+            job["status"] = "done"
+            job["finished_at"] = datetime.now().isoformat()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="传感器历史数据列式导出（Parquet/npz）")
+    parser.add_argument("--db", default="data/sensor_data.db")
+    parser.add_argument("--out", required=True, help="输出目录")
+    parser.add_argument("--start", help="起始时间（含），如 2026-09-01")
+    parser.add_argument("--end", help="结束时间（不含）")
+    parser.add_argument("--sensor-type")
+    parser.add_argument("--format", default="auto", choices=("auto", "parquet", "npz"))
+    parser.add_argument("--chunk-size", type=int, default=100000, help="每个行组/文件的最大行数")
+    parser.add_argument("--compression", default="zstd", help="Parquet压缩算法")
+    args = parser.parse_args()
+
+    from database import Database
+    database = Database(args.db, flush_interval=0)
+    result = export_history(database, args.out, start=args.start, end=args.end,
+                            sensor_type=args.sensor_type, fmt=args.format,
+                            chunk_size=args.chunk_size, compression=args.compression,
+                            progress=lambda rows: print(f"已导出 {rows} 行", flush=True))
+    database.close()
+    print(json.dumps({k: v for k, v in result.items() if k != "files"}, ensure_ascii=False, indent=2))
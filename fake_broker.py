@@ -0,0 +1,96 @@
+# fake_broker.py
+import threading
+
+def topic_matches(topic_filter, topic):
+    """MQTT主题通配符匹配（支持 + 和 #）"""
+    filter_parts = topic_filter.split("/")
+    topic_parts = topic.split("/")
+    for i, part in enumerate(filter_parts):
+        if part == "#":
+            return True
+        if i >= len(topic_parts):
+            return False
+        if part != "+" and part != topic_parts[i]:
+            return False
+    return len(filter_parts) == len(topic_parts)
+
+class FakeMessage:
+    __slots__ = ("topic", "payload", "qos")
+    
+    def __init__(self, topic, payload, qos=0):
+        self.topic = topic
+        self.payload = payload
+        self.qos = qos
+
+class FakeBroker:
+    """进程内模拟Broker：本地测试和压测时代替真实的MQTT Broker"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clients = []
+    
+    def client(self):
+        """创建一个连接到本Broker的客户端（接口与paho.mqtt.client.Client的常用部分一致）"""
+        return FakeClient(self)
+    
+    def _attach(self, client):
+        with self._lock:
+            if client not in self._clients:
+                self._clients.append(client)
+    
+    def _detach(self, client):
+        with self._lock:
+            if client in self._clients:
+                self._clients.remove(client)
+    
+    def publish(self, topic, payload, qos=0):
+        """把消息同步投递给所有订阅了该主题的客户端（在发布者线程中回调on_message）"""
+        if isinstance(payload, str):
+            payload = payload.encode("utf-8")
+        message = FakeMessage(topic, payload, qos)
+        with self._lock:
+            clients = list(self._clients)
+        delivered = 0
+        for client in clients:
+            if client._matches(topic) and client.on_message is not None:
+                client.on_message(client, None, message)
+                delivered += 1
+        return delivered
+
+class FakeClient:
+    def __init__(self, broker):
+        self.broker = broker
+        self.on_connect = None
+        self.on_message = None
+        self._filters = {}
+    
+    def connect(self, host=None, port=None, *args, **kwargs):
+        self.broker._attach(self)
+        if self.on_connect is not None:
+            self.on_connect(self, None, {}, 0)
+        return 0
+    
+    def disconnect(self):
+        self.broker._detach(self)
+        return 0
+    
+    def loop_start(self):
+        return 0
+    
+    def loop_stop(self, *args):
+        return 0
+    
+    def subscribe(self, topic, qos=0):
+        self._filters[topic] = qos
+        return (0, None)
+    
+    def unsubscribe(self, topic):
+        self._filters.pop(topic, None)
+        return (0, None)
+    
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        self.broker.publish(topic, payload, qos)
+        return (0, None)
+    
+    def _matches(self, topic):
+        return any(topic_matches(f, topic) for f in self._filters)
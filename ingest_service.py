@@ -0,0 +1,303 @@
+# ingest_service.py
+import argparse
+import asyncio
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from state_store import StateStore
+
+def valid_timestamp(ts):
+    """ts 是否为可用的发布时间戳：有限的数值（epoch秒），且在 datetime.fromtimestamp 的范围内"""
+    if isinstance(ts, bool) or not isinstance(ts, (int, float)) or not math.isfinite(ts):
+        return False
+    try:
+        datetime.fromtimestamp(ts)
+    except (OverflowError, OSError, ValueError):
+        return False
+    return True
+
+class IngestStats:
+    """接入统计：吞吐量与端到端延迟（发布时间戳 -> 处理完成）"""
+    
+    def __init__(self, latency_samples=100000):
+        self.received = 0
+        self.processed = 0
+        self.parse_errors = 0
+        self.unknown_devices = 0
+        self.blocked = 0  # 队列满导致网络线程等待的次数
+        self.quarantined = 0  # 被异常检测隔离、没有进入实时状态和控制的读数
+        self.latencies = deque(maxlen=latency_samples)
+        self.started_at = time.time()
+    
+    def percentile(self, p):
+        if not self.latencies:
+            return None
+        values = sorted(self.latencies)
+        return values[min(len(values) - 1, int(len(values) * p / 100))]
+    
+    def to_dict(self):
+        elapsed = max(time.time() - self.started_at, 1e-9)
+        p50, p99 = self.percentile(50), self.percentile(99)
+        return {
+            "received": self.received,
+            "processed": self.processed,
+            "parse_errors": self.parse_errors,
+            "unknown_devices": self.unknown_devices,
+            "blocked": self.blocked,
+            "quarantined": self.quarantined,
+            "throughput": round(self.processed / elapsed, 1),
+            "latency_p50_ms": None if p50 is None else round(p50 * 1000, 3),
+            "latency_p99_ms": None if p99 is None else round(p99 * 1000, 3),
+        }
+
+class IngestService:
+    """异步MQTT接入服务：
+    网络线程只负责把原始消息放入有界队列（队列满时阻塞网络线程形成背压），
+    事件循环中批量解析、异常检测，再分发到最新值存储、数据库写入管道和控制回调"""
+    
+    def __init__(self, mqtt_client, db=None, on_readings=None, queue_size=10000,
+                 batch_size=500, workers=1, state_store=None, health=None, recent=None):
+        self.mqtt_client = mqtt_client
+        self.registry = mqtt_client.devices
+        self.db = db
+        # 控制回调 on_readings(room, changed)，每批消息中读数有变化的教室各调用一次
+        self.on_readings = on_readings
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.workers = workers
+        
+        # 最新值存储（每个教室一个写时复制的快照槽位）
+        self.state = state_store or StateStore()
+        # 异常检测（anomaly.SensorHealth）：被标记的读数照常写库，但不进入实时状态和控制
+        self.health = health
+        # 最近数据的内存环形缓冲区（recent_series.RecentSeries），与数据库写入相同的读数
+        self.recent = recent
+        self.stats = IngestStats()
+        self._slots = threading.BoundedSemaphore(queue_size)
+        self._loop = None
+        self._queue = None
+        self._tasks = []
+        self._running = False
+    
+    # ============ 网络线程 ============
+    def _on_message(self, topic, payload):
+        """MQTT网络线程回调：不解析，只入队"""
+        if not self._slots.acquire(blocking=False):
+            self.stats.blocked += 1
+            self._slots.acquire()
+        self.stats.received += 1
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, (topic, payload))
+    
+    # ============ 事件循环 ============
+    async def start(self, topics=None):
+        """订阅传感器主题并启动处理协程"""
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._running = True
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self.mqtt_client.add_message_handler(self._on_message)
+        for topic in topics or self.mqtt_client.sensor_topic_filters():
+            self.mqtt_client.subscribe(topic)
+    
+    async def stop(self, drain=True):
+        """停止接入；drain为True时先处理完队列中的消息"""
+        if self._on_message in self.mqtt_client.message_handlers:
+            self.mqtt_client.message_handlers.remove(self._on_message)
+        if drain:
+            await self._queue.join()
+        self._running = False
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self.db is not None:
+            await self._loop.run_in_executor(None, self.db.flush)
+    
+    async def _worker(self):
+        queue = self._queue
+        while self._running:
+            batch = [await queue.get()]
+            while len(batch) < self.batch_size and not queue.empty():
+                batch.append(queue.get_nowait())
+            try:
+                await self._process_batch(batch)
+            except Exception as e:
+                print(f"接入处理出错: {e}")
+            finally:
+                for _ in batch:
+                    queue.task_done()
+                    self._slots.release()
+    
+    def parse_message(self, topic, payload):
+        """解析一条消息，返回 (device_id, sensor_type, room, value, unit, ts)；无法识别时返回None
+        负载可以是JSON对象 {"device_id", "sensor_type", "value", "unit", "room", "ts"}，也可以是裸数值"""
+        try:
+            data = json.loads(payload)
+        except (ValueError, UnicodeDecodeError):
+            self.stats.parse_errors += 1
+            return None
+        if not isinstance(data, dict):
+            data = {"value": data}
+        
+        device = self.registry.by_topic(topic)
+        device_id = data.get("device_id") or (device.id if device else None)
+        if device is None and device_id is not None:
+            device = self.registry.get(device_id)
+        sensor_type = data.get("sensor_type") or (device.type if device else None)
+        room = data.get("room") or (device.room if device else None)
+        value = data.get("value")
+        if device_id is None or sensor_type is None:
+            self.stats.unknown_devices += 1
+            return None
+        if not isinstance(value, (int, float)) or not math.isfinite(value):
+            self.stats.parse_errors += 1
+            return None
+        ts = data.get("ts")
+        if ts is not None and not valid_timestamp(ts):
+            self.stats.parse_errors += 1
+            return None
+        unit = data.get("unit") or (device.extra.get("unit") if device else None)
+        return device_id, sensor_type, room, value, unit, ts
+    
+    async def _process_batch(self, batch):
+        rows = []
+        updates = {}  # room -> {sensor_type: value}
+        published = []
+        health = self.health
+        now = time.time()
+        for topic, payload in batch:
+            # 逐条处理：一条读数出错只丢弃这一条，不影响同批的其他读数
+            try:
+                reading = self.parse_message(topic, payload)
+                if reading is None:
+                    continue
+                device_id, sensor_type, room, value, unit, ts = reading
+                row = (device_id, sensor_type, value, unit,
+                       datetime.fromtimestamp(ts) if ts else None)
+                if health is None or health.check(device_id, sensor_type, value, ts or now):
+                    updates.setdefault(room, {})[sensor_type] = value
+                else:
+                    self.stats.quarantined += 1
+            except Exception as e:
+                self.stats.parse_errors += 1
+                print(f"接入读数处理出错 ({topic}): {e}")
+                continue
+            rows.append(row)
+            if ts:
+                published.append(ts)
+        
+        # 数据库写入可能触发一次同步flush，放到线程池中避免阻塞事件循环
+        if self.db is not None and rows:
+            await self._loop.run_in_executor(None, self.db.save_sensor_batch, rows)
+        if self.recent is not None:
+            self.recent.extend(rows)
+        
+        # 控制回调（自动控制、数据库写入、校园汇总）可能很慢，同样放到线程池中执行；
+        # 等待它完成后再取下一批，同一教室的读数仍按到达顺序处理
+        if updates:
+            if self.on_readings is None:
+                self._dispatch(updates)
+            else:
+                await self._loop.run_in_executor(None, self._dispatch, updates)
+        
+        done = time.time()
+        self.stats.processed += len(rows)
+        self.stats.latencies.extend(done - ts for ts in published)
+    
+    def _dispatch(self, updates):
+        """把一批读数合并到最新值存储，对读数有变化的教室调用控制回调"""
+        for room, values in updates.items():
+            changed = self.state.update(room, values)
+            if changed and self.on_readings is not None:
+                try:
+                    self.on_readings(room, changed)
+                except Exception as e:
+                    print(f"控制回调出错 ({room}): {e}")
+
+def run_in_thread(service, topics=None):
+    """在独立线程中运行接入服务的事件循环（供Flask等同步程序使用），返回事件循环"""
+    loop = asyncio.new_event_loop()
+    started = threading.Event()
+    
+    def runner():
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(service.start(topics))
+        started.set()
+        loop.run_forever()
+    
+    threading.Thread(target=runner, daemon=True).start()
+    started.wait()
+    return loop
+
+# ============ 压测 ============
+async def benchmark(messages=100000, rate=10000, rooms=100, with_db=True):
+    """用进程内模拟Broker按指定速率发布消息，报告持续吞吐量和端到端延迟"""
+    from database import Database
+    from device_registry import DeviceRegistry
+    from fake_broker import FakeBroker
+    from mqtt_client import MQTTClient
+    
+    broker = FakeBroker()
+    client = MQTTClient(registry=DeviceRegistry(), client=broker.client())
+    client.connect()
+    
+    db = None
+    if with_db:
+        tmpdir = tempfile.mkdtemp()
+        db = Database(os.path.join(tmpdir, "ingest_bench.db"))
+    
+    service = IngestService(client, db=db)
+    await service.start(["sensor/#"])
+    
+    sensor_types = ("temperature", "humidity", "light", "co2", "pir")
+    
+    def publish():
+        interval = 1.0 / rate
+        next_at = time.perf_counter()
+        for i in range(messages):
+            room = f"room{i % rooms:04d}"
+            sensor_type = sensor_types[i % len(sensor_types)]
+            payload = json.dumps({
+                "device_id": f"{room}-{sensor_type}",
+                "sensor_type": sensor_type,
+                "room": room,
+                "value": i % 1000,
+                "ts": time.time(),
+            })
+            broker.publish(f"sensor/{room}/{sensor_type}", payload)
+            next_at += interval
+            delay = next_at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+    
+    started = time.time()
+    service.stats.started_at = started
+    publisher = threading.Thread(target=publish)
+    publisher.start()
+    while publisher.is_alive():
+        await asyncio.sleep(0.05)
+    await service.stop()
+    elapsed = time.time() - started
+    
+    result = service.stats.to_dict()
+    result["target_rate"] = rate
+    result["elapsed_s"] = round(elapsed, 3)
+    if db is not None:
+        db.close()
+    return result
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="MQTT接入服务压测（进程内模拟Broker）")
+    parser.add_argument("--messages", type=int, default=100000)
+    parser.add_argument("--rate", type=int, default=10000, help="目标发布速率（条/秒）")
+    parser.add_argument("--rooms", type=int, default=100)
+    parser.add_argument("--no-db", action="store_true", help="不写数据库，只测接入路径")
+    args = parser.parse_args()
+    
+    report = asyncio.run(benchmark(args.messages, args.rate, args.rooms, not args.no_db))
+    print(json.dumps(report, ensure_ascii=False, indent=2))
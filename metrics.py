@@ -0,0 +1,254 @@
+# metrics.py
+import bisect
+import functools
+import os
+import threading
+import time
+
+# 设置环境变量 SMART_CLASSROOM_METRICS=0 可关闭指标：
+# 导入时关闭则计时装饰器直接返回原函数（零开销），运行时关闭则只多一次布尔判断
+_enabled = os.environ.get("SMART_CLASSROOM_METRICS", "1") != "0"
+
+def enabled():
+    return _enabled
+
+def set_enabled(value):
+    global _enabled
+    _enabled = bool(value)
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+class _Metric:
+    type = None
+    
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children = {}
+        if not self.labelnames:
+            self.labels()
+    
+    def labels(self, **labels):
+        """按标签取子指标（同一组标签返回同一个对象，可在导入时缓存）"""
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+    
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for key, child in sorted(self._children.items()):
+            lines.extend(child._render(self.name, self.labelnames, key))
+        return lines
+
+# 子指标的 += 是读-改-写，Flask请求线程和后台线程并发更新时会丢失增量，每个子指标一把锁
+class _CounterChild:
+    __slots__ = ("value", "_lock")
+    
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+    
+    def inc(self, amount=1):
+        if _enabled:
+            with self._lock:
+                self.value += amount
+    
+    def _render(self, name, labelnames, key):
+        return [f"{name}{_format_labels(labelnames, key)} {_format_value(self.value)}"]
+
+class Counter(_Metric):
+    type = "counter"
+    _new_child = _CounterChild
+    
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+class _GaugeChild:
+    __slots__ = ("value", "function", "_lock")
+    
+    def __init__(self):
+        self.value = 0
+        self.function = None
+        self._lock = threading.Lock()
+    
+    def set(self, value):
+        if _enabled:
+            self.value = value
+    
+    def inc(self, amount=1):
+        if _enabled:
+            with self._lock:
+                self.value += amount
+    
+    def dec(self, amount=1):
+        if _enabled:
+            with self._lock:
+                self.value -= amount
+    
+    def set_function(self, function):
+        """抓取时调用 function() 取值（如队列长度），热点路径无需更新"""
+        self.function = function
+    
+    def _render(self, name, labelnames, key):
+        value = self.value
+        if self.function is not None:
+            try:
+                value = self.function()
+            except Exception:
+                value = float("nan")
+        return [f"{name}{_format_labels(labelnames, key)} {_format_value(value)}"]
+
+class Gauge(_Metric):
+    type = "gauge"
+    _new_child = _GaugeChild
+    
+    def set(self, value):
+        self.labels().set(value)
+    
+    def set_function(self, function):
+        self.labels().set_function(function)
+
+class _HistogramChild:
+    __slots__ = ("buckets", "counts", "sum", "count", "_lock")
+    
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+    
+    def observe(self, value):
+        if not _enabled:
+            return
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+    
+    def time(self):
+        return _Timer(self)
+    
+    def _render(self, name, labelnames, key):
+        # 在锁内取一致的快照，保证各桶之和等于 _count
+        with self._lock:
+            counts = list(self.counts)
+            total = self.sum
+            observed = self.count
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            labels = _format_labels(labelnames, key, ("le", _format_value(float(bound))))
+            lines.append(f"{name}_bucket{labels} {cumulative}")
+        labels = _format_labels(labelnames, key)
+        lines.append(f"{name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{name}_count{labels} {observed}")
+        return lines
+
+class Histogram(_Metric):
+    type = "histogram"
+    
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.bucket_bounds = tuple(sorted(buckets))
+        super().__init__(name, help, labelnames)
+    
+    def _new_child(self):
+        return _HistogramChild(self.bucket_bounds)
+    
+    def observe(self, value):
+        self.labels().observe(value)
+    
+    def time(self):
+        return self.labels().time()
+
+class _Timer:
+    """计时上下文管理器：with HISTOGRAM.time(): ..."""
+    __slots__ = ("histogram", "start")
+    
+    def __init__(self, histogram):
+        self.histogram = histogram
+    
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+    
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+def timed(histogram):
+    """计时装饰器；导入时已关闭指标则直接返回原函数"""
+    def decorator(func):
+        if not _enabled:
+            return func
+        
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+    
+    def register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+    
+    def render(self):
+        """Prometheus文本格式（text/plain; version=0.0.4）"""
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+REGISTRY = MetricsRegistry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def counter(name, help, labelnames=()):
+    return REGISTRY.register(Counter(name, help, labelnames))
+
+def gauge(name, help, labelnames=()):
+    return REGISTRY.register(Gauge(name, help, labelnames))
+
+def histogram(name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return REGISTRY.register(Histogram(name, help, labelnames, buckets))
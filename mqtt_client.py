@@ -1,30 +1,93 @@
 # src/mqtt_client.py 顶部添加
+import threading
 
-# 设备配置
-DEVICES_CONFIG = {
-    "sensors": [
-        {"id": "temp1", "type": "temperature", "location": "front", "mqtt_topic": "sensor/temp1"},
-        {"id": "humi1", "type": "humidity", "location": "front", "mqtt_topic": "sensor/humi1"},
-        {"id": "light_sensor1", "type": "light", "location": "window", "mqtt_topic": "sensor/light1"},
-        {"id": "co2_sensor1", "type": "co2", "location": "middle", "mqtt_topic": "sensor/co2_1"},
-        {"id": "pir1", "type": "pir", "location": "door", "mqtt_topic": "sensor/pir1"}
-    ],
-    "actuators": [
-        {"id": "light1", "type": "light", "location": "front", "mqtt_topic": "control/light1"},
-        {"id": "fan1", "type": "fan", "location": "back", "mqtt_topic": "control/fan1"},
-        {"id": "curtain1", "type": "curtain", "location": "window", "mqtt_topic": "control/curtain1"},
-        {"id": "ac1", "type": "ac", "location": "side", "mqtt_topic": "control/ac1"}
-    ]
-}
+try:
+    import paho.mqtt.client as mqtt
+except ImportError:  # 没有安装paho时仍可使用进程内的模拟Broker
+    mqtt = None
 
-# 在MQTTClient类中添加设备管理
+from device_registry import default_registry
+from fake_broker import topic_matches
+
+def create_paho_client():
+    """创建paho客户端，兼容paho-mqtt 1.x与2.x"""
+    if mqtt is None:
+        raise RuntimeError("需要安装 paho-mqtt，或传入 fake_broker.FakeBroker().client()")
+    if hasattr(mqtt, "CallbackAPIVersion"):
+        return mqtt.Client(mqtt.CallbackAPIVersion.VERSION1)
+    return mqtt.Client()
+
+# 在MQTTClient类中添加设备管理（设备配置统一来自 config/config.json）
 class MQTTClient:
-    def __init__(self):
-        self.client = mqtt.Client()
-        self.devices = DEVICES_CONFIG
+    def __init__(self, registry=None, client=None, host="localhost", port=1883):
+        self.client = client or create_paho_client()
+        self.host = host
+        self.port = port
+        self.devices = registry or default_registry()
         self.sensor_data = {}  # 存储最新数据
         self.actuator_status = {}  # 存储设备状态
         
+        # 消息处理函数 handler(topic, payload)，在MQTT网络线程中调用
+        self.message_handlers = []
+        # 按主题过滤的处理函数 (topic_filter, handler)：匹配的消息只交给它们（如命令确认）
+        self.topic_handlers = []
+        self._subscriptions = {}
+        self._lock = threading.Lock()
+        self.client.on_connect = self._on_connect
+        self.client.on_message = self._on_message
+        
+    def connect(self):
+        """连接Broker并启动网络线程"""
+        self.client.connect(self.host, self.port)
+        self.client.loop_start()
+        
+    def disconnect(self):
+        self.client.loop_stop()
+        self.client.disconnect()
+        
+    def subscribe(self, topic, qos=0):
+        """订阅主题，断线重连后自动重新订阅"""
+        with self._lock:
+            self._subscriptions[topic] = qos
+        self.client.subscribe(topic, qos)
+        
+    def publish(self, topic, payload, qos=0):
+        return self.client.publish(topic, payload, qos)
+        
+    def add_message_handler(self, handler):
+        self.message_handlers.append(handler)
+        
+    def add_topic_handler(self, topic_filter, handler):
+        self.topic_handlers.append((topic_filter, handler))
+        
+    def sensor_topic_filters(self):
+        """根据设备配置生成传感器订阅主题，如 sensor/temp1 -> sensor/#"""
+        return sorted({d.mqtt_topic.split("/")[0] + "/#"
+                       for d in self.devices.sensors() if d.mqtt_topic})
+        
+    def ack_topic_filters(self, suffix="/ack"):
+        """执行器命令确认的订阅主题，如 control/light1 -> control/+/ack"""
+        return sorted({d.mqtt_topic.split("/")[0] + "/+" + suffix
+                       for d in self.devices.actuators() if d.mqtt_topic})
+        
+    def _on_connect(self, client, userdata, flags, rc, *args):
+        with self._lock:
+            subscriptions = list(self._subscriptions.items())
+        for topic, qos in subscriptions:
+            client.subscribe(topic, qos)
+        
+    def _on_message(self, client, userdata, msg):
+        matched = False
+        for topic_filter, handler in self.topic_handlers:
+            if topic_matches(topic_filter, msg.topic):
+                handler(msg.topic, msg.payload)
+                matched = True
+        if matched:
+            return
+        for handler in self.message_handlers:
+            handler(msg.topic, msg.payload)
+        
     def update_device_status(self, device_id, status):
         """更新设备状态"""
-        self.actuator_status[device_id] = status
\ No newline at end of file
+        self.actuator_status[device_id] = status
+        self.devices.update_status(device_id, status)
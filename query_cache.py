@@ -0,0 +1,114 @@
+# query_cache.py
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+import metrics
+from database import _to_timestamp
+
+CACHE_REQUESTS = metrics.counter("smart_classroom_query_cache_requests_total",
+                                 "查询缓存请求数", ("method", "result"))
+CACHE_EVICTIONS = metrics.counter("smart_classroom_query_cache_evictions_total",
+                                  "查询缓存淘汰的条目数", ("reason",))
+CACHE_ENTRIES = metrics.gauge("smart_classroom_query_cache_entries", "查询缓存当前条目数")
+
+# 依赖键：所有数据 / 某类传感器 / 某一天
+ANY = ("any",)
+
+class QueryCache:
+    """Database 读方法前的结果缓存：按查询参数缓存，LRU + TTL 有界；
+    写入管道提交新数据时按传感器类型和日期增加代数，依赖旧代数的结果自动失效。
+    与 Database 的同名方法签名一致，可直接替换；返回的结果是共享对象，调用方不要修改"""
+
+    def __init__(self, db, max_entries=512, ttl=30.0):
+        self.db = db
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (代数, 过期时间, 结果)
+        self._loading = {}  # key -> Event，同一查询只有一个线程访问数据库
+        self._generation = 0  # 全局代数（保留清理、重算汇总等影响全部数据的写入）
+        self._generations = {}  # 依赖键 -> 代数
+        db.add_write_listener(self.invalidate)
+        CACHE_ENTRIES.set_function(lambda: len(self._entries))
+
+    def invalidate(self, sensor_types=None, days=None):
+        """写入回调：增加受影响的传感器类型/日期的代数；都为 None 时全部失效"""
+        with self._lock:
+            if sensor_types is None and days is None:
+                self._generation += 1
+                return
+            keys = [ANY]
+            keys += [("type", sensor_type) for sensor_type in sensor_types or ()]
+            keys += [("day", day) for day in days or ()]
+            for key in keys:
+                self._generations[key] = self._generations.get(key, 0) + 1
+
+    def _token(self, dependency):
+        return self._generation, self._generations.get(dependency, 0)
+
+    def _get(self, method, key, dependency, load):
+        key = (method,) + key
+        while True:
+            with self._lock:
+                token = self._token(dependency)
+                entry = self._entries.get(key)
+                if entry is not None:
+                    if entry[0] == token and entry[1] > time.monotonic():
+                        self._entries.move_to_end(key)
+                        CACHE_REQUESTS.labels(method=method, result="hit").inc()
+                        return entry[2]
+                    del self._entries[key]
+                    CACHE_EVICTIONS.labels(reason="stale" if entry[0] != token else "ttl").inc()
+                loading = self._loading.get(key)
+                owner = loading is None
+                if owner:
+                    loading = self._loading[key] = threading.Event()
+            if not owner:
+                # 其他线程正在查询同一结果，等它完成后重新查缓存
+                loading.wait()
+                continue
+            CACHE_REQUESTS.labels(method=method, result="miss").inc()
+            try:
+                value = load()
+                with self._lock:
+                    # 查询期间有新写入时代数已变，下次读取会判为过期
+                    self._entries[key] = (token, time.monotonic() + self.ttl, value)
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+                        CACHE_EVICTIONS.labels(reason="lru").inc()
+                return value
+            finally:
+                with self._lock:
+                    del self._loading[key]
+                loading.set()
+
+    @staticmethod
+    def _type_dependency(sensor_type):
+        return ("type", sensor_type) if sensor_type else ANY
+
+    def query_recent_data(self, sensor_type=None, limit=100, start=None, end=None):
+        return self._get("query_recent_data", (sensor_type, limit, start, end),
+                         self._type_dependency(sensor_type),
+                         lambda: self.db.query_recent_data(sensor_type, limit, start, end))
+
+    def get_daily_summary(self, date=None):
+        day = _to_timestamp(date if date is not None else datetime.now().date())[:10]
+        return self._get("get_daily_summary", (day,), ("day", day),
+                         lambda: self.db.get_daily_summary(day))
+
+    def query_rollup(self, granularity="minute", sensor_type=None, start=None, end=None,
+                     device_id=None, limit=1000):
+        return self._get("query_rollup", (granularity, sensor_type, start, end, device_id, limit),
+                         self._type_dependency(sensor_type),
+                         lambda: self.db.query_rollup(granularity, sensor_type, start, end,
+                                                      device_id, limit))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "max_entries": self.max_entries, "ttl": self.ttl}
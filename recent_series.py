@@ -0,0 +1,173 @@
+# recent_series.py
+import threading
+import time
+from array import array
+from datetime import datetime
+
+import metrics
+
+RECENT_APPENDS = metrics.counter("smart_classroom_recent_series_appends_total",
+                                 "写入内存环形缓冲区的读数", ("result",))
+RECENT_MEMORY = metrics.gauge("smart_classroom_recent_series_bytes", "内存环形缓冲区占用的字节数")
+
+# 每个点 = 时间戳 double + 值 double
+BYTES_PER_POINT = 16
+
+class SeriesRing:
+    """单个传感器的定长环形缓冲区：时间戳和值各一个 array('d')，
+    内存固定为 capacity * 16 字节（另有约200字节的对象开销），写满后覆盖最旧的点。
+    只接受时间不早于最新点的读数，保证缓冲区内按时间升序"""
+    __slots__ = ("capacity", "times", "values", "head", "size")
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.times = array("d", bytes(8 * capacity))
+        self.values = array("d", bytes(8 * capacity))
+        self.head = 0  # 下一个写入位置
+        self.size = 0
+
+    def append(self, ts, value):
+        if self.size and ts < self.times[(self.head - 1) % self.capacity]:
+            return False
+        self.times[self.head] = ts
+        self.values[self.head] = value
+        self.head = (self.head + 1) % self.capacity
+        if self.size < self.capacity:
+            self.size += 1
+        return True
+
+    def _physical(self, i):
+        """逻辑下标（0为最旧）-> 数组下标"""
+        return (self.head - self.size + i) % self.capacity
+
+    def oldest(self):
+        return self.times[self._physical(0)] if self.size else None
+
+    def _lower_bound(self, ts):
+        """第一个时间 >= ts 的逻辑下标（二分查找）"""
+        low, high = 0, self.size
+        while low < high:
+            mid = (low + high) // 2
+            if self.times[self._physical(mid)] < ts:
+                low = mid + 1
+            else:
+                high = mid
+        return low
+
+    def _slice(self, data, first, last):
+        """逻辑区间 [first, last) 的数据，回绕时拼接两段"""
+        start = self._physical(first)
+        count = last - first
+        if start + count <= self.capacity:
+            return data[start:start + count]
+        return data[start:] + data[:start + count - self.capacity]
+
+    def range(self, start=None, end=None):
+        """[start, end) 内的 (时间戳数组, 值数组)"""
+        first = 0 if start is None else self._lower_bound(start)
+        last = self.size if end is None else self._lower_bound(end)
+        if last <= first:
+            return array("d"), array("d")
+        return self._slice(self.times, first, last), self._slice(self.values, first, last)
+
+    def last(self, n):
+        first = max(0, self.size - n)
+        return self._slice(self.times, first, self.size), self._slice(self.values, first, self.size)
+
+class RecentSeries:
+    """最近一段时间的传感器数据（每个传感器一个 SeriesRing），图表和统计查询不访问数据库。
+    内存上限 = 传感器数 * capacity * 16 字节，如默认 4320 点（5秒一次约6小时）每个传感器约68KB"""
+
+    def __init__(self, capacity=4320, registry=None):
+        self.capacity = capacity
+        self.registry = registry
+        self._lock = threading.Lock()
+        self._series = {}  # device_id -> SeriesRing
+        self._types = {}  # device_id -> sensor_type
+        self._devices = {}  # (room, sensor_type) -> device_id
+        # 这个时间之后的读数都写入了缓冲区（重建起点或创建时间）
+        self.complete_since = time.time()
+        RECENT_MEMORY.set_function(self.memory_bytes)
+
+    def append(self, device_id, sensor_type, value, ts=None):
+        if value is None:
+            return
+        ts = time.time() if ts is None else ts
+        with self._lock:
+            ring = self._series.get(device_id)
+            if ring is None:
+                ring = self._series[device_id] = SeriesRing(self.capacity)
+                self._types[device_id] = sensor_type
+            accepted = ring.append(ts, value)
+        RECENT_APPENDS.labels(result="ok" if accepted else "out_of_order").inc()
+
+    def extend(self, readings):
+        """readings 为 (device_id, sensor_type, value, unit, timestamp) 序列（与 save_sensor_batch 相同）"""
+        now = time.time()
+        for device_id, sensor_type, value, _, timestamp in readings:
+            self.append(device_id, sensor_type, value, timestamp.timestamp() if timestamp else now)
+
+    def append_snapshot(self, room, values, ts=None):
+        """按教室写入一组读数，传感器由设备注册表确定；注册表中没有的传感器跳过"""
+        for sensor_type, value in values.items():
+            key = (room, sensor_type)
+            if key not in self._devices:
+                self._devices[key] = next((device.id for device in self.registry.by_room(room)
+                                           if device.kind == "sensor" and device.type == sensor_type), None)
+            if self._devices[key] is not None:
+                self.append(self._devices[key], sensor_type, value, ts)
+
+    def rebuild(self, db, seconds):
+        """启动时从数据库加载最近 seconds 秒的原始数据，返回加载的读数数"""
+        since = time.time() - seconds
+        count = 0
+        for _, timestamp, device_id, sensor_type, value, _ in db.iter_history(
+                start=datetime.fromtimestamp(since), order="asc"):
+            self.append(device_id, sensor_type, value, datetime.fromisoformat(timestamp).timestamp())
+            count += 1
+        self.complete_since = since
+        return count
+
+    def select(self, sensor_type=None, device_id=None):
+        """符合条件的 device_id 列表"""
+        with self._lock:
+            if device_id is not None:
+                return [device_id] if device_id in self._series else []
+            return [d for d, t in self._types.items() if sensor_type is None or t == sensor_type]
+
+    def covers(self, start, device_ids):
+        """缓冲区是否包含从 start 开始的全部数据（否则调用方应查询数据库）"""
+        if start < self.complete_since:
+            return False
+        with self._lock:
+            for device_id in device_ids:
+                ring = self._series[device_id]
+                if ring.size == ring.capacity and ring.oldest() > start:
+                    return False
+        return True
+
+    def window(self, device_id, start=None, end=None):
+        """[start, end) 内的 (时间戳数组, 值数组)"""
+        with self._lock:
+            return self._series[device_id].range(start, end)
+
+    def last(self, device_id, n):
+        with self._lock:
+            return self._series[device_id].last(n)
+
+    def sensor_type(self, device_id):
+        return self._types.get(device_id)
+
+    def memory_bytes(self):
+        return len(self._series) * self.capacity * BYTES_PER_POINT
+
+    def stats(self):
+        return {"sensors": len(self._series), "capacity": self.capacity,
+                "memory_bytes": self.memory_bytes(), "complete_since": self.complete_since}
+
+def summarize(values):
+    """一段数据的 count/min/max/avg"""
+    if not values:
+        return {"count": 0, "min": None, "max": None, "avg": None}
+    return {"count": len(values), "min": min(values), "max": max(values),
+            "avg": round(sum(values) / len(values), 3)}
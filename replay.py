@@ -0,0 +1,250 @@
+# replay.py
+"""历史数据回放（回测）：按时间顺序把 sensor_data 中的读数送入 ControlLogic，
+不等待、不写库，统计命令数、执行器通电时长、估算能耗和抖动（flap）次数
+
+    python replay.py --start 2026-09-01 --end 2026-10-01 --workers 4
+    python replay.py --rules new_rules.json --mode energy --room room101
+
+回放按 (教室, 日期) 分片，各片在进程池中独立执行；每天从执行器的初始状态开始
+（夜间教室无人、设备关闭），因此分片之间没有依赖。修改阈值后用 --rules 传入新的规则段，
+与默认规则的结果对比即可评估改动效果。
+"""
+import argparse
+import json
+import sqlite3
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+from app_config import load_config
+from control_logic import ControlLogic
+from device_registry import default_registry
+from energy import ACTIVE_STATUSES, rated_power
+
+class ReplayTask:
+    """一个分片：某教室某一天的回放参数（可序列化，传给工作进程）"""
+    __slots__ = ("db_path", "room", "day", "devices", "actuators", "rules", "policies", "mode",
+                 "flap_window")
+
+    def __init__(self, db_path, room, day, devices, actuators, rules, policies, mode, flap_window):
+        self.db_path = db_path
+        self.room = room
+        self.day = day
+        self.devices = devices  # 该教室的传感器 device_id 列表
+        self.actuators = actuators  # 执行器 -> (初始状态, 功率W)
+        self.rules = rules
+        self.policies = policies
+        self.mode = mode
+        self.flap_window = flap_window
+
+    def __getstate__(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
+
+def _epoch(timestamp):
+    return datetime.fromisoformat(timestamp).timestamp()
+
+def _iter_readings(task):
+    """只读连接按 (timestamp, id) 顺序流式读取该教室当天的读数"""
+    day = datetime.fromisoformat(task.day)
+    start = day.isoformat(" ")
+    end = (day + timedelta(days=1)).isoformat(" ")
+    conn = sqlite3.connect(f"file:{task.db_path}?mode=ro", uri=True)
+    try:
+        placeholders = ", ".join("?" * len(task.devices))
+        cursor = conn.execute(f'''
+            SELECT timestamp, sensor_type, value FROM sensor_data
+            WHERE timestamp >= ? AND timestamp < ? AND device_id IN ({placeholders})
+            ORDER BY timestamp, id
+        ''', (start, end, *task.devices))
+        while True:
+            rows = cursor.fetchmany(5000)
+            if not rows:
+                break
+            yield from rows
+    finally:
+        conn.close()
+
+def replay_task(task):
+    """回放一个 (教室, 日期) 分片，返回统计结果"""
+    started = time.perf_counter()
+    logic = ControlLogic(actuator_policies=task.policies, rules=task.rules)
+    logic.scene_mode = task.mode
+    day_start = _epoch(task.day)
+    day_end = day_start + 86400
+
+    status = {}  # 执行器 -> (状态, 开始时间)
+    switched = {}  # 执行器 -> 上一次被回放命令切换的时间（初始状态不算）
+    for device, (initial, _) in task.actuators.items():
+        logic.record_command(device, initial, now=day_start)
+        status[device] = (initial, day_start)
+    on_seconds = Counter()
+    commands = Counter()
+    flaps = Counter()
+
+    def apply(transitions, now):
+        for cmd in transitions:
+            device = cmd["device"]
+            previous, since = status.get(device, (None, day_start))
+            if previous in ACTIVE_STATUSES:
+                on_seconds[device] += now - since
+            # 抖动：上一次切换后 flap_window 秒内又被切换
+            if device in switched and now - switched[device] < task.flap_window:
+                flaps[device] += 1
+            switched[device] = now
+            status[device] = (cmd["command"], now)
+            commands[(device, cmd["command"])] += 1
+
+    values = {}
+    readings = 0
+    first = last = None
+    pending = set()
+    current = None
+
+    def evaluate(now):
+        if task.mode == "auto":
+            apply(logic.auto_control_changes(values, now=now, changed=pending), now)
+        else:
+            apply(logic.filter_transitions(logic.scene_mode_control(task.mode, values), now), now)
+        pending.clear()
+
+    # 同一时间戳的读数（同一个快照）合并后评估一次
+    for timestamp, sensor_type, value in _iter_readings(task):
+        if timestamp != current:
+            if pending:
+                evaluate(_epoch(current))
+            current = timestamp
+        if value is None:
+            continue
+        if values.get(sensor_type) != value:
+            values[sensor_type] = value
+            pending.add(sensor_type)
+        readings += 1
+        if first is None:
+            first = timestamp
+        last = timestamp
+    if pending:
+        evaluate(_epoch(current))
+
+    # 当天结束时仍在通电的执行器计到24点
+    for device, (state, since) in status.items():
+        if state in ACTIVE_STATUSES:
+            on_seconds[device] += day_end - since
+
+    simulated = _epoch(last) - _epoch(first) if readings else 0
+    return {
+        "room": task.room,
+        "day": task.day,
+        "readings": readings,
+        "simulated_seconds": simulated,
+        "elapsed_s": time.perf_counter() - started,
+        "commands": {f"{device}:{command}": count for (device, command), count in commands.items()},
+        "on_seconds": dict(on_seconds),
+        "energy_wh": {device: seconds * task.actuators.get(device, (None, 0))[1] / 3600
+                      for device, seconds in on_seconds.items()},
+        "flaps": dict(flaps),
+    }
+
+def _days(db_path, start, end):
+    """有数据的日期（读天汇总表，不扫描原始数据）"""
+    conditions = []
+    params = []
+    if start is not None:
+        conditions.append("bucket >= ?")
+        params.append(str(start)[:10])
+    if end is not None:
+        conditions.append("bucket < ?")
+        params.append(str(end)[:10])
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        return [row[0] for row in conn.execute(
+            f"SELECT DISTINCT bucket FROM sensor_rollup_day {where} ORDER BY bucket", params)]
+    finally:
+        conn.close()
+
+def plan_tasks(db_path="data/sensor_data.db", start=None, end=None, rooms=None, rules=None,
+               mode="auto", flap_window=300, registry=None, config=None):
+    """按 (教室, 日期) 生成回放分片；rules 缺省时使用配置文件中的规则"""
+    registry = registry or default_registry()
+    config = config if config is not None else load_config()
+    rules = rules if rules is not None else config.get("rules")
+    policies = config.get("control", {}).get("actuators", {})
+    actuators = {}
+    for actuator in registry.actuators():
+        power = rated_power(actuator.type, actuator.extra)
+        actuators[actuator.id] = (actuator.status, power)
+
+    tasks = []
+    for room in rooms or [room for room in registry.rooms() if room]:
+        devices = [device.id for device in registry.by_room(room) if device.kind == "sensor"]
+        if not devices:
+            continue
+        room_actuators = {device.id: actuators[device.id] for device in registry.by_room(room)
+                          if device.id in actuators}
+        for day in _days(db_path, start, end):
+            tasks.append(ReplayTask(db_path, room, day, devices, room_actuators, rules, policies,
+                                    mode, flap_window))
+    return tasks
+
+def merge(results):
+    """合并各分片的结果：总计 + 按教室"""
+    summary = {"readings": 0, "simulated_seconds": 0.0, "commands": Counter(), "on_seconds": Counter(),
+               "energy_wh": Counter(), "flaps": Counter()}
+    rooms = {}
+    for result in results:
+        room = rooms.setdefault(result["room"], {"days": 0, "commands": 0, "energy_wh": 0.0, "flaps": 0})
+        room["days"] += 1
+        room["commands"] += sum(result["commands"].values())
+        room["energy_wh"] += sum(result["energy_wh"].values())
+        room["flaps"] += sum(result["flaps"].values())
+        summary["readings"] += result["readings"]
+        summary["simulated_seconds"] += result["simulated_seconds"]
+        for key in ("commands", "on_seconds", "energy_wh", "flaps"):
+            summary[key].update(result[key])
+    summary = {key: dict(value) if isinstance(value, Counter) else value for key, value in summary.items()}
+    summary["total_commands"] = sum(summary["commands"].values())
+    summary["total_energy_wh"] = round(sum(summary["energy_wh"].values()), 3)
+    summary["total_flaps"] = sum(summary["flaps"].values())
+    summary["rooms"] = rooms
+    return summary
+
+def replay(tasks, workers=1):
+    """执行回放，workers>1 时用进程池；返回合并后的统计和回放倍速"""
+    started = time.perf_counter()
+    if workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(replay_task, tasks))
+    else:
+        results = [replay_task(task) for task in tasks]
+    summary = merge(results)
+    elapsed = time.perf_counter() - started
+    summary["tasks"] = len(tasks)
+    summary["elapsed_s"] = round(elapsed, 3)
+    summary["speedup"] = round(summary["simulated_seconds"] / elapsed, 1) if elapsed > 0 else None
+    return summary
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="历史数据回放：评估控制规则和场景模式")
+    parser.add_argument("--db", default="data/sensor_data.db")
+    parser.add_argument("--start", help="起始日期（含），如 2026-09-01")
+    parser.add_argument("--end", help="结束日期（不含）")
+    parser.add_argument("--room", action="append", help="只回放指定教室，可重复")
+    parser.add_argument("--rules", help="规则JSON文件（配置文件 rules 段的格式），缺省用当前配置")
+    parser.add_argument("--mode", default="auto", help="auto 或场景模式名（lecture/exam/energy）")
+    parser.add_argument("--flap-window", type=float, default=300, help="判定抖动的时间窗口（秒）")
+    parser.add_argument("--workers", type=int, default=1, help="进程数")
+    args = parser.parse_args()
+
+    rule_config = None
+    if args.rules:
+        with open(args.rules, encoding="utf-8") as f:
+            rule_config = json.load(f)
+    replay_tasks = plan_tasks(args.db, args.start, args.end, rooms=args.room, rules=rule_config,
+                              mode=args.mode, flap_window=args.flap_window)
+    print(f"回放分片: {len(replay_tasks)} 个（教室 × 日期）")
+    print(json.dumps(replay(replay_tasks, args.workers), ensure_ascii=False, indent=2))
@@ -0,0 +1,120 @@
+# retention.py
+import threading
+import time
+from datetime import datetime, timedelta
+
+import metrics
+from database import ROLLUP_TABLES
+
+RETENTION_DELETED = metrics.counter("smart_classroom_retention_deleted_rows_total",
+                                    "数据保留策略删除的行数", ("table",))
+
+# 默认策略：原始数据7天，分钟汇总90天，小时/天汇总永久保留（None表示永久）
+DEFAULT_POLICY = {"raw_days": 7, "minute_days": 90, "hour_days": None, "day_days": None}
+
+class RetentionManager:
+    """数据保留与压缩：按传感器类型分批删除过期数据，并增量回收空闲页
+    每批删除在独立的短事务中完成，批次之间暂停，避免长时间阻塞写入管道"""
+    
+    def __init__(self, db, config=None):
+        config = config or {}
+        self.db = db
+        self.default_policy = dict(DEFAULT_POLICY, **config.get("default", {}))
+        self.sensor_policies = config.get("sensor_types", {})
+        self.interval = config.get("interval", 3600)
+        self.batch_size = config.get("batch_size", 5000)
+        self.batch_pause = config.get("batch_pause", 0.05)
+        self.vacuum_pages = config.get("vacuum_pages", 2000)
+        self._stop = threading.Event()
+        self._thread = None
+    
+    def policy_for(self, sensor_type):
+        """某类传感器的保留策略（默认策略 + 按类型覆盖）"""
+        return dict(self.default_policy, **self.sensor_policies.get(sensor_type, {}))
+    
+    def run_once(self, now=None):
+        """执行一轮清理，返回各表删除的行数和回收的页数"""
+        now = now or datetime.now()
+        with self.db.writer() as conn:
+            sensor_types = [row[0] for row in conn.execute(
+                "SELECT DISTINCT sensor_type FROM sensor_rollup_day")]
+        
+        deleted = {}
+        for sensor_type in sensor_types:
+            policy = self.policy_for(sensor_type)
+            
+            if policy.get("raw_days") is not None:
+                cutoff = (now - timedelta(days=policy["raw_days"])).isoformat(" ")
+                deleted["sensor_data"] = deleted.get("sensor_data", 0) + self._delete_batches('''
+                    DELETE FROM sensor_data WHERE id IN (
+                        SELECT id FROM sensor_data
+                        WHERE sensor_type = ? AND timestamp < ?
+                        LIMIT ?
+                    )
+                ''', (sensor_type, cutoff))
+            
+            for granularity, (table, fmt) in ROLLUP_TABLES.items():
+                days = policy.get(f"{granularity}_days")
+                if days is None:
+                    continue
+                cutoff = (now - timedelta(days=days)).strftime(fmt)
+                deleted[table] = deleted.get(table, 0) + self._delete_batches(f'''
+                    DELETE FROM {table} WHERE (bucket, sensor_type, device_id) IN (
+                        SELECT bucket, sensor_type, device_id FROM {table}
+                        WHERE sensor_type = ? AND bucket < ?
+                        LIMIT ?
+                    )
+                ''', (sensor_type, cutoff))
+        
+        for table, count in deleted.items():
+            RETENTION_DELETED.labels(table=table).inc(count)
+        if any(deleted.values()):
+            self.db.notify_written()
+        
+        return {"deleted": deleted, "freed_pages": self.incremental_vacuum()}
+    
+    def _delete_batches(self, sql, params):
+        """分批删除直到没有匹配的行，返回删除总数；每批单独占用写入连接，批次之间让出给写入管道"""
+        total = 0
+        while not self._stop.is_set():
+            with self.db.writer() as conn, conn:
+                count = conn.execute(sql, (*params, self.batch_size)).rowcount
+            total += count
+            if count < self.batch_size:
+                break
+            time.sleep(self.batch_pause)
+        return total
+    
+    def incremental_vacuum(self):
+        """回收最多 vacuum_pages 个空闲页，返回回收的页数"""
+        with self.db.writer() as conn:
+            before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            # incremental_vacuum 每执行一步回收一页，executescript 会一直执行到结束
+            conn.executescript(f"PRAGMA incremental_vacuum({int(self.vacuum_pages)});")
+            # 被动检查点：把WAL写回主文件，使截断后的文件大小生效，不阻塞写入
+            conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchall()
+            after = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        return before - after
+    
+    def start(self):
+        """启动后台清理线程"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+            self._thread = None
+    
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                result = self.run_once()
+                if any(result["deleted"].values()) or result["freed_pages"]:
+                    print(f"🧹 数据清理: 删除 {result['deleted']}，回收 {result['freed_pages']} 页")
+            except Exception as e:
+                print(f"数据清理出错: {e}")
+            self._stop.wait(self.interval)
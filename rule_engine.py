@@ -0,0 +1,301 @@
+# rule_engine.py
+import operator
+import os
+import threading
+
+import metrics
+from app_config import CONFIG_PATH, load_config
+
+try:
+    import numpy as np
+except ImportError:  # 批量评估需要NumPy，单教室评估不受影响
+    np = None
+
+RULE_EVALUATIONS = metrics.counter("smart_classroom_rule_evaluations_total", "规则评估次数", ("rule",))
+RULE_MATCHES = metrics.counter("smart_classroom_rule_matches_total", "规则命中次数", ("rule",))
+RULE_RELOADS = metrics.counter("smart_classroom_rule_reloads_total", "规则热加载次数", ("result",))
+
+# 命令编码（兼容保留；批量接口的结果是规则编号，见 RulePlan.evaluate_batch）
+CMD_NONE = 0
+CMD_ON = 1
+CMD_OFF = 2
+CMD_OPEN = 3
+CMD_CLOSE = 4
+COMMAND_NAMES = {CMD_ON: "on", CMD_OFF: "off", CMD_OPEN: "open", CMD_CLOSE: "close"}
+COMMAND_CODES = {name: code for code, name in COMMAND_NAMES.items()}
+
+OPERATORS = {
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "==": operator.eq,
+    "!=": operator.ne,
+}
+
+# 滞回带宽的方向：命令会改变设备状态时，阈值向更难触发的方向移动
+BAND_SIGN = {"<": -1, "<=": -1, ">": 1, ">=": 1, "==": 0, "!=": 0}
+
+# 配置文件没有 rules 段时使用的默认规则（与原先硬编码的阈值一致）
+DEFAULT_RULES = {
+    # 读数缺失时的默认值，未列出的传感器默认为0
+    "defaults": {"temperature": 25},
+    # 自动控制：每个设备一组规则，按顺序评估，第一条满足的规则生效
+    "auto": [
+        {"device": "light1", "rules": [
+            {"command": "on", "all": [["light", "<", 300], ["pir", "==", 1]],
+             "reason": "光照不足且有人"},
+            {"command": "off", "any": [["light", ">", 500], ["pir", "==", 0]],
+             "reason": "光照充足或无人"},
+        ]},
+        {"device": "fan1", "rules": [
+            {"command": "on", "all": [["co2", ">", 1000]], "reason": "CO2浓度过高"},
+            {"command": "off", "all": [["co2", "<", 800]], "reason": "CO2浓度正常"},
+        ]},
+        {"device": "ac1", "rules": [
+            {"command": "on", "all": [["temperature", ">", 26]], "params": {"temp": 25},
+             "reason": "温度过高"},
+            {"command": "off", "all": [["temperature", "<", 22]], "reason": "温度适宜"},
+        ]},
+        {"device": "curtain1", "rules": [
+            {"command": "close", "all": [["light", ">", 800]], "reason": "光线过强"},
+            {"command": "open", "all": [["light", "<", 200]], "reason": "需要更多光线"},
+        ]},
+    ],
+    # 场景模式：满足条件（没有条件即总是满足）的命令全部下发
+    "scenes": {
+        "lecture": [
+            {"device": "light1", "command": "on"},
+            {"device": "ac1", "command": "on", "params": {"temp": 24}},
+        ],
+        "exam": [
+            {"device": "light1", "command": "on"},
+            {"device": "fan1", "command": "off"},
+        ],
+        "energy": [
+            {"device": "light1", "command": "off", "all": [["pir", "==", 0]]},
+            {"device": "ac1", "command": "off", "all": [["pir", "==", 0]]},
+            {"device": "fan1", "command": "off", "all": [["pir", "==", 0]]},
+        ],
+    },
+}
+
+class Rule:
+    """编译后的单条规则：条件为 (传感器, 缺省值, 比较函数, 阈值, 带宽方向) 元组"""
+    __slots__ = ("id", "device", "command", "conditions", "match_any", "command_dict",
+                 "sensors", "_evaluations", "_matches")
+
+    def __init__(self, id, device, command, conditions, match_any, command_dict):
+        self.id = id
+        self.device = device
+        self.command = command
+        self.conditions = conditions
+        self.match_any = match_any
+        self.command_dict = command_dict
+        self.sensors = frozenset(condition[0] for condition in conditions)
+        self._evaluations = RULE_EVALUATIONS.labels(rule=id)
+        self._matches = RULE_MATCHES.labels(rule=id)
+
+    def test(self, values, band=0):
+        """单教室评估；band 为该设备当前的滞回带宽"""
+        self._evaluations.inc()
+        result = not self.match_any
+        for sensor, default, compare, threshold, sign in self.conditions:
+            if compare(values.get(sensor, default), threshold + sign * band):
+                if self.match_any:
+                    result = True
+                    break
+            elif not self.match_any:
+                result = False
+                break
+        if result:
+            self._matches.inc()
+        return result
+
+    def test_batch(self, columns, band=0):
+        """批量评估，返回布尔数组；band 为滞回带宽，可以是标量或每个教室一个值的数组"""
+        masks = [compare(columns[sensor], threshold + sign * band)
+                 for sensor, _, compare, threshold, sign in self.conditions]
+        if not masks:
+            return True
+        combine = np.logical_or if self.match_any else np.logical_and
+        return combine.reduce(masks)
+
+class RulePlan:
+    """从配置编译的评估计划：自动控制规则按设备分组，并按输入传感器建立索引，
+    读数变化时只需重新评估依赖该传感器的设备组"""
+
+    def __init__(self, config=None):
+        config = DEFAULT_RULES if config is None else config
+        self.defaults = config.get("defaults", {})
+
+        self.groups = []  # [(device, (Rule, ...)), ...]
+        by_sensor = {}
+        for group in config.get("auto", []):
+            device = group["device"]
+            rules = tuple(self._compile(rule, device, f"{device}_{rule.get('command')}")
+                          for rule in group.get("rules", []))
+            index = len(self.groups)
+            self.groups.append((device, rules))
+            for rule in rules:
+                for sensor in rule.sensors:
+                    by_sensor.setdefault(sensor, set()).add(index)
+        self.devices = tuple(device for device, _ in self.groups)
+        self.by_sensor = {sensor: frozenset(indexes) for sensor, indexes in by_sensor.items()}
+        self.by_device = {device: index for index, device in enumerate(self.devices)}
+
+        self.scenes = {
+            mode: tuple(self._compile(rule, rule.get("device"), f"scene_{mode}_{i}")
+                        for i, rule in enumerate(rules))
+            for mode, rules in config.get("scenes", {}).items()
+        }
+
+    def _compile(self, spec, device, default_id):
+        rule_id = spec.get("id", default_id)
+        command = spec.get("command")
+        if not device or not command:
+            raise ValueError(f"规则 {rule_id} 缺少 device 或 command")
+        if "all" in spec and "any" in spec:
+            raise ValueError(f"规则 {rule_id} 不能同时使用 all 和 any")
+
+        conditions = []
+        for sensor, op, threshold in spec.get("any", spec.get("all", [])):
+            if op not in OPERATORS:
+                raise ValueError(f"规则 {rule_id} 使用了不支持的比较符: {op}")
+            conditions.append((sensor, self.defaults.get(sensor, 0), OPERATORS[op],
+                               threshold, BAND_SIGN[op]))
+
+        command_dict = {"device": device, "command": command}
+        command_dict.update(spec.get("params", {}))
+        if spec.get("reason"):
+            command_dict["reason"] = spec["reason"]
+        return Rule(rule_id, device, command, tuple(conditions), "any" in spec, command_dict)
+
+    def groups_for(self, sensors=(), devices=()):
+        """依赖这些传感器或属于这些设备的规则组（按配置顺序）"""
+        indexes = set()
+        for sensor in sensors:
+            indexes.update(self.by_sensor.get(sensor, ()))
+        for device in devices:
+            if device in self.by_device:
+                indexes.add(self.by_device[device])
+        return sorted(indexes)
+
+    def evaluate(self, values, band=None, groups=None):
+        """评估自动控制规则，groups 为 None 时评估全部设备组；
+        band(device, command) 返回滞回带宽"""
+        commands = []
+        for index in (range(len(self.groups)) if groups is None else groups):
+            _, rules = self.groups[index]
+            for rule in rules:
+                if rule.test(values, band(rule.device, rule.command) if band else 0):
+                    commands.append(dict(rule.command_dict))
+                    break
+        return commands
+
+    def scene_commands(self, mode, values):
+        """场景模式下需要下发的命令"""
+        return [dict(rule.command_dict) for rule in self.scenes.get(mode, ())
+                if rule.test(values)]
+
+    def evaluate_batch(self, columns, size, band=None):
+        """批量评估：columns 为 传感器 -> 数组，返回 (len(devices), size) 的规则编号数组：
+        0 表示没有规则命中，k 表示该设备组的第k条规则（从1开始）。记录规则而不是命令名，
+        同一设备组有多条同名命令（参数或原因不同）时展开结果与单教室评估一致。
+        band(device, command) 与 evaluate 相同，返回标量或每个教室一个值的数组"""
+        if np is None:
+            raise RuntimeError("批量控制需要安装NumPy")
+        longest = max((len(rules) for _, rules in self.groups), default=0)
+        codes = np.zeros((len(self.groups), size), dtype=np.int8 if longest < 128 else np.int16)
+        full = {sensor: np.asarray(column) for sensor, column in columns.items()}
+        for row, (_, rules) in enumerate(self.groups):
+            for rule in rules:
+                for sensor, default, _, _, _ in rule.conditions:
+                    if sensor not in full:
+                        full[sensor] = np.full(size, default)
+            # 倒序写入，排在前面的规则覆盖后面的，与单教室评估的优先级一致
+            for position in range(len(rules), 0, -1):
+                rule = rules[position - 1]
+                matched = rule.test_batch(full, band(rule.device, rule.command) if band else 0)
+                codes[row][matched] = position
+        return codes
+
+    def expand_batch(self, codes, index):
+        """把批量结果中第index个教室的命令展开成单教室评估的格式"""
+        commands = []
+        for row, (_, rules) in enumerate(self.groups):
+            position = int(codes[row][index])
+            if position:
+                commands.append(dict(rules[position - 1].command_dict))
+        return commands
+
+    def rules(self):
+        for _, rules in self.groups:
+            yield from rules
+        for rules in self.scenes.values():
+            yield from rules
+
+    def stats(self):
+        """每条规则的评估/命中次数（进程启动以来，热加载后同id的计数继续累加）"""
+        return [{
+            "id": rule.id,
+            "device": rule.device,
+            "command": rule.command,
+            "evaluations": rule._evaluations.value,
+            "matches": rule._matches.value,
+        } for rule in self.rules()]
+
+class RuleReloader:
+    """规则热加载：定期检查配置文件的修改时间，变化时重新编译并替换 ControlLogic 的规则，
+    编译失败时保留旧规则"""
+
+    def __init__(self, control_logic, path=None, interval=2.0):
+        self.control_logic = control_logic
+        self.path = path or CONFIG_PATH
+        self.interval = interval
+        self._mtime = self._current_mtime()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _current_mtime(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def reload(self):
+        """立即重新加载，成功返回True"""
+        try:
+            self.control_logic.load_rules(load_config(self.path).get("rules"))
+        except Exception as e:
+            RULE_RELOADS.labels(result="error").inc()
+            print(f"规则加载失败，继续使用旧规则: {e}")
+            return False
+        RULE_RELOADS.labels(result="ok").inc()
+        return True
+
+    def check(self):
+        """配置文件有变化时重新加载，返回是否加载了新规则"""
+        mtime = self._current_mtime()
+        if mtime is None or mtime == self._mtime:
+            return False
+        self._mtime = mtime
+        return self.reload()
+
+    def start(self):
+        """启动后台监视线程"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+            self._thread = None
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            if self.check():
+                print("🔁 控制规则已重新加载")
@@ -0,0 +1,325 @@
+# scene_scheduler.py
+"""按课表自动切换场景模式：每周固定的课程时段 + 一次性的考试安排
+
+    python scene_scheduler.py --entries 100000
+
+所有待触发的切换放在一个小顶堆中（按触发时间），取下一个到期切换 O(1)、插入/弹出 O(log n)；
+后台线程睡眠到最近的触发时间，不逐个教室轮询。每周时段只保留下一次出现，触发结束后再放入下一周。
+开始前 lead_minutes 分钟提前切换（如提前开空调预冷），结束时恢复 default_scene。
+
+配置文件 timetable 段：
+    {"default_scene": "auto", "lead_minutes": 10,
+     "rooms": {"room101": {
+         "weekly": [{"day": "mon", "start": "08:00", "end": "09:40", "scene": "lecture"}],
+         "once": [{"date": "2026-11-05", "start": "14:00", "end": "16:00", "scene": "exam",
+                   "lead_minutes": 15}]}}}
+"""
+import argparse
+import heapq
+import itertools
+import json
+import threading
+import time
+from datetime import date as date_type, datetime, time as time_type, timedelta
+
+import metrics
+
+SCENE_SWITCHES = metrics.counter("smart_classroom_scene_switches_total", "课表触发的场景切换次数",
+                                 ("scene",))
+SCHEDULE_ENTRIES = metrics.gauge("smart_classroom_schedule_entries", "课表条目数")
+
+WEEKDAYS = {"mon": 0, "tue": 1, "wed": 2, "thu": 3, "fri": 4, "sat": 5, "sun": 6}
+WEEK = timedelta(days=7)
+
+def _parse_time(value):
+    return value if isinstance(value, time_type) else time_type.fromisoformat(value)
+
+def _parse_weekday(value):
+    if isinstance(value, int):
+        return value
+    return WEEKDAYS[value.lower()[:3]]
+
+class ScheduleEntry:
+    """一个课表条目：每周固定时段（weekday）或某一天（date）的 [start, end)"""
+    __slots__ = ("id", "room", "scene", "weekday", "date", "start", "end", "lead")
+
+    def __init__(self, entry_id, room, scene, start, end, weekday=None, date=None, lead=0):
+        if (weekday is None) == (date is None):
+            raise ValueError("课表条目需要 weekday（每周）或 date（一次性）之一")
+        self.id = entry_id
+        self.room = room
+        self.scene = scene
+        self.weekday = None if weekday is None else _parse_weekday(weekday)
+        self.date = None if date is None else (
+            date if isinstance(date, date_type) else date_type.fromisoformat(date))
+        self.start = _parse_time(start)
+        self.end = _parse_time(end)
+        self.lead = lead  # 提前切换的秒数
+        if self.end <= self.start:
+            raise ValueError(f"课表条目结束时间必须晚于开始时间: {start}-{end}")
+
+    def occurrence_after(self, now):
+        """第一个结束时间晚于 now 的时段 (开始, 结束)，没有时返回None"""
+        if self.date is not None:
+            day = self.date
+        else:
+            day = now.date() + timedelta(days=(self.weekday - now.weekday()) % 7)
+        begin = datetime.combine(day, self.start)
+        finish = datetime.combine(day, self.end)
+        if finish <= now:
+            if self.date is not None:
+                return None
+            begin += WEEK
+            finish += WEEK
+        return begin, finish
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "room": self.room,
+            "scene": self.scene,
+            "weekday": self.weekday,
+            "date": self.date.isoformat() if self.date else None,
+            "start": self.start.isoformat("minutes"),
+            "end": self.end.isoformat("minutes"),
+            "lead_minutes": self.lead / 60,
+        }
+
+class SceneScheduler:
+    """课表调度：on_switch(room, scene, entry) 在到期时调用（entry 为 None 表示恢复默认场景）"""
+
+    def __init__(self, config=None, on_switch=None):
+        config = config or {}
+        self.on_switch = on_switch
+        self.default_scene = config.get("default_scene", "auto")
+        self.lead_minutes = config.get("lead_minutes", 0)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._heap = []  # (触发时间, 序号, 类型, 条目id, 时段开始, 时段结束)
+        self._seq = itertools.count()
+        self._ids = itertools.count(1)
+        self._entries = {}  # 条目id -> ScheduleEntry（取消的条目从这里删除，堆中的事件惰性丢弃）
+        # room -> [(条目id, 时段开始), ...]，正在进行的时段按开始顺序排列，最后一个决定当前场景；
+        # 嵌套的短时段结束后恢复外层时段的场景，而不是默认场景
+        self._active = {}
+        self._stop = threading.Event()
+        self._thread = None
+        SCHEDULE_ENTRIES.set_function(lambda: len(self._entries))
+        self.load(config.get("rooms", {}))
+
+    def load(self, rooms, now=None):
+        """加载课表：{room: {"weekly": [{day, start, end, scene}], "once": [{date, start, end, scene}]}}"""
+        for room, timetable in rooms.items():
+            for slot in timetable.get("weekly", ()):
+                self.add(room, slot["scene"], slot["start"], slot["end"], weekday=slot["day"],
+                         lead_minutes=slot.get("lead_minutes"), now=now)
+            for slot in timetable.get("once", ()):
+                self.add(room, slot["scene"], slot["start"], slot["end"], date=slot["date"],
+                         lead_minutes=slot.get("lead_minutes"), now=now)
+
+    def add(self, room, scene, start, end, weekday=None, date=None, lead_minutes=None, now=None):
+        """增加一个课表条目，返回条目id；正在进行中的时段立即触发"""
+        lead = (self.lead_minutes if lead_minutes is None else lead_minutes) * 60
+        with self._lock:
+            entry = ScheduleEntry(next(self._ids), room, scene, start, end, weekday, date, lead)
+            self._entries[entry.id] = entry
+            self._push_occurrence(entry, now or datetime.now())
+            self._wakeup.notify()
+        return entry.id
+
+    def cancel(self, entry_id):
+        """取消课表条目；该条目设置的场景立即恢复默认"""
+        with self._lock:
+            entry = self._entries.pop(entry_id, None)
+            if entry is None:
+                return False
+            switch = self._deactivate(entry.room, lambda item: item[0] == entry_id)
+        if switch is not None:
+            self._switch(entry.room, *switch)
+        return True
+
+    def _deactivate(self, room, match):
+        """移除 room 中满足 match 的进行中时段（调用方持有锁）；当前场景因此改变时
+        返回要切换到的 (场景, 条目)——外层时段的场景，没有外层时段时为默认场景——否则返回None"""
+        stack = self._active.get(room)
+        if not stack:
+            return None
+        top = stack[-1]
+        stack[:] = [item for item in stack if not match(item)]
+        # 外层时段的条目可能已被取消
+        while stack and stack[-1][0] not in self._entries:
+            stack.pop()
+        if stack and stack[-1] == top:
+            return None
+        if not stack:
+            del self._active[room]
+            return self.default_scene, None
+        outer = self._entries[stack[-1][0]]
+        return outer.scene, outer
+
+    def _push_occurrence(self, entry, now):
+        """把条目下一次出现的开始事件放入堆（调用方持有锁）"""
+        occurrence = entry.occurrence_after(now)
+        if occurrence is None:
+            return
+        begin, finish = occurrence
+        due = max(begin.timestamp() - entry.lead, now.timestamp())
+        heapq.heappush(self._heap, (due, next(self._seq), "start", entry.id,
+                                    begin.timestamp(), finish.timestamp()))
+
+    def run_due(self, now=None):
+        """处理所有到期的事件，返回触发的场景切换数"""
+        now = time.time() if now is None else now
+        switches = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                _, _, kind, entry_id, begin, finish = heapq.heappop(self._heap)
+                entry = self._entries.get(entry_id)
+                if entry is None:
+                    continue
+                if kind == "start":
+                    self._active.setdefault(entry.room, []).append((entry_id, begin))
+                    heapq.heappush(self._heap, (finish, next(self._seq), "end", entry_id, begin, finish))
+                    switches.append((entry.room, entry.scene, entry))
+                else:
+                    # 结束的是当前时段时恢复外层时段的场景（没有则恢复默认）；之后开始的时段已经接管时不动
+                    switch = self._deactivate(entry.room, lambda item: item == (entry_id, begin))
+                    if switch is not None:
+                        switches.append((entry.room, *switch))
+                    if entry.date is None:
+                        self._push_occurrence(entry, datetime.fromtimestamp(finish))
+                    else:
+                        del self._entries[entry_id]
+        for room, scene, entry in switches:
+            self._switch(room, scene, entry)
+        return len(switches)
+
+    def _switch(self, room, scene, entry):
+        SCENE_SWITCHES.labels(scene=scene).inc()
+        if self.on_switch is not None:
+            try:
+                self.on_switch(room, scene, entry)
+            except Exception as e:
+                print(f"场景切换出错: {room} -> {scene}: {e}")
+
+    def next_due(self):
+        """最近一次切换的时间（epoch秒），没有时返回None"""
+        with self._lock:
+            return self._heap[0][0] if self._heap else None
+
+    def upcoming(self, room=None, limit=50, hours=24):
+        """未来 hours 小时内的切换，按时间排序；结束事件的 scene 是结束后实际恢复的场景
+        （仍在进行的外层时段的场景，没有外层时段时为默认场景）"""
+        until = time.time() + hours * 3600
+        with self._lock:
+            # 只取最早的 limit 个事件（不复制、排序整个堆）；时段开始后才入堆的结束事件在推演时补上
+            events = heapq.nsmallest(limit, (
+                event for event in self._heap if event[0] <= until and event[3] in self._entries
+                and (room is None or self._entries[event[3]].room == room)))
+            # 按时间顺序在进行中时段的副本上推演，得到每个结束事件之后的场景
+            seq = itertools.count()
+            stacks = {}
+            result = []
+            while events and len(result) < limit:
+                due, _, kind, entry_id, begin, finish = heapq.heappop(events)
+                entry = self._entries[entry_id]
+                stack = stacks.get(entry.room)
+                if stack is None:
+                    stack = stacks[entry.room] = list(self._active.get(entry.room, ()))
+                if kind == "start":
+                    stack.append((entry_id, begin))
+                    scene = entry.scene
+                    if finish <= until:
+                        heapq.heappush(events, (finish, next(seq), "end", entry_id, begin, finish))
+                else:
+                    stack[:] = [item for item in stack if item != (entry_id, begin)]
+                    scene = self._current_scene(stack)
+                result.append({
+                    "at": datetime.fromtimestamp(due).isoformat(timespec="seconds"),
+                    "action": kind,
+                    "scene": scene,
+                    "room": entry.room,
+                    "entry": entry.to_dict(),
+                    "slot": [datetime.fromtimestamp(begin).isoformat(timespec="minutes"),
+                             datetime.fromtimestamp(finish).isoformat(timespec="minutes")],
+                })
+            return result
+
+    def _current_scene(self, stack):
+        """进行中时段栈决定的场景：最内层未取消的时段，没有时为默认场景（调用方持有锁）"""
+        for entry_id, _ in reversed(stack):
+            entry = self._entries.get(entry_id)
+            if entry is not None:
+                return entry.scene
+        return self.default_scene
+
+    def active_scenes(self):
+        with self._lock:
+            return {room: self._entries[stack[-1][0]].scene for room, stack in self._active.items()
+                    if stack[-1][0] in self._entries}
+
+    def entries(self, room=None):
+        with self._lock:
+            return [entry.to_dict() for entry in self._entries.values() if room is None or entry.room == room]
+
+    # ============ 后台线程 ============
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        with self._lock:
+            self._wakeup.notify()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _loop(self):
+        """睡眠到最近的触发时间；新增条目时被唤醒重新计算"""
+        while not self._stop.is_set():
+            self.run_due()
+            with self._lock:
+                if self._stop.is_set():
+                    break
+                timeout = self._heap[0][0] - time.time() if self._heap else None
+                if timeout is None or timeout > 0:
+                    # 时钟调整时最多睡眠一小时后重新检查
+                    self._wakeup.wait(min(timeout, 3600) if timeout is not None else 3600)
+
+# ============ 压测 ============
+def benchmark(entries=100000, rooms=5000):
+    """加载 entries 个每周时段，测加载耗时和模拟一周内全部切换的处理速率"""
+    scheduler = SceneScheduler({"lead_minutes": 5})
+    slots = [("08:00", "09:40"), ("10:00", "11:40"), ("14:00", "15:40"), ("16:00", "17:40"), ("19:00", "20:40")]
+    now = datetime(2026, 9, 7)  # 周一
+    started = time.perf_counter()
+    for i in range(entries):
+        start, end = slots[i % len(slots)]
+        scheduler.add(f"room{i % rooms}", "lecture", start, end, weekday=(i // len(slots)) % 7, now=now)
+    load = time.perf_counter() - started
+
+    started = time.perf_counter()
+    switches = 0
+    ts = now.timestamp()
+    # 每5分钟一个tick，推进一周
+    for step in range(7 * 24 * 12):
+        switches += scheduler.run_due(ts + step * 300)
+    elapsed = time.perf_counter() - started
+    return {
+        "entries": entries,
+        "load_s": round(load, 3),
+        "switches": switches,
+        "switches_per_sec": round(switches / elapsed, 1),
+        "ticks": 7 * 24 * 12,
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="课表场景调度压测")
+    parser.add_argument("--entries", type=int, default=100000)
+    parser.add_argument("--rooms", type=int, default=5000)
+    args = parser.parse_args()
+    print(json.dumps(benchmark(args.entries, args.rooms), ensure_ascii=False, indent=2))
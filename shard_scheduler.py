@@ -0,0 +1,356 @@
+# shard_scheduler.py
+"""多进程分片控制循环：按教室id的crc32把教室分配到各个分片进程，
+每个分片每个tick执行 采集 -> 规则评估 -> 持久化，并把命令和最新读数报告给主进程
+
+    python shard_scheduler.py --rooms 5000 --shards 4 --ticks 10 --interval 0
+
+分片落后于tick截止时间时，把剩余的教室分块放入共享的窃取队列，空闲的分片取走处理；
+被窃取的教室状态随任务一起传递，处理后经主进程交还给所属分片。
+
+主进程的场景模式（set_mode）和手动命令（record_command）随下一个tick发给所属分片：
+非 auto 模式的教室只采集不执行自动规则，手动命令计入该教室的执行器状态（去重和最短驻留时间）。
+分片数超过CPU核数时进程只是轮流占用CPU，吞吐不会提高。
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import zlib
+
+import metrics
+
+SHARD_TICK_SECONDS = metrics.histogram("smart_classroom_shard_tick_seconds", "分片每个tick的耗时（秒）",
+                                       ("shard",))
+SHARD_OVERRUNS = metrics.counter("smart_classroom_shard_overruns_total", "超过tick截止时间的分片tick数",
+                                 ("shard",))
+STOLEN_CHUNKS = metrics.counter("smart_classroom_shard_stolen_chunks_total", "被其他分片窃取处理的任务块数")
+
+def shard_for(room, shards):
+    """教室所属的分片（与进程数和教室顺序无关的稳定划分）"""
+    return zlib.crc32(room.encode()) % shards
+
+class _RoomState:
+    """一个教室在分片中的状态：传感器模型、各执行器最后一次下发的命令和场景模式
+    （可序列化，随窃取任务传递）"""
+    __slots__ = ("model", "devices", "mode")
+
+    def __init__(self, model, devices=None, mode="auto"):
+        self.model = model
+        self.devices = devices if devices is not None else {}
+        self.mode = mode
+
+    def __getstate__(self):
+        return self.model, self.devices, self.mode
+
+    def __setstate__(self, state):
+        self.model, self.devices, self.mode = state
+
+class _Shard:
+    """分片进程中的工作循环"""
+
+    def __init__(self, index, rooms, inbox, results, steal_queue, steal_pending, options):
+        from control_logic import ControlLogic
+        from device_simulator import ClassroomModel
+        from rule_engine import RulePlan
+
+        self.index = index
+        self.inbox = inbox
+        self.results = results
+        self.steal_queue = steal_queue
+        # 已放入窃取队列、还没处理完的任务块数（队列由后台线程异步写入，不能只靠 Empty 判断）
+        self.steal_pending = steal_pending
+        self.chunk_size = options.get("chunk_size", 64)
+        self.steal_margin = options.get("steal_margin", 0.8)
+        self.states = {room: _RoomState(ClassroomModel(room, seed=options.get("seed", 0)))
+                       for room in rooms}
+        self.modes = {}  # 非 auto 模式的教室 -> 场景模式
+        # 一个分片共用一份编译好的规则；评估某个教室时把 device_state 指向该教室的状态
+        self.logic = ControlLogic(actuator_policies=options.get("actuator_policies"),
+                                  rules=RulePlan(options.get("rules")))
+        self.storage = None
+        if options.get("db_path"):
+            from storage import WideBackend
+            self.storage = WideBackend(options["db_path"], batch_size=options.get("batch_size", 5000))
+
+    def run(self):
+        while True:
+            message = self.inbox.get()
+            kind = message[0]
+            if kind == "stop":
+                break
+            if kind == "state":
+                # 被其他分片处理过的教室，状态交还给本分片
+                for room, state in message[1]:
+                    self.states[room] = state
+            elif kind == "tick":
+                self._tick(*message[1:])
+        if self.storage is not None:
+            self.storage.close()
+
+    def _process(self, chunk, sim_ts):
+        """处理一块教室：采集、规则评估、写库；返回 (读数, 命令)"""
+        logic = self.logic
+        readings = []
+        commands = []
+        for room, state in chunk:
+            values = state.model.step(sim_ts)
+            # 场景模式由主进程下发场景命令，这里只采集
+            if state.mode == "auto":
+                logic.device_state = state.devices
+                for command in logic.auto_control_changes(values, now=sim_ts):
+                    commands.append((room, command))
+            readings.append((room, values))
+        if self.storage is not None:
+            self.storage.write_snapshots([(None, room, values) for room, values in readings])
+        return readings, commands
+
+    def _report(self, tick, owner, chunk, readings, commands):
+        # 窃取来的教室需要把新状态带回去；自己的教室状态本来就在本进程
+        returned = [(room, state) for room, state in chunk] if owner != self.index else None
+        self.results.put(("chunk", tick, self.index, owner, len(chunk), readings, commands, returned))
+
+    def _apply_control(self, modes, manual):
+        """应用主进程转发的场景模式和手动命令（tick开始前，本分片的教室都已交还）"""
+        for room in self.modes.keys() | modes.keys():
+            if room in self.states:
+                self.states[room].mode = modes.get(room, "auto")
+        self.modes = modes
+        for room, device, command, ts in manual:
+            if room in self.states:
+                self.states[room].devices[device] = (command, ts)
+
+    def _tick(self, tick, sim_ts, deadline, modes=None, manual=()):
+        started = time.time()
+        self._apply_control(modes or {}, manual)
+        rooms = list(self.states.items())
+        chunks = [rooms[i:i + self.chunk_size] for i in range(0, len(rooms), self.chunk_size)]
+        budget = deadline - started
+        offloaded = 0
+        processed = 0
+        while chunks:
+            chunk = chunks.pop(0)
+            readings, commands = self._process(chunk, sim_ts)
+            processed += len(chunk)
+            self._report(tick, self.index, chunk, readings, commands)
+            # 按当前速度预计会超过截止时间：把剩余任务的一半放入窃取队列
+            if chunks and budget > 0:
+                elapsed = time.time() - started
+                remaining = sum(len(c) for c in chunks)
+                if elapsed + elapsed / processed * remaining > budget * self.steal_margin:
+                    half = len(chunks) // 2
+                    with self.steal_pending.get_lock():
+                        self.steal_pending.value += half
+                    for offload in chunks[len(chunks) - half:]:
+                        self.steal_queue.put((tick, self.index, sim_ts, offload))
+                    offloaded += half
+                    del chunks[len(chunks) - half:]
+        # 自己的任务做完后帮忙处理窃取队列（包括自己放进去、还没被取走的任务）
+        stolen = 0
+        while self.steal_pending.value > 0:
+            try:
+                steal_tick, owner, steal_ts, chunk = self.steal_queue.get(timeout=0.01)
+            except queue.Empty:
+                continue
+            readings, commands = self._process(chunk, steal_ts)
+            if owner == self.index:
+                # 经过队列的是副本，自己的教室直接用处理后的状态替换
+                self.states.update(chunk)
+            else:
+                stolen += 1
+            self._report(steal_tick, owner, chunk, readings, commands)
+            with self.steal_pending.get_lock():
+                self.steal_pending.value -= 1
+        elapsed = time.time() - started
+        self.results.put(("done", tick, self.index, elapsed, offloaded, stolen))
+
+def _shard_main(index, rooms, inbox, results, steal_queue, steal_pending, options):
+    _Shard(index, rooms, inbox, results, steal_queue, steal_pending, options).run()
+
+class ShardedScheduler:
+    """主进程中的调度器：启动分片进程、按周期下发tick、汇总结果并转交被窃取教室的状态
+    on_result(room, values, commands) 在主进程中对每个教室调用（可选）"""
+
+    def __init__(self, rooms, shards=None, interval=5.0, on_result=None, db_path=None,
+                 rules=None, actuator_policies=None, chunk_size=64, seed=0, start_method="spawn"):
+        self.rooms = list(rooms)
+        self.shards = shards or os.cpu_count() or 1
+        self.interval = interval
+        self.on_result = on_result
+        # spawn 会在子进程中重新导入主模块；主模块有较重的初始化时可用 fork（分片只使用自己创建的对象）
+        self.start_method = start_method
+        self.options = {"db_path": db_path, "rules": rules, "actuator_policies": actuator_policies,
+                        "chunk_size": chunk_size, "seed": seed}
+        self._room_set = set(self.rooms)
+        # 转发给分片的控制状态：每个分片 {教室: 非auto场景模式}，以及待转发的手动命令
+        self._control_lock = threading.Lock()
+        self._modes = [{} for _ in range(self.shards)]
+        self._manual = [[] for _ in range(self.shards)]
+        self.tick = 0
+        self.stats = {"ticks": 0, "rooms_processed": 0, "commands": 0, "overruns": 0,
+                      "stolen_chunks": 0, "offloaded_chunks": 0}
+        self._processes = []
+        self._inboxes = []
+
+    def start(self):
+        cpus = os.cpu_count() or 1
+        if self.shards > cpus:
+            print(f"⚠️ 分片数 {self.shards} 超过CPU核数 {cpus}，多出的分片不会提高吞吐")
+        context = multiprocessing.get_context(self.start_method)
+        self._results = context.Queue()
+        self._steal_queue = context.Queue()
+        self._steal_pending = context.Value("i", 0)
+        partitions = [[] for _ in range(self.shards)]
+        for room in self.rooms:
+            partitions[shard_for(room, self.shards)].append(room)
+        for index, rooms in enumerate(partitions):
+            inbox = context.Queue()
+            process = context.Process(target=_shard_main, daemon=True,
+                                      args=(index, rooms, inbox, self._results, self._steal_queue,
+                                            self._steal_pending, self.options))
+            process.start()
+            self._inboxes.append(inbox)
+            self._processes.append(process)
+
+    def stop(self):
+        for inbox in self._inboxes:
+            inbox.put(("stop",))
+        for process in self._processes:
+            process.join(timeout=10)
+        self._processes = []
+        self._inboxes = []
+
+    def set_mode(self, room, mode):
+        """教室的场景模式：非 auto 时所属分片从下一个tick起不再执行该教室的自动规则"""
+        if room not in self._room_set:
+            return
+        with self._control_lock:
+            modes = self._modes[shard_for(room, self.shards)]
+            if mode == "auto":
+                modes.pop(room, None)
+            else:
+                modes[room] = mode
+
+    def record_command(self, room, device, command, now=None):
+        """外部（手动或场景）下发的命令，下一个tick前计入所属分片的执行器状态"""
+        if room not in self._room_set:
+            return
+        with self._control_lock:
+            self._manual[shard_for(room, self.shards)].append(
+                (room, device, command, time.time() if now is None else now))
+
+    def run_tick(self, sim_ts=None):
+        """执行一个tick并等待所有教室处理完，返回本tick的统计"""
+        self.tick += 1
+        tick = self.tick
+        started = time.time()
+        sim_ts = started if sim_ts is None else sim_ts
+        deadline = started + self.interval
+        with self._control_lock:
+            modes = [dict(shard_modes) for shard_modes in self._modes]
+            manual, self._manual = self._manual, [[] for _ in range(self.shards)]
+        for index, inbox in enumerate(self._inboxes):
+            inbox.put(("tick", tick, sim_ts, deadline, modes[index], manual[index]))
+
+        returned = [[] for _ in range(self.shards)]
+        rooms_done = 0
+        shards_done = 0
+        commands = 0
+        result = {"tick": tick, "overruns": 0, "stolen_chunks": 0, "offloaded_chunks": 0}
+        while rooms_done < len(self.rooms) or shards_done < self.shards:
+            try:
+                message = self._results.get(timeout=1.0)
+            except queue.Empty:
+                dead = [i for i, process in enumerate(self._processes) if not process.is_alive()]
+                if dead:
+                    raise RuntimeError(f"分片进程已退出: {dead}")
+                continue
+            if message[0] == "chunk":
+                _, _, _, owner, count, readings, chunk_commands, states = message
+                rooms_done += count
+                commands += len(chunk_commands)
+                if states is not None:
+                    returned[owner].extend(states)
+                if self.on_result is not None:
+                    by_room = {}
+                    for room, command in chunk_commands:
+                        by_room.setdefault(room, []).append(command)
+                    for room, values in readings:
+                        self.on_result(room, values, by_room.get(room, ()))
+            else:
+                _, _, shard, elapsed, offloaded, stolen = message
+                shards_done += 1
+                SHARD_TICK_SECONDS.labels(shard=shard).observe(elapsed)
+                if self.interval and elapsed > self.interval:
+                    SHARD_OVERRUNS.labels(shard=shard).inc()
+                    result["overruns"] += 1
+                STOLEN_CHUNKS.inc(stolen)
+                result["stolen_chunks"] += stolen
+                result["offloaded_chunks"] += offloaded
+
+        # 下一个tick之前把被窃取教室的新状态交还给所属分片（同一队列先到先处理）
+        for owner, states in enumerate(returned):
+            if states:
+                self._inboxes[owner].put(("state", states))
+
+        result["rooms"] = rooms_done
+        result["commands"] = commands
+        result["elapsed_s"] = round(time.time() - started, 4)
+        self.stats["ticks"] += 1
+        self.stats["rooms_processed"] += rooms_done
+        self.stats["commands"] += commands
+        for key in ("overruns", "stolen_chunks", "offloaded_chunks"):
+            self.stats[key] += result[key]
+        return result
+
+    def run_forever(self, stop_event=None):
+        """按周期运行tick，直到 stop_event 被设置"""
+        while stop_event is None or not stop_event.is_set():
+            result = self.run_tick()
+            if result["elapsed_s"] > self.interval:
+                print(f"⚠️ 分片调度超时: tick {result['tick']} 耗时 {result['elapsed_s']}s")
+            time.sleep(max(0.0, self.interval - result["elapsed_s"]))
+
+def benchmark(rooms=2000, shards=None, ticks=5, interval=0.0, db_path=None):
+    """连续运行 ticks 个tick（interval=0 时不等待），返回每秒处理的教室数"""
+    scheduler = ShardedScheduler([f"room{i}" for i in range(rooms)], shards=shards,
+                                 interval=interval, db_path=db_path)
+    scheduler.start()
+    try:
+        scheduler.run_tick()  # 预热：进程启动和模块导入
+        started = time.time()
+        sim_ts = time.time()
+        for i in range(ticks):
+            scheduler.run_tick(sim_ts + 5 * (i + 1))
+        elapsed = time.time() - started
+    finally:
+        scheduler.stop()
+    return {
+        "rooms": rooms,
+        "shards": scheduler.shards,
+        "cpus": os.cpu_count(),
+        "ticks": ticks,
+        "rooms_per_sec": round(rooms * ticks / elapsed, 1),
+        "tick_ms": round(elapsed / ticks * 1000, 2),
+        "stolen_chunks": scheduler.stats["stolen_chunks"],
+        "commands": scheduler.stats["commands"],
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="多进程分片控制循环压测")
+    parser.add_argument("--rooms", type=int, default=2000)
+    parser.add_argument("--shards", default="1,2,4", help="分片数，逗号分隔，依次测试")
+    parser.add_argument("--ticks", type=int, default=5)
+    parser.add_argument("--interval", type=float, default=0.0,
+                        help="tick周期（秒），0表示不等待、用于测吞吐；大于0时启用截止时间和窃取")
+    parser.add_argument("--db", help="写入的数据库路径（默认不写库）")
+    args = parser.parse_args()
+
+    reports = [benchmark(args.rooms, int(shards), args.ticks, args.interval, args.db)
+               for shards in args.shards.split(",")]
+    # 相对第一组分片数的吞吐倍数（只有CPU核数不少于分片数时才会接近线性）
+    for report in reports:
+        report["speedup"] = round(report["rooms_per_sec"] / reports[0]["rooms_per_sec"], 2)
+    print(json.dumps(reports, ensure_ascii=False, indent=2))
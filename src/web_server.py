@@ -7,26 +7,21 @@ import random
 import threading
 from datetime import datetime
 import os
+import sys
+import atexit
 
 app = Flask(__name__)
 
 # ============ 1. 多设备管理 ============
-# 设备配置（粘贴第5步的第一个代码块）
-devices = {
-    "sensors": [
-        {"id": "temp1", "type": "temperature", "location": "front"},
-        {"id": "humi1", "type": "humidity", "location": "front"},
-        {"id": "light_sensor1", "type": "light", "location": "window"},
-        {"id": "co2_sensor1", "type": "co2", "location": "middle"},
-        {"id": "pir1", "type": "pir", "location": "door"}
-    ],
-    "actuators": [
-        {"id": "light1", "type": "light", "location": "front", "status": "off"},
-        {"id": "fan1", "type": "fan", "location": "back", "status": "off"},
-        {"id": "curtain1", "type": "curtain", "location": "window", "status": "closed"},
-        {"id": "ac1", "type": "ac", "location": "side", "status": "off"}
-    ]
-}
+# 设备配置统一来自 config/config.json（与根目录的 web_server.py 共用设备注册表）
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from device_registry import default_registry
+from storage import WideBackend
+
+devices = default_registry()
+
+# 本程序记录的教室（配置中的第一个教室）
+ROOM = next((room for room in devices.rooms() if room), "default")
 
 # 当前传感器数据
 current_sensor_data = {
@@ -59,38 +54,21 @@ def auto_control_logic(sensor_data):
 
 # ============ 3. 数据持久化 ============
 # 数据库函数（粘贴第5步的第三个代码块，但要修改参数名）
+# 宽表存储后端：data/sensor_data.db 中的 sensor_data_wide 表（与根目录 web_server.py 的窄表不冲突）
+storage = None
+
 def init_database():
     """初始化数据库"""
+    global storage
     os.makedirs('data', exist_ok=True)
-    conn = sqlite3.connect('data/sensor_data.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS sensor_data 
-        (id INTEGER PRIMARY KEY AUTOINCREMENT,
-         timestamp DATETIME,
-         temperature REAL,
-         humidity REAL,
-         light INTEGER,
-         co2 INTEGER,
-         occupancy INTEGER)
-    ''')
-    conn.commit()
-    conn.close()
+    # 每分钟（12个周期）批量提交一次，退出时写入剩余数据
+    storage = WideBackend('data/sensor_data.db', batch_size=12)
+    atexit.register(storage.close)
     print("✅ 数据库初始化完成")
 
 def save_sensor_data(data):
-    """保存传感器数据"""
-    conn = sqlite3.connect('data/sensor_data.db')
-    cursor = conn.cursor()
-    # 注意：这里修改了参数名，从 data['temp'] 改为 data['temperature']
-    cursor.execute('''
-        INSERT INTO sensor_data 
-        (timestamp, temperature, humidity, light, co2, occupancy) 
-        VALUES (?, ?, ?, ?, ?, ?)
-    ''', (datetime.now(), data['temperature'], data['humidity'], 
-          data['light'], data['co2'], data['pir']))
-    conn.commit()
-    conn.close()
+    """保存传感器数据（整行写入宽表）"""
+    storage.write_snapshots([(datetime.now(), ROOM, data)])
 
 # ============ 4. Web API路由 ============
 @app.route('/')
@@ -110,10 +88,8 @@ def get_sensor_data():
 @app.route('/api/devices')
 def get_devices():
     """获取设备列表API"""
-    return jsonify({
-        "success": True,
-        "devices": devices
-    })
+    body = '{"success": true, "devices": ' + devices.to_json() + '}'
+    return app.response_class(body, mimetype='application/json')
 
 @app.route('/api/control', methods=['POST'])
 def control_device():
@@ -124,10 +100,7 @@ def control_device():
         command = data.get('command')
         
         # 更新设备状态
-        for actuator in devices["actuators"]:
-            if actuator["id"] == device_id:
-                actuator["status"] = command
-                break
+        devices.update_status(device_id, command)
         
         return jsonify({
             "success": True,
@@ -191,10 +164,7 @@ def background_task():
                 print(f"🤖 自动控制: {cmd['device']} -> {cmd['command']}")
                 
                 # 更新设备状态
-                for actuator in devices["actuators"]:
-                    if actuator["id"] == cmd["device"]:
-                        actuator["status"] = cmd["command"]
-                        break
+                devices.update_status(cmd["device"], cmd["command"])
             
             # 5. 等待5秒
             time.sleep(5)
@@ -0,0 +1,63 @@
+# state_store.py
+import threading
+import time
+from datetime import datetime
+
+class RoomSnapshot:
+    """某个教室在某个版本的只读快照；序列化结果按快照（即按版本）缓存"""
+    __slots__ = ("room", "version", "values", "updated_at", "etag", "_cache")
+    
+    def __init__(self, room, version, values, updated_at, epoch):
+        self.room = room
+        self.version = version
+        self.values = values  # 约定只读，更新时整体替换（写时复制）
+        self.updated_at = updated_at
+        self.etag = f"{epoch:x}-{version}"
+        self._cache = {}
+    
+    def cached(self, key, builder):
+        """builder(snapshot) 的结果按 key 缓存在本快照上，同一版本只序列化一次"""
+        value = self._cache.get(key)
+        if value is None:
+            value = self._cache[key] = builder(self)
+        return value
+
+class StateStore:
+    """实时读数存储：每个教室一个最新值槽位，写时复制，读取方无需加锁"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rooms = {}  # room -> RoomSnapshot
+        self.version = 0
+        # 进程启动时间参与ETag，重启后旧的ETag不会误命中
+        self._epoch = int(time.time())
+    
+    def update(self, room, values):
+        """合并一组读数，返回实际变化的字段（无变化时不产生新版本）"""
+        with self._lock:
+            current = self._rooms.get(room)
+            old = current.values if current is not None else {}
+            changed = {k: v for k, v in values.items() if old.get(k, _MISSING) != v}
+            if not changed:
+                return changed
+            merged = dict(old)
+            merged.update(changed)
+            self.version += 1
+            self._rooms[room] = RoomSnapshot(room, self.version, merged,
+                                             datetime.now().isoformat(), self._epoch)
+            return changed
+    
+    def snapshot(self, room):
+        """教室的当前快照；教室不存在时返回空快照"""
+        snapshot = self._rooms.get(room)
+        if snapshot is None:
+            snapshot = RoomSnapshot(room, 0, {}, None, self._epoch)
+        return snapshot
+    
+    def get(self, room):
+        return self.snapshot(room).values
+    
+    def rooms(self):
+        return list(self._rooms)
+
+_MISSING = object()
@@ -0,0 +1,331 @@
+# storage.py
+"""传感器数据存储后端：窄表（每个读数一行）和宽表（每个教室每个时刻一行，每种传感器一列）
+
+    python storage.py migrate --from legacy --to narrow
+    python storage.py migrate --from narrow --to wide --start 2026-09-01 --end 2026-10-01
+
+写入方只使用 write_snapshots / query_range / iter_snapshots，切换布局不需要修改写入代码。
+Web应用的读取路径（历史、汇总表、每日摘要、导出、回放、保留策略、内存序列重建）都基于窄表
+sensor_data 及其汇总表，宽表没有对应的读取实现，因此Web应用只接受 APP_BACKENDS 中的布局；
+宽表用于分片压测的写入和离线分析。
+"""
+import argparse
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from datetime import datetime
+
+import metrics
+from database import Database, _to_timestamp, rename_legacy_wide_table
+from device_registry import default_registry
+
+STORAGE_ROWS = metrics.counter("smart_classroom_storage_snapshots_total",
+                               "存储后端写入的读数快照数", ("backend",))
+
+# Web应用可用的存储布局（读取路径完整的布局）
+APP_BACKENDS = ("narrow",)
+
+# 宽表的传感器列（与传感器类型同名）
+WIDE_COLUMNS = ("temperature", "humidity", "light", "co2", "pir")
+
+class SnapshotSource(ABC):
+    """可读取的快照数据源（迁移工具的源）：快照为 (timestamp, room, {sensor_type: value})"""
+    name = None
+
+    @abstractmethod
+    def query_range(self, sensor_type, start=None, end=None, room=None):
+        """按时间升序产出 (timestamp, room, value)"""
+
+    @abstractmethod
+    def iter_snapshots(self, start=None, end=None, room=None):
+        """按时间升序产出 (timestamp, room, {sensor_type: value})（迁移工具使用）"""
+
+class StorageBackend(SnapshotSource):
+    """存储后端接口：在数据源的读取接口之上增加批量写入"""
+
+    @abstractmethod
+    def write_snapshots(self, snapshots):
+        """批量写入读数快照"""
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.flush()
+
+class NarrowBackend(StorageBackend):
+    """窄表 sensor_data：复用 Database 的批量写入管道、索引和汇总表；
+    教室与传感器设备的对应关系来自设备注册表"""
+    name = "narrow"
+
+    def __init__(self, db, registry=None):
+        self.db = db
+        self.registry = registry or default_registry()
+        self.skipped = 0  # 注册表中找不到对应传感器的读数
+        self._devices = {}  # (room, sensor_type) -> Device
+
+    def _device_for(self, room, sensor_type):
+        key = (room, sensor_type)
+        if key not in self._devices:
+            self._devices[key] = next((device for device in self.registry.by_room(room)
+                                       if device.kind == "sensor" and device.type == sensor_type), None)
+        return self._devices[key]
+
+    def write_snapshots(self, snapshots):
+        readings = []
+        for timestamp, room, values in snapshots:
+            # 汇总表按 datetime 计算时间桶，从其他布局读出的时间字符串先转换
+            if isinstance(timestamp, str):
+                timestamp = datetime.fromisoformat(timestamp)
+            for sensor_type, value in values.items():
+                device = self._device_for(room, sensor_type)
+                if device is None:
+                    self.skipped += 1
+                    continue
+                readings.append((device.id, sensor_type, value, device.extra.get("unit"), timestamp))
+        self.db.save_sensor_batch(readings)
+        STORAGE_ROWS.labels(backend=self.name).inc(len(snapshots))
+
+    def _room_of(self, device_id):
+        device = self.registry.get(device_id)
+        return device.room if device is not None else None
+
+    def query_range(self, sensor_type, start=None, end=None, room=None):
+        device_id = None
+        if room is not None:
+            device = self._device_for(room, sensor_type)
+            if device is None:
+                return
+            device_id = device.id
+        for _, timestamp, row_device, _, value, _ in self.db.iter_history(
+                sensor_type=sensor_type, device_id=device_id, start=start, end=end):
+            yield timestamp, room or self._room_of(row_device), value
+
+    def iter_snapshots(self, start=None, end=None, room=None):
+        """同一教室同一秒内的读数合并成一个快照"""
+        pending = {}  # room -> {sensor_type: value}
+        current = None
+        for _, timestamp, device_id, sensor_type, value, _ in self.db.iter_history(start=start, end=end):
+            row_room = self._room_of(device_id)
+            if room is not None and row_room != room:
+                continue
+            second = timestamp[:19]
+            if second != current:
+                for group_room, values in pending.items():
+                    yield current, group_room, values
+                pending = {}
+                current = second
+            pending.setdefault(row_room, {})[sensor_type] = value
+        for group_room, values in pending.items():
+            yield current, group_room, values
+
+    def flush(self):
+        self.db.flush()
+
+class WideBackend(StorageBackend):
+    """宽表 sensor_data_wide：每个教室每个时刻一行，整行写入；
+    按 (room, timestamp) 和 timestamp 建索引，批量 executemany 提交"""
+    name = "wide"
+
+    def __init__(self, db_path="data/sensor_data.db", table="sensor_data_wide", batch_size=500):
+        self.db_path = db_path
+        self.table = table
+        self.batch_size = batch_size
+        self._pending = []
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        rename_legacy_wide_table(self._conn)
+        columns = ", ".join(f"{column} REAL" for column in WIDE_COLUMNS)
+        with self._conn:
+            self._conn.execute(f'''
+                CREATE TABLE IF NOT EXISTS {table} (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    timestamp DATETIME NOT NULL,
+                    room VARCHAR(50),
+                    {columns}
+                )
+            ''')
+            self._conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_room_time ON {table} (room, timestamp)")
+            self._conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_time ON {table} (timestamp)")
+
+    def write_snapshots(self, snapshots):
+        rows = [(_to_timestamp(timestamp or datetime.now()), room,
+                 *(values.get(column) for column in WIDE_COLUMNS))
+                for timestamp, room, values in snapshots]
+        with self._lock:
+            self._pending.extend(rows)
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self.flush()
+        STORAGE_ROWS.labels(backend=self.name).inc(len(rows))
+
+    def flush(self):
+        with self._lock:
+            rows, self._pending = self._pending, []
+            if not rows:
+                return
+            placeholders = ", ".join("?" * (len(WIDE_COLUMNS) + 2))
+            with self._conn:
+                self._conn.executemany(f'''
+                    INSERT INTO {self.table} (timestamp, room, {", ".join(WIDE_COLUMNS)})
+                    VALUES ({placeholders})
+                ''', rows)
+
+    def _select(self, columns, start, end, room, extra=None):
+        conditions = list(extra or [])
+        params = []
+        if room is not None:
+            conditions.append("room = ?")
+            params.append(room)
+        if start is not None:
+            conditions.append("timestamp >= ?")
+            params.append(_to_timestamp(start))
+        if end is not None:
+            conditions.append("timestamp < ?")
+            params.append(_to_timestamp(end))
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            cursor = conn.execute(f'''
+                SELECT timestamp, room, {columns} FROM {self.table}
+                {where}
+                ORDER BY timestamp, id
+            ''', params)
+            while True:
+                rows = cursor.fetchmany(1000)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            conn.close()
+
+    def query_range(self, sensor_type, start=None, end=None, room=None):
+        if sensor_type not in WIDE_COLUMNS:
+            raise ValueError(f"宽表没有传感器列: {sensor_type}")
+        yield from self._select(sensor_type, start, end, room, [f"{sensor_type} IS NOT NULL"])
+
+    def iter_snapshots(self, start=None, end=None, room=None):
+        for timestamp, row_room, *values in self._select(", ".join(WIDE_COLUMNS), start, end, room):
+            yield timestamp, row_room, {column: value for column, value in zip(WIDE_COLUMNS, values)
+                                        if value is not None}
+
+    def close(self):
+        self.flush()
+        self._conn.close()
+
+class LegacyWideSource(SnapshotSource):
+    """旧版宽表 sensor_data_legacy_wide（只读，迁移用）：没有教室列，occupancy 即 pir"""
+    name = "legacy"
+    COLUMNS = (("temperature", "temperature"), ("humidity", "humidity"), ("light", "light"),
+               ("co2", "co2"), ("pir", "occupancy"))
+
+    def __init__(self, db_path="data/sensor_data.db", room=None):
+        self.db_path = db_path
+        self.room = room
+        conn = sqlite3.connect(db_path)
+        rename_legacy_wide_table(conn)
+        conn.close()
+
+    def iter_snapshots(self, start=None, end=None, room=None):
+        if room is not None and room != self.room:
+            return
+        conditions = []
+        params = []
+        if start is not None:
+            conditions.append("timestamp >= ?")
+            params.append(_to_timestamp(start))
+        if end is not None:
+            conditions.append("timestamp < ?")
+            params.append(_to_timestamp(end))
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        conn = sqlite3.connect(self.db_path)
+        try:
+            exists = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sensor_data_legacy_wide'").fetchone()
+            if not exists:
+                return
+            cursor = conn.execute(f'''
+                SELECT timestamp, {", ".join(column for _, column in self.COLUMNS)}
+                FROM sensor_data_legacy_wide
+                {where}
+                ORDER BY timestamp, id
+            ''', params)
+            for timestamp, *values in cursor:
+                yield timestamp, self.room, {sensor_type: value for (sensor_type, _), value
+                                             in zip(self.COLUMNS, values) if value is not None}
+        finally:
+            conn.close()
+
+    def query_range(self, sensor_type, start=None, end=None, room=None):
+        for timestamp, row_room, values in self.iter_snapshots(start, end, room):
+            if sensor_type in values:
+                yield timestamp, row_room, values[sensor_type]
+
+def check_app_backend(name):
+    """Web应用只接受读取路径完整的布局，否则抛出 ValueError"""
+    if name not in APP_BACKENDS:
+        raise ValueError(f"Web应用不支持存储布局 {name}：历史、汇总和导出等读取路径只支持 "
+                         f"{', '.join(APP_BACKENDS)}，宽表数据请用 storage.py migrate 迁移")
+
+def create_backend(name, db=None, db_path="data/sensor_data.db", registry=None):
+    """按名称创建存储后端（配置文件 storage.backend）"""
+    if name == "narrow":
+        return NarrowBackend(db or Database(db_path), registry)
+    if name == "wide":
+        return WideBackend(db_path)
+    raise ValueError(f"不支持的存储后端: {name}")
+
+def migrate(source, target, start=None, end=None, room=None, chunk_size=5000, progress=None):
+    """把 source 中的快照按时间顺序分块写入 target，返回迁移的快照数"""
+    total = 0
+    chunk = []
+    for snapshot in source.iter_snapshots(start=start, end=end, room=room):
+        chunk.append(snapshot)
+        if len(chunk) >= chunk_size:
+            target.write_snapshots(chunk)
+            total += len(chunk)
+            chunk = []
+            if progress is not None:
+                progress(total)
+    if chunk:
+        target.write_snapshots(chunk)
+        total += len(chunk)
+    target.flush()
+    return total
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="传感器数据存储后端工具")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    migrate_parser = subparsers.add_parser("migrate", help="在存储布局之间迁移数据")
+    migrate_parser.add_argument("--db", default="data/sensor_data.db")
+    migrate_parser.add_argument("--from", dest="source", required=True, choices=("legacy", "narrow", "wide"))
+    migrate_parser.add_argument("--to", dest="target", required=True, choices=("narrow", "wide"))
+    migrate_parser.add_argument("--start")
+    migrate_parser.add_argument("--end")
+    migrate_parser.add_argument("--room", help="只迁移一个教室；旧版宽表的数据归入该教室（默认第一个教室）")
+    args = parser.parse_args()
+
+    if args.source == args.target:
+        parser.error("源和目标布局相同")
+    registry = default_registry()
+    database = Database(args.db, flush_interval=0)
+    backends = {
+        "narrow": lambda: NarrowBackend(database, registry),
+        "wide": lambda: WideBackend(args.db),
+    }
+    if args.source == "legacy":
+        legacy_room = args.room or next((room for room in registry.rooms() if room), None)
+        source = LegacyWideSource(args.db, room=legacy_room)
+        room_filter = None
+    else:
+        source = backends[args.source]()
+        room_filter = args.room
+    target = backends[args.target]()
+
+    count = migrate(source, target, start=args.start, end=args.end, room=room_filter,
+                    progress=lambda n: print(f"已迁移 {n} 个快照", flush=True))
+    target.close()
+    database.close()
+    print(f"迁移完成: {args.source} -> {args.target}，共 {count} 个快照")
+    if getattr(target, "skipped", 0):
+        print(f"注册表中没有对应传感器、已跳过的读数: {target.skipped}")
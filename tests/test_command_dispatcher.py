@@ -0,0 +1,143 @@
+# tests/test_command_dispatcher.py
+"""命令分发：合并、确认、超时重发（退避）和失败"""
+import json
+
+import pytest
+
+import command_dispatcher
+from command_dispatcher import ACK_SUFFIX, CommandDispatcher
+from device_registry import DeviceRegistry
+
+class Clock:
+    """代替 time 模块的可控时钟"""
+    def __init__(self):
+        self.now = 1000.0
+    
+    def time(self):
+        return self.now
+    
+    def monotonic(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(command_dispatcher, "time", clock)
+    return clock
+
+def make_dispatcher(publish=None, **config):
+    registry = DeviceRegistry()
+    for device_id in ("light1", "fan1"):
+        registry.register("actuator", {"id": device_id, "type": device_id[:-1], "room": "room1",
+                                       "mqtt_topic": f"control/{device_id}", "status": "off"})
+    applied = []
+    config.setdefault("require_ack", True)
+    config.setdefault("ack_timeout", 5)
+    dispatcher = CommandDispatcher(publish, registry, config, on_applied=applied.append)
+    return dispatcher, applied
+
+def ack(dispatcher, command_id, **extra):
+    dispatcher.handle_message("control/light1" + ACK_SUFFIX, json.dumps(dict(id=command_id, **extra)))
+
+def test_ack_applies_the_command(clock):
+    published = []
+    dispatcher, applied = make_dispatcher(lambda topic, payload: published.append((topic, json.loads(payload))))
+    command_id = dispatcher.submit("light1", "on")
+    assert dispatcher.dispatch_once() == 1
+    assert published == [("control/light1", {"id": command_id, "command": "on", "params": None})]
+    assert dispatcher.get(command_id)["status"] == "sent"
+    assert applied == []
+    
+    ack(dispatcher, command_id)
+    assert dispatcher.get(command_id)["status"] == "acked"
+    assert [cmd.id for cmd in applied] == [command_id]
+    assert dispatcher.stats()["in_flight"] == 0
+
+def test_rejected_command_is_failed_and_not_applied(clock):
+    dispatcher, applied = make_dispatcher(lambda topic, payload: None)
+    command_id = dispatcher.submit("light1", "on")
+    dispatcher.dispatch_once()
+    ack(dispatcher, command_id, ok=False, error="过热保护")
+    assert dispatcher.get(command_id)["status"] == "failed"
+    assert dispatcher.get(command_id)["error"] == "过热保护"
+    assert applied == []
+
+def test_unacked_command_is_retried_with_backoff_then_failed(clock):
+    published = []
+    dispatcher, applied = make_dispatcher(lambda topic, payload: published.append(topic), max_retries=2)
+    command_id = dispatcher.submit("light1", "on")
+    dispatcher.dispatch_once()
+    # 第n次发送后等待 n*ack_timeout
+    for attempts, wait in ((2, 5), (3, 10)):
+        clock.now += wait - 0.1
+        dispatcher.dispatch_once()
+        assert len(published) == attempts - 1
+        clock.now += 0.1
+        dispatcher.dispatch_once()
+        assert len(published) == attempts
+    clock.now += 15
+    dispatcher.dispatch_once()
+    assert len(published) == 3
+    assert dispatcher.get(command_id)["status"] == "failed"
+    assert dispatcher.get(command_id)["attempts"] == 3
+    assert applied == []
+
+def test_retried_command_acked_on_a_later_attempt(clock):
+    dispatcher, applied = make_dispatcher(lambda topic, payload: None)
+    command_id = dispatcher.submit("light1", "on")
+    dispatcher.dispatch_once()
+    clock.now += 5
+    dispatcher.dispatch_once()
+    ack(dispatcher, command_id)
+    # 重复的确认不会再次生效
+    ack(dispatcher, command_id)
+    assert dispatcher.get(command_id)["status"] == "acked"
+    assert dispatcher.get(command_id)["attempts"] == 2
+    assert len(applied) == 1
+
+def test_publish_error_is_retried_by_timeout(clock):
+    calls = []
+    
+    def flaky(topic, payload):
+        calls.append(topic)
+        if len(calls) == 1:
+            raise ConnectionError("broker down")
+    
+    dispatcher, _ = make_dispatcher(flaky)
+    command_id = dispatcher.submit("light1", "on")
+    dispatcher.dispatch_once()
+    clock.now += 5
+    dispatcher.dispatch_once()
+    assert len(calls) == 2
+    ack(dispatcher, command_id)
+    assert dispatcher.get(command_id)["status"] == "acked"
+
+def test_newer_commands_supersede_queued_and_unacked_ones(clock):
+    published = []
+    dispatcher, _ = make_dispatcher(lambda topic, payload: published.append(json.loads(payload)["command"]))
+    first = dispatcher.submit("light1", "on")
+    second = dispatcher.submit("light1", "off")
+    dispatcher.dispatch_once()
+    assert published == ["off"]
+    assert dispatcher.get(first)["status"] == "superseded"
+    
+    # 等待确认期间同一设备有新命令排队：超时后不再重发旧命令
+    third = dispatcher.submit("light1", "on")
+    clock.now += 5
+    dispatcher._check_timeouts()
+    assert dispatcher.get(second)["status"] == "superseded"
+    dispatcher.dispatch_once()
+    assert published == ["off", "on"]
+    assert dispatcher.get(third)["status"] == "sent"
+
+def test_without_broker_commands_apply_immediately(clock):
+    dispatcher, applied = make_dispatcher(None)
+    command_id = dispatcher.submit("fan1", "on")
+    dispatcher.dispatch_once()
+    assert dispatcher.get(command_id)["status"] == "applied"
+    assert [cmd.device_id for cmd in applied] == ["fan1"]
+
+def test_unknown_actuator_is_rejected(clock):
+    dispatcher, _ = make_dispatcher(None)
+    with pytest.raises(ValueError):
+        dispatcher.submit("nope", "on")
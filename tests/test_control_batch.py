@@ -0,0 +1,107 @@
+# tests/test_control_batch.py
+"""批量规则评估（auto_control_batch + expand_batch_commands）与单教室评估（auto_control_logic）的一致性"""
+import itertools
+import random
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from control_logic import ControlLogic  # noqa: E402
+from rule_engine import DEFAULT_RULES  # noqa: E402
+
+SENSORS = ("light", "pir", "co2", "temperature")
+
+def boundary_values(rules):
+    """每个传感器在所有规则阈值处取 <、==、> 三个值（整数阈值 ±1，温度再加 ±0.1）"""
+    values = {sensor: set() for sensor in SENSORS}
+    for group in rules["auto"]:
+        for rule in group["rules"]:
+            for sensor, _, threshold in rule.get("all", rule.get("any", [])):
+                steps = (1, 0.1) if sensor == "temperature" else (1,)
+                values[sensor].add(threshold)
+                for step in steps:
+                    values[sensor].update((threshold - step, threshold + step))
+    return {sensor: sorted(vals) for sensor, vals in values.items()}
+
+def batch_mismatches(logic, rooms):
+    columns = {sensor: np.array([room[sensor] for room in rooms]) for sensor in SENSORS}
+    codes = logic.auto_control_batch(**columns)
+    return [room for i, room in enumerate(rooms)
+            if logic.auto_control_logic(room) != logic.expand_batch_commands(codes, i)]
+
+def test_default_rules_cover_every_boundary():
+    values = boundary_values(DEFAULT_RULES)
+    # 每条规则的每个阈值都产生 <、==、> 三个取值
+    assert {799, 800, 801, 999, 1000, 1001} <= set(values["co2"])
+    assert {21.9, 22, 22.1, 25.9, 26, 26.1} <= set(values["temperature"])
+
+def test_batch_matches_scalar_at_threshold_boundaries():
+    values = boundary_values(DEFAULT_RULES)
+    rooms = [dict(zip(SENSORS, combo)) for combo in itertools.product(*(values[s] for s in SENSORS))]
+    assert batch_mismatches(ControlLogic(), rooms) == []
+
+def test_batch_matches_scalar_on_random_rooms():
+    rng = random.Random(0)
+    rooms = [{
+        "light": rng.randint(0, 1000),
+        "pir": rng.randint(0, 1),
+        "co2": rng.randint(400, 1500),
+        "temperature": round(rng.uniform(19, 30), 1),
+    } for _ in range(5000)]
+    assert batch_mismatches(ControlLogic(), rooms) == []
+
+def test_missing_sensor_uses_rule_defaults():
+    """规则用到但没有传入的传感器，批量评估与单教室评估使用同一个缺省值"""
+    rules = {"defaults": {"humidity": 50},
+             "auto": [{"device": "fan1", "rules": [
+                 {"command": "on", "all": [["humidity", ">", 40]]},
+                 {"command": "off", "all": [["humidity", "<=", 40]]}]}]}
+    logic = ControlLogic(rules=rules)
+    rooms = [{"light": 0, "pir": 0, "co2": 0, "temperature": 25}]
+    assert batch_mismatches(logic, rooms) == []
+    assert logic.auto_control_logic(rooms[0]) == [{"device": "fan1", "command": "on"}]
+
+def test_duplicate_command_names_keep_their_own_params():
+    """同一设备组两条 on 规则参数和原因不同，批量展开的命令必须来自命中的那一条"""
+    rules = {"auto": [{"device": "ac1", "rules": [
+        {"command": "on", "all": [["temperature", ">", 30]], "params": {"temp": 22}, "reason": "高温"},
+        {"command": "on", "all": [["temperature", ">", 26]], "params": {"temp": 25}, "reason": "偏热"},
+        {"command": "off", "all": [["temperature", "<", 22]], "reason": "温度适宜"}]}]}
+    logic = ControlLogic(rules=rules)
+    rooms = [{"light": 0, "pir": 0, "co2": 0, "temperature": t} for t in (20, 24, 28, 31)]
+    assert batch_mismatches(logic, rooms) == []
+    assert logic.auto_control_logic(rooms[2])[0]["temp"] == 25
+
+def test_batch_matches_scalar_with_hysteresis_state():
+    """有设备状态和滞回带宽时，批量评估使用与单教室评估相同的带宽"""
+    policies = {"light1": {"hysteresis": 50}, "fan1": {"hysteresis": 100},
+                "ac1": {"hysteresis": 1}, "curtain1": {"hysteresis": 50}}
+    logic = ControlLogic(actuator_policies=policies)
+    for device, command in (("light1", "on"), ("fan1", "on"), ("ac1", "off"), ("curtain1", "close")):
+        logic.record_command(device, command, now=0)
+    values = boundary_values(DEFAULT_RULES)
+    # 带宽移动后的阈值附近也要取值
+    for sensor, band in (("light", 50), ("co2", 100), ("temperature", 1)):
+        values[sensor] = sorted({v + d for v in values[sensor] for d in (-band, 0, band)})
+    rooms = [dict(zip(SENSORS, combo)) for combo in itertools.product(*(values[s] for s in SENSORS))]
+    assert batch_mismatches(logic, rooms) == []
+    # 带宽确实生效：风扇开启时 CO2 要低于 800-100 才关闭
+    def fan(co2):
+        return [cmd["command"] for cmd in logic.auto_control_logic(
+            {"light": 400, "pir": 1, "co2": co2, "temperature": 24}) if cmd["device"] == "fan1"]
+    assert fan(750) == []
+    assert fan(650) == ["off"]
+
+def test_batch_accepts_per_room_bands():
+    """带宽可以是每个教室一个值的数组，结果与逐个教室按各自带宽评估一致"""
+    plan = ControlLogic().rules
+    rng = random.Random(1)
+    rooms = [{"light": rng.randint(0, 1000), "pir": rng.randint(0, 1),
+              "co2": rng.randint(400, 1500), "temperature": round(rng.uniform(19, 30), 1)}
+             for _ in range(500)]
+    bands = np.array([rng.choice((0, 1, 50, 100)) for _ in rooms])
+    columns = {sensor: np.array([room[sensor] for room in rooms]) for sensor in SENSORS}
+    codes = plan.evaluate_batch(columns, len(rooms), lambda device, command: bands)
+    assert [plan.expand_batch(codes, i) for i in range(len(rooms))] == \
+        [plan.evaluate(room, lambda device, command, b=int(b): b) for room, b in zip(rooms, bands)]
@@ -0,0 +1,122 @@
+# tests/test_database.py
+"""数据库：写入管道（校验、有界队列、失败重试、死信队列）和历史查询参数检查"""
+import sqlite3
+from datetime import datetime
+
+import pytest
+
+from database import Database
+
+@pytest.fixture
+def db(tmp_path):
+    database = Database(str(tmp_path / "test.db"), flush_interval=0)
+    yield database
+    database.close()
+
+def count_rows(db, table="sensor_data"):
+    conn = sqlite3.connect(db.db_path)
+    try:
+        return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    finally:
+        conn.close()
+
+def reading(i, value=None):
+    return (f"d{i}", "temperature", 20 + i if value is None else value, "°C", datetime(2026, 1, 1, 0, i % 60))
+
+def test_invalid_rows_are_dropped_at_enqueue(db):
+    db.save_sensor_batch([reading(0), reading(1, float("nan")), reading(2, "hot"), ("d3", "co2", 1, None, "bad")])
+    assert db.pending_count() == 1
+    assert db.dropped_rows == 3
+    assert [table for table, _, _ in db.dead_letters] == ["sensor_data"] * 3
+    assert db.flush() == 1
+
+def test_pending_queues_are_bounded(tmp_path):
+    db = Database(str(tmp_path / "bounded.db"), batch_size=10, flush_interval=0, max_pending=10)
+    db._retry_after = float("inf")  # 不由写入方触发刷新，只看队列上限
+    db.save_sensor_batch([reading(i) for i in range(8)])
+    for i in range(5):
+        db.save_control_command(f"fan{i}", "on")
+    assert db.pending_count() == 10
+    assert db.dropped_rows == 3
+    # 先丢最旧的传感器数据
+    assert [row[1] for row in db._pending_sensor] == ["d3", "d4", "d5", "d6", "d7"]
+    db.close()
+
+def test_operational_error_requeues_and_retries(db, monkeypatch):
+    db.save_sensor_batch([reading(i) for i in range(5)])
+    write_rows = db._write_rows
+    
+    def unavailable(conn, sensor_rows, control_rows):
+        raise sqlite3.OperationalError("database is locked")
+    
+    monkeypatch.setattr(db, "_write_rows", unavailable)
+    with pytest.raises(sqlite3.OperationalError):
+        db.flush()
+    assert db.pending_count() == 5
+    assert not db.dead_letters
+    
+    monkeypatch.setattr(db, "_write_rows", write_rows)
+    assert db.flush() == 5
+    assert db.pending_count() == 0
+    assert count_rows(db) == 5
+
+def test_rows_that_keep_failing_go_to_dead_letters(db):
+    # 数据库拒绝 value = 666 的行（模拟个别行违反约束）：整批失败后逐行写入，只有这一行进入死信队列
+    with db.writer() as conn, conn:
+        conn.execute('''
+            CREATE TRIGGER reject_666 BEFORE INSERT ON sensor_data
+            WHEN NEW.value = 666 BEGIN SELECT RAISE(ABORT, 'rejected'); END
+        ''')
+    db.save_sensor_batch([reading(0), reading(1, 666), reading(2)])
+    db.save_control_command("fan1", "on")
+    assert db.flush() == 3
+    assert count_rows(db) == 2
+    assert count_rows(db, "control_history") == 1
+    assert len(db.dead_letters) == 1
+    table, row, error = db.dead_letters[0]
+    assert (table, row[3]) == ("sensor_data", 666)
+    assert "rejected" in error
+    # 坏数据不会卡住管道：之后的写入正常
+    db.save_sensor_batch([reading(3)])
+    assert db.flush() == 1
+    # 汇总表只包含写入成功的行
+    conn = sqlite3.connect(db.db_path)
+    assert conn.execute("SELECT SUM(count) FROM sensor_rollup_day").fetchone()[0] == 3
+    conn.close()
+
+def test_iter_history_checks_arguments_before_iteration(db):
+    # 参数错误在调用时立即抛出，而不是在开始迭代（流式响应已经开始）之后
+    with pytest.raises(ValueError):
+        db.iter_history(order="bogus")
+    with pytest.raises(ValueError):
+        db.iter_history(limit=-1)
+    with pytest.raises(ValueError):
+        db.iter_history(limit=0)
+
+def test_iter_history_limit_and_order(db):
+    db.save_sensor_batch([(f"d{i}", "temperature", 20 + i, "°C", datetime(2026, 1, 1, 0, i))
+                          for i in range(5)])
+    db.flush()
+    rows = list(db.iter_history(order="desc", limit=2))
+    assert [row[4] for row in rows] == [24, 23]
+
+def test_writer_threads_share_one_connection(db):
+    # 每个短生命周期的写线程都不应留下自己的连接
+    import os
+    import threading
+    
+    def write(i):
+        db.save_energy_totals([("2026-01-01", f"light{i}", "room1", 1.0, 60)])
+        db.save_sensor_batch([(f"d{i}", "temperature", 20, "°C", datetime(2026, 1, 1))])
+        db.flush()
+    
+    write(0)
+    fd_dir = "/proc/self/fd"
+    before = len(os.listdir(fd_dir)) if os.path.isdir(fd_dir) else None
+    for i in range(1, 51):
+        thread = threading.Thread(target=write, args=(i,))
+        thread.start()
+        thread.join()
+    assert db.pending_count() == 0
+    if before is not None:
+        assert len(os.listdir(fd_dir)) <= before + 2
@@ -0,0 +1,46 @@
+# tests/test_energy.py
+"""能耗统计：开放区间的查询合并内存累计值，不写库"""
+import time
+
+from database import Database
+from energy import EnergyAccountant, merge_totals
+
+class Device:
+    def __init__(self, device_id, room, device_type="light"):
+        self.id = device_id
+        self.room = room
+        self.type = device_type
+        self.extra = {}
+        self.status = "off"
+
+class Registry:
+    def __init__(self, *devices):
+        self.devices = {device.id: device for device in devices}
+    
+    def get(self, device_id):
+        return self.devices.get(device_id)
+    
+    def actuators(self):
+        return list(self.devices.values())
+
+def test_query_merges_unflushed_totals_without_writing(tmp_path):
+    db = Database(str(tmp_path / "test.db"), flush_interval=0)
+    accountant = EnergyAccountant(db, Registry(Device("light1", "room1"), Device("fan1", "room2", "fan")))
+    now = time.time()
+    accountant.record_transition("light1", "on", now=now - 7200)
+    accountant.flush(now=now - 3600)
+    accountant.record_transition("fan1", "on", now=now - 3600)
+    
+    writes = []
+    save = db.save_energy_totals
+    db.save_energy_totals = lambda rows: (writes.append(rows), save(rows))
+    data, unflushed = accountant.query(db.query_energy, now=now)
+    merged = merge_totals(data, unflushed)
+    assert writes == []
+    totals = {row["room"]: round(sum(r["energy_wh"] for r in merged if r["room"] == row["room"]))
+              for row in merged}
+    # light1: 400W × 2h（1h已写库 + 1h仍在通电），fan1: 60W × 1h
+    assert totals == {"room1": 800, "room2": 60}
+    data, unflushed = accountant.query(lambda: db.query_energy(room="room2"), now=now)
+    assert [row["room"] for row in merge_totals(data, unflushed, room="room2")] == ["room2"]
+    db.close()
@@ -0,0 +1,58 @@
+# tests/test_ingest.py
+"""接入服务：批处理中的坏消息只丢弃自身，不影响同批的其他读数"""
+import asyncio
+import json
+import time
+
+from device_registry import DeviceRegistry
+from fake_broker import FakeBroker
+from ingest_service import IngestService
+from mqtt_client import MQTTClient
+
+def make_service(**kwargs):
+    client = MQTTClient(registry=DeviceRegistry(), client=FakeBroker().client())
+    return IngestService(client, **kwargs)
+
+def reading(room, value, **extra):
+    payload = {"device_id": f"{room}-temperature", "sensor_type": "temperature",
+               "room": room, "value": value, "ts": time.time()}
+    payload.update(extra)
+    return f"sensor/{room}/temperature", json.dumps(payload)
+
+def run_batch(service, batch):
+    async def main():
+        service._loop = asyncio.get_running_loop()
+        await service._process_batch(batch)
+    asyncio.run(main())
+
+def test_bad_timestamps_drop_only_their_own_reading():
+    service = make_service()
+    batch = [reading(f"room{i}", 20 + i) for i in range(20)]
+    batch.insert(5, reading("bad1", 1, ts="yesterday"))
+    batch.insert(10, reading("bad2", 1, ts=1e20))
+    batch.insert(15, reading("bad3", 1, ts=-1e20))
+    run_batch(service, batch)
+    assert service.stats.processed == 20
+    assert service.stats.parse_errors == 3
+    assert service.state.get("room7")["temperature"] == 27
+    assert service.state.get("bad1") == {}
+
+def test_non_finite_values_are_parse_errors():
+    service = make_service()
+    run_batch(service, [("sensor/room1/temperature", '{"device_id": "d", "sensor_type": "temperature", '
+                                                     '"room": "room1", "value": NaN}'),
+                        reading("room2", 21)])
+    assert service.stats.processed == 1
+    assert service.stats.parse_errors == 1
+
+def test_callback_errors_do_not_block_other_rooms():
+    seen = []
+    
+    def on_readings(room, changed):
+        if room == "room0":
+            raise RuntimeError("boom")
+        seen.append(room)
+    
+    service = make_service(on_readings=on_readings)
+    run_batch(service, [reading(f"room{i}", 20) for i in range(3)])
+    assert seen == ["room1", "room2"]
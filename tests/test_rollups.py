@@ -0,0 +1,96 @@
+# tests/test_rollups.py
+"""结构迁移和汇总表：旧数据库升级、增量汇总与重算一致、原始数据部分清理后不覆盖汇总"""
+import sqlite3
+from datetime import datetime, timedelta
+
+import pytest
+
+from database import ROLLUP_TABLES, Database
+
+def rollups(db_path, table):
+    conn = sqlite3.connect(db_path)
+    try:
+        return sorted(conn.execute(f"SELECT bucket, sensor_type, device_id, count, ROUND(sum, 6), min, max "
+                                   f"FROM {table}"))
+    finally:
+        conn.close()
+
+def readings(start, count, step=timedelta(minutes=10)):
+    """每 step 一个温度和CO2读数"""
+    rows = []
+    for i in range(count):
+        ts = start + i * step
+        rows.append(("temp1", "temperature", 20 + i % 7, "°C", ts))
+        rows.append(("co2_1", "co2", 400 + i * 3, "ppm", ts))
+    return rows
+
+@pytest.fixture
+def db(tmp_path):
+    database = Database(str(tmp_path / "test.db"), flush_interval=0)
+    yield database
+    database.close()
+
+def test_migrations_upgrade_a_baseline_database(tmp_path):
+    path = str(tmp_path / "old.db")
+    conn = sqlite3.connect(path)
+    conn.executescript('''
+        CREATE TABLE sensor_data (id INTEGER PRIMARY KEY AUTOINCREMENT, timestamp DATETIME NOT NULL,
+                                  device_id VARCHAR(50), sensor_type VARCHAR(20), value REAL, unit VARCHAR(10));
+        CREATE TABLE energy_consumption (id INTEGER PRIMARY KEY AUTOINCREMENT, date DATE NOT NULL,
+                                         device_id VARCHAR(50), power_consumed REAL, duration INTEGER);
+        INSERT INTO sensor_data (timestamp, device_id, sensor_type, value, unit) VALUES
+            ('2026-01-01 08:00:00', 'temp1', 'temperature', 20, '°C'),
+            ('2026-01-01 08:00:30', 'temp1', 'temperature', 24, '°C'),
+            ('2026-01-01 09:15:00', 'temp1', 'temperature', 22, '°C');
+        INSERT INTO energy_consumption (date, device_id, power_consumed, duration) VALUES
+            ('2026-01-01', 'light1', 100, 600), ('2026-01-01', 'light1', 50, 300),
+            ('2026-01-01', 'fan1', 10, 60);
+    ''')
+    conn.commit()
+    conn.close()
+    
+    database = Database(path, flush_interval=0)
+    database.close()
+    conn = sqlite3.connect(path)
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == 3
+    assert conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+    assert sorted(conn.execute("SELECT device_id, power_consumed, duration FROM energy_consumption")) == \
+        [("fan1", 10, 60), ("light1", 150, 900)]
+    with pytest.raises(sqlite3.IntegrityError):
+        conn.execute("INSERT INTO energy_consumption (date, device_id) VALUES ('2026-01-01', 'fan1')")
+    conn.close()
+    # 已有原始数据回填到汇总表
+    assert rollups(path, "sensor_rollup_minute") == [
+        ("2026-01-01 08:00", "temperature", "temp1", 2, 44.0, 20.0, 24.0),
+        ("2026-01-01 09:15", "temperature", "temp1", 1, 22.0, 22.0, 22.0)]
+    assert rollups(path, "sensor_rollup_day") == [("2026-01-01", "temperature", "temp1", 3, 66.0, 20.0, 24.0)]
+    # 再次打开不重复执行迁移
+    Database(path, flush_interval=0).close()
+    assert rollups(path, "sensor_rollup_day") == [("2026-01-01", "temperature", "temp1", 3, 66.0, 20.0, 24.0)]
+
+def test_incremental_rollups_match_a_full_rebuild(db):
+    rows = readings(datetime(2026, 1, 1, 22), 30)
+    # 分多批写入，同一个时间桶跨批次累加
+    for i in range(0, len(rows), 7):
+        db.save_sensor_batch(rows[i:i + 7])
+        db.flush()
+    incremental = {table: rollups(db.db_path, table) for table, _ in ROLLUP_TABLES.values()}
+    db.rebuild_rollups()
+    for table, _ in ROLLUP_TABLES.values():
+        assert rollups(db.db_path, table) == incremental[table]
+    # 跨午夜的数据分到两天
+    assert [row[0] for row in incremental["sensor_rollup_day"]] == \
+        ["2026-01-01", "2026-01-01", "2026-01-02", "2026-01-02"]
+
+def test_rebuild_keeps_buckets_that_retention_partly_deleted(db):
+    # 一整天每10分钟一个读数（每类144个），然后像保留策略一样删除中午之前的原始数据
+    db.save_sensor_batch(readings(datetime(2026, 1, 1), 144))
+    db.flush()
+    before = {table: rollups(db.db_path, table) for table, _ in ROLLUP_TABLES.values()}
+    with db.writer() as conn, conn:
+        conn.execute("DELETE FROM sensor_data WHERE timestamp < '2026-01-01 12:05:00'")
+    db.rebuild_rollups()
+    for table, _ in ROLLUP_TABLES.values():
+        assert rollups(db.db_path, table) == before[table]
+    day = rollups(db.db_path, "sensor_rollup_day")
+    assert [row[3] for row in day] == [144, 144]
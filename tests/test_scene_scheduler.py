@@ -0,0 +1,57 @@
+# tests/test_scene_scheduler.py
+"""课表调度：嵌套时段结束后恢复外层时段的场景"""
+from datetime import date, datetime, timedelta
+
+from scene_scheduler import SceneScheduler
+
+DAY = date.today() + timedelta(days=2)
+
+def at(hour, minute=0):
+    return datetime.combine(DAY, datetime.min.time()).replace(hour=hour, minute=minute)
+
+def nested_scheduler(switches):
+    scheduler = SceneScheduler(on_switch=lambda room, scene, entry: switches.append((room, scene)))
+    now = at(7)
+    outer = scheduler.add("room1", "lecture", "08:00", "12:00", date=DAY, now=now)
+    inner = scheduler.add("room1", "exam", "09:00", "10:00", date=DAY, now=now)
+    return scheduler, outer, inner
+
+def test_nested_slot_restores_outer_scene():
+    switches = []
+    scheduler, _, _ = nested_scheduler(switches)
+    for hour in (8, 9, 10, 12):
+        scheduler.run_due(at(hour).timestamp())
+        if hour == 10:
+            assert scheduler.active_scenes() == {"room1": "lecture"}
+    assert switches == [("room1", "lecture"), ("room1", "exam"), ("room1", "lecture"), ("room1", "auto")]
+    assert scheduler.active_scenes() == {}
+
+def test_cancelling_inner_slot_restores_outer_scene():
+    switches = []
+    scheduler, _, inner = nested_scheduler(switches)
+    scheduler.run_due(at(9, 30).timestamp())
+    assert scheduler.cancel(inner)
+    assert switches[-1] == ("room1", "lecture")
+
+def test_cancelling_outer_slot_keeps_inner_scene():
+    switches = []
+    scheduler, outer, _ = nested_scheduler(switches)
+    scheduler.run_due(at(9, 30).timestamp())
+    assert scheduler.cancel(outer)
+    assert switches == [("room1", "lecture"), ("room1", "exam")]
+    scheduler.run_due(at(10).timestamp())
+    assert switches[-1] == ("room1", "auto")
+
+def test_upcoming_reports_the_scene_that_resumes():
+    scheduler, _, _ = nested_scheduler([])
+    events = scheduler.upcoming("room1", hours=24 * 4)
+    assert [(event["action"], event["scene"]) for event in events] == [
+        ("start", "lecture"), ("start", "exam"), ("end", "lecture"), ("end", "auto")]
+    assert len(scheduler.upcoming("room1", limit=2, hours=24 * 4)) == 2
+
+def test_upcoming_accounts_for_slots_already_in_progress():
+    scheduler, _, _ = nested_scheduler([])
+    scheduler.run_due(at(8, 30).timestamp())
+    events = scheduler.upcoming("room1", hours=24 * 4)
+    assert [(event["action"], event["scene"]) for event in events] == [
+        ("start", "exam"), ("end", "lecture"), ("end", "auto")]
@@ -1,56 +1,174 @@
 # src/web_server.py
-from flask import Flask, render_template, jsonify, request
+from flask import Flask, render_template, jsonify, request, Response, g
 import json
 import time
 import threading
 import random
+import atexit
+import base64
+import functools
+import os
 from datetime import datetime
 
+import downsample
+import metrics
+from app_config import load_config
+from campus import CampusAggregator
+from device_registry import default_registry
+from event_stream import EventHub, format_sse
+from recent_series import RecentSeries, summarize
+from state_store import StateStore
+
 # 导入你创建的所有模块
 try:
-    from mqtt_client import MQTTClient, DEVICES_CONFIG
+    from mqtt_client import MQTTClient
     from control_logic import ControlLogic
     from database import Database
+    from retention import RetentionManager
+    from energy import EnergyAccountant, merge_totals
+    from rule_engine import RuleReloader
+    from export import ExportJobs, available_formats
+    from storage import check_app_backend, create_backend
+    from anomaly import SensorHealth
+    from query_cache import QueryCache
+    from command_dispatcher import ACK_SUFFIX, CommandDispatcher
+    from scene_scheduler import SceneScheduler
 except ImportError:
     # 如果导入失败，创建简单版本
     print("警告：某些模块导入失败，使用简化版本")
-    DEVICES_CONFIG = {
-        "sensors": [
-            {"id": "temp1", "type": "temperature", "location": "front", "mqtt_topic": "sensor/temp1"},
-            {"id": "humi1", "type": "humidity", "location": "front", "mqtt_topic": "sensor/humi1"},
-            {"id": "light_sensor1", "type": "light", "location": "window", "mqtt_topic": "sensor/light1"},
-            {"id": "co2_sensor1", "type": "co2", "location": "middle", "mqtt_topic": "sensor/co2_1"},
-            {"id": "pir1", "type": "pir", "location": "door", "mqtt_topic": "sensor/pir1"}
-        ],
-        "actuators": [
-            {"id": "light1", "type": "light", "location": "front", "mqtt_topic": "control/light1", "status": "off"},
-            {"id": "fan1", "type": "fan", "location": "back", "mqtt_topic": "control/fan1", "status": "off"},
-            {"id": "curtain1", "type": "curtain", "location": "window", "mqtt_topic": "control/curtain1", "status": "closed"},
-            {"id": "ac1", "type": "ac", "location": "side", "mqtt_topic": "control/ac1", "status": "off"}
-        ]
-    }
+
+# 设备注册表（唯一的设备配置来源：config/config.json）
+device_registry = default_registry()
 
 app = Flask(__name__)
 
+# 后台循环周期（秒）
+TICK_INTERVAL = 5
+
+# 直接运行时使用 debug 模式的自动重载：父进程只负责监视文件，实际服务的是 WERKZEUG_RUN_MAIN=true 的子进程
+USE_RELOADER = True
+SERVING_PROCESS = not USE_RELOADER or os.environ.get("WERKZEUG_RUN_MAIN") == "true"
+
+def create_sharded_scheduler(scheduler_config):
+    """创建并启动分片进程：配置中的教室 + simulated_rooms 个模拟教室。
+    用fork启动（spawn会在子进程中重新执行本模块的全部初始化），因此必须在创建数据库连接、
+    启动任何后台线程之前调用——fork只复制当前线程，其他线程持有的锁会原样带进子进程"""
+    from shard_scheduler import ShardedScheduler
+    rooms = [room for room in device_registry.rooms() if room]
+    rooms += [f"sim{i:05d}" for i in range(scheduler_config.get("simulated_rooms", 0))]
+    scheduler = ShardedScheduler(
+        rooms, shards=scheduler_config.get("shards"), interval=TICK_INTERVAL,
+        rules=load_config().get("rules"),
+        actuator_policies=load_config().get("control", {}).get("actuators"),
+        chunk_size=scheduler_config.get("chunk_size", 64), start_method="fork")
+    scheduler.start()
+    return scheduler
+
+# 分片调度器（直接运行、未接入MQTT且配置启用时），在下面的模块初始化之前启动分片进程
+sharded_scheduler = None
+if (__name__ == '__main__' and SERVING_PROCESS and load_config().get("scheduler", {}).get("enabled")
+        and not load_config().get("mqtt", {}).get("enabled")):
+    sharded_scheduler = create_sharded_scheduler(load_config()["scheduler"])
+
+# ============ 运行指标 ============
+TICK_SECONDS = metrics.histogram("smart_classroom_tick_seconds", "后台循环每个tick的耗时（秒）")
+TICK_OVERRUNS = metrics.counter("smart_classroom_tick_overruns_total", "耗时超过循环周期的tick数")
+COMMANDS_PER_TICK = metrics.histogram("smart_classroom_commands_per_tick", "每个tick下发的控制命令数",
+                                      buckets=(0, 1, 2, 4, 8, 16, 64, 256, 1024))
+COMMANDS_TOTAL = metrics.counter("smart_classroom_commands_total", "下发的控制命令数", ("source",))
+REQUEST_SECONDS = metrics.histogram("smart_classroom_http_request_seconds", "API请求耗时（秒）",
+                                    ("route", "method"))
+REQUESTS_TOTAL = metrics.counter("smart_classroom_http_requests_total", "API请求数",
+                                 ("route", "method", "status"))
+
+@app.before_request
+def _start_request_timer():
+    if metrics.enabled():
+        g.request_started = time.perf_counter()
+
+@app.after_request
+def _record_request_metrics(response):
+    started = g.pop("request_started", None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        REQUEST_SECONDS.labels(route=route, method=request.method).observe(time.perf_counter() - started)
+        REQUESTS_TOTAL.labels(route=route, method=request.method, status=response.status_code).inc()
+    return response
+
+# 存储布局：历史、汇总、导出等读取路径都基于窄表，配置为其他布局时直接退出，不以回退模式运行
+STORAGE_BACKEND = load_config().get("storage", {}).get("backend", "narrow")
+try:
+    check_app_backend(STORAGE_BACKEND)
+except ValueError as e:
+    raise SystemExit(f"配置错误: {e}")
+except NameError:
+    pass  # 存储模块导入失败（简化版本）
+
 # 初始化各个模块
 try:
     # 初始化数据库
     db = Database()
+    # 退出时写入队列中剩余的数据
+    atexit.register(db.close)
+    
+    # 仪表盘读查询的结果缓存（写入管道提交新数据时按传感器类型/日期失效）；关闭时直接查询数据库
+    cache_config = dict(load_config().get("query_cache", {}))
+    db_reads = QueryCache(db, **cache_config) if cache_config.pop("enabled", True) else db
+    
+    # 数据保留策略（按传感器类型分级清理，后台线程执行）
+    retention = RetentionManager(db, load_config().get("retention", {}))
+    
+    # 能耗统计（执行器开关区间在线累加，按天批量写入 energy_consumption）
+    energy = EnergyAccountant(db, device_registry, load_config().get("energy", {}))
+    energy.seed_from_registry()
+    # 先于 db.close 执行，把最后的累计值写入数据库
+    atexit.register(energy.stop)
+    
+    # 传感器快照的存储布局（storage.backend，已在初始化之前检查）
+    storage = create_backend(STORAGE_BACKEND, db=db, registry=device_registry)
+    atexit.register(storage.close)
+    
+    # 传感器异常检测（MQTT接入、后台模拟和分片调度的读数都经过检查，异常读数不进入实时状态和自动控制）
+    sensor_health = SensorHealth(load_config().get("anomaly", {}))
+    
+    # 执行器命令分发（合并、批量发布到 control/<id>，跟踪设备确认）；命令生效时更新设备状态
+    dispatcher = CommandDispatcher(registry=device_registry, config=load_config().get("dispatch", {}),
+                                   on_applied=lambda cmd: set_actuator_status(cmd.device_id, cmd.command))
+    dispatcher.start()
+    atexit.register(dispatcher.stop)
+    
+    # 列式导出后台任务（输出到 data/exports/<任务id>）
+    export_jobs = ExportJobs(db)
     
     # 初始化MQTT客户端（简单版本，不实际连接）
     class SimpleMQTTClient:
         def __init__(self):
-            self.devices = DEVICES_CONFIG
+            self.devices = device_registry
             self.sensor_data = {}
             self.actuator_status = {}
         
         def update_device_status(self, device_id, status):
             self.actuator_status[device_id] = status
+            self.devices.update_status(device_id, status)
     
     mqtt_client = SimpleMQTTClient()
     
-    # 初始化控制逻辑
-    control_logic = ControlLogic()
+    # 初始化控制逻辑（规则、滞回带宽和最短驻留时间来自配置文件）
+    control_config = load_config().get("control", {})
+    control_logic = ControlLogic(actuator_policies=control_config.get("actuators", {}),
+                                 rules=load_config().get("rules"))
+    for actuator in device_registry.actuators():
+        control_logic.record_command(actuator.id, actuator.status, now=0)
+    
+    # 按课表切换场景（每周时段和一次性考试），到期时走与 /api/scene 相同的场景逻辑
+    scene_scheduler = SceneScheduler(
+        load_config().get("timetable", {}),
+        on_switch=lambda room, scene, entry: apply_scene(
+            room, scene, reason=f"课表: {scene}" if entry else "课表时段结束", source="schedule"))
+    
+    # 配置文件修改后自动重新编译规则，无需重启
+    rule_reloader = RuleReloader(control_logic,
+                                 interval=control_config.get("rule_reload_interval", 2))
     
 except Exception as e:
     print(f"初始化模块时出错: {e}")
@@ -58,40 +176,171 @@ except Exception as e:
     mqtt_client = None
     control_logic = None
     db = None
+    db_reads = None
+    retention = None
+    energy = None
+    rule_reloader = None
+    scene_scheduler = None
+    export_jobs = None
+    dispatcher = None
+    storage = None
+    sensor_health = None
 
-# 当前传感器数据（用于Web显示）
-current_sensor_data = {
+# 实时读数：每个教室一个槽位，写时复制快照，序列化结果按版本缓存
+state_store = StateStore()
+
+# 最近数据的内存环形缓冲区（每个传感器固定 capacity 个点），启动时从数据库重建
+recent_config = load_config().get("recent_series", {})
+recent_series = RecentSeries(recent_config.get("capacity", 4320), registry=device_registry)
+if db:
+    try:
+        loaded = recent_series.rebuild(db, recent_config.get("rebuild_hours", 6) * 3600)
+        print(f"内存时间序列已重建: {loaded} 个读数")
+    except Exception as e:
+        print(f"重建内存时间序列失败: {e}")
+
+# 仪表盘显示的教室（配置中的第一个教室）
+DEFAULT_ROOM = next((room for room in device_registry.rooms() if room), "default")
+
+# 当前传感器数据初始值（用于Web显示）
+state_store.update(DEFAULT_ROOM, {
     "temperature": 25.0,
     "humidity": 50.0,
     "light": 500,
     "co2": 800,
     "pir": 0
-}
+})
+
+# 校园层次汇总（楼栋/楼层/教室），读数和设备状态变化时按差值增量更新
+campus = CampusAggregator(device_registry)
+for _room in state_store.rooms():
+    campus.update_room(_room, state_store.get(_room))
+
+# SSE事件中心：传感器数据或设备状态变化时推送增量
+event_hub = EventHub()
+
+def set_actuator_status(device_id, status):
+    """更新执行器状态，状态变化时推送事件，返回是否发生变化"""
+    if not device_registry.update_status(device_id, status):
+        return False
+    if energy:
+        energy.record_transition(device_id, status)
+    campus.update_actuator(device_id, status)
+    event_hub.publish("device", {device_id: status})
+    return True
+
+def dispatch_command(device_id, command, params=None, reason=None, source="auto"):
+    """把命令交给分发器（异步发布，不等待设备），返回命令id；分发器不可用时直接更新状态"""
+    if dispatcher:
+        return dispatcher.submit(device_id, command, params, reason, source)
+    set_actuator_status(device_id, command)
+    return None
+
+def build_snapshot():
+    """完整状态快照（新连接或断线过久时发送）"""
+    return {
+        "sensor_data": state_store.get(DEFAULT_ROOM),
+        "devices": {a.id: a.status for a in device_registry.actuators()},
+        "timestamp": datetime.now().isoformat()
+    }
 
 # ============ Web路由 ============
 @app.route('/')
 def index():
     """主页面"""
     return render_template('index.html', 
-                         devices=DEVICES_CONFIG,
-                         sensor_data=current_sensor_data)
+                         devices=device_registry.to_dict(),
+                         sensor_data=state_store.get(DEFAULT_ROOM))
+
+@app.route('/metrics')
+def get_metrics():
+    """Prometheus文本格式的运行指标"""
+    return Response(metrics.REGISTRY.render(), mimetype=None, content_type=metrics.CONTENT_TYPE)
+
+def conditional_json(body, etag):
+    """带ETag的JSON响应；客户端 If-None-Match 命中时返回304"""
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def _sensor_data_body(snapshot):
+    return json.dumps({
+        "success": True,
+        "data": snapshot.values,
+        "timestamp": snapshot.updated_at
+    }, ensure_ascii=False).encode('utf-8')
 
 @app.route('/api/sensor_data')
 def get_sensor_data():
-    """获取当前传感器数据"""
-    return jsonify({
-        "success": True,
-        "data": current_sensor_data,
-        "timestamp": datetime.now().isoformat()
-    })
+    """获取当前传感器数据（每个版本只序列化一次，支持ETag）"""
+    snapshot = state_store.snapshot(request.args.get('room', DEFAULT_ROOM))
+    return conditional_json(snapshot.cached("api", _sensor_data_body), snapshot.etag)
+
+# 设备列表响应体缓存：(注册表版本, 字节串)
+_devices_body = (-1, b"")
+_started_at = int(time.time())
 
 @app.route('/api/devices')
 def get_devices():
-    """获取设备列表"""
-    return jsonify({
-        "success": True,
-        "devices": DEVICES_CONFIG
-    })
+    """获取设备列表（设备JSON按注册表版本缓存，状态变化时才重新序列化，支持ETag）"""
+    global _devices_body
+    version, body = _devices_body
+    if version != device_registry.version:
+        version, devices_json = device_registry.versioned_json()
+        body = ('{"success": true, "devices": ' + devices_json + '}').encode('utf-8')
+        _devices_body = (version, body)
+    return conditional_json(body, f"{_started_at:x}-d{version}")
+
+@app.route('/api/campus')
+def get_campus():
+    """校园概览：全校、各楼栋和楼层的汇总（不遍历教室，按版本缓存，支持ETag）"""
+    version, body = campus.overview_json()
+    return conditional_json(body, f"{_started_at:x}-c{version}")
+
+@app.route('/api/campus/<node_id>')
+def get_campus_node(node_id):
+    """某个楼栋/楼层/教室的汇总及其下一级"""
+    node = campus.node(node_id)
+    if node is None:
+        return jsonify({"success": False, "error": "节点不存在"}), 404
+    return jsonify({"success": True, "node": node})
+
+@app.route('/api/stream')
+def stream():
+    """SSE推送：只发送变化的数据，支持 Last-Event-ID 断线续传"""
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        last_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        last_id = None
+    
+    def generate():
+        cursor = last_id
+        # 浏览器断线重连时间（毫秒）
+        yield "retry: 3000\n\n"
+        events = event_hub.events_since(cursor) if cursor is not None else None
+        while True:
+            if events is None:
+                # 首次连接或错过的事件已被覆盖：先发完整快照
+                cursor = event_hub.last_id
+                payload = json.dumps(build_snapshot(), ensure_ascii=False)
+                yield format_sse(cursor, "snapshot", payload)
+            elif not events:
+                # 保活注释，防止代理断开空闲连接
+                yield ": keepalive\n\n"
+            else:
+                for event_id, event, payload in events:
+                    yield format_sse(event_id, event, payload)
+                cursor = events[-1][0]
+            events = event_hub.wait_for_events(cursor, timeout=15)
+    
+    return Response(generate(),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 @app.route('/api/control', methods=['POST'])
 def control_device():
@@ -102,11 +351,14 @@ def control_device():
         command = data.get('command')
         reason = data.get('reason', '手动控制')
         
-        # 更新设备状态
-        for actuator in DEVICES_CONFIG["actuators"]:
-            if actuator["id"] == device_id:
-                actuator["status"] = command
-                break
+        # 命令入队即返回，设备状态在命令发出（或设备确认）后更新
+        command_id = dispatch_command(device_id, command, data.get('params'), reason, "manual")
+        if control_logic:
+            control_logic.record_command(device_id, command)
+        if sharded_scheduler:
+            sharded_scheduler.record_command(getattr(device_registry.get(device_id), "room", None),
+                                             device_id, command)
+        COMMANDS_TOTAL.labels(source="manual").inc()
         
         # 保存到数据库
         if db:
@@ -114,55 +366,512 @@ def control_device():
         
         return jsonify({
             "success": True,
-            "message": f"设备 {device_id} 已执行 {command}",
+            "message": f"设备 {device_id} 的 {command} 命令已提交",
+            "command_id": command_id,
             "device_id": device_id,
             "command": command
+        }), 202
+    except Exception as e:
+        return jsonify({
+            "success": False,
+            "error": str(e)
         })
+
+@app.route('/api/control/<command_id>')
+def get_command_status(command_id):
+    """查询命令的分发状态：queued / sent / acked / applied / superseded / failed"""
+    try:
+        command = dispatcher.get(command_id) if dispatcher else None
+        if command is None:
+            return jsonify({"success": False, "error": "命令不存在"}), 404
+        return jsonify({"success": True, "command": command})
     except Exception as e:
         return jsonify({
             "success": False,
             "error": str(e)
         })
 
+def apply_scene(room, scene, reason=None, source="scene"):
+    """切换教室的场景模式，并下发该教室设备的场景命令（经去重和最短驻留时间过滤），返回命令id列表；
+    仪表盘教室的自动控制只在 auto 模式下运行"""
+    if not control_logic:
+        return []
+    if room == DEFAULT_ROOM:
+        control_logic.scene_mode = scene
+    if sharded_scheduler:
+        sharded_scheduler.set_mode(room, scene)
+    if scene == "auto":
+        return []
+    commands = [cmd for cmd in control_logic.scene_mode_control(scene, state_store.get(room))
+                if getattr(device_registry.get(cmd["device"]), "room", None) == room]
+    command_ids = []
+    for cmd in control_logic.filter_transitions(commands):
+        command_ids.append(dispatch_command(cmd["device"], cmd["command"], cmd.get("params"),
+                                            reason or f"场景: {scene}", source))
+        if sharded_scheduler:
+            sharded_scheduler.record_command(room, cmd["device"], cmd["command"])
+        if db:
+            db.save_control_command(cmd["device"], cmd["command"], reason or f"场景: {scene}")
+    COMMANDS_TOTAL.labels(source=source).inc(len(command_ids))
+    return command_ids
+
 @app.route('/api/scene', methods=['POST'])
 def set_scene_mode():
-    """设置场景模式"""
-    scene = request.json.get('scene', 'auto')
-    
-    if control_logic:
-        control_logic.scene_mode = scene
+    """设置场景模式（room 缺省为仪表盘教室），立即下发场景命令"""
+    data = request.json or {}
+    scene = data.get('scene', 'auto')
+    try:
+        command_ids = apply_scene(data.get('room', DEFAULT_ROOM), scene, source="manual")
+    except Exception as e:
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        })
     
     return jsonify({
         "success": True,
         "message": f"已切换到 {scene} 模式",
-        "scene": scene
+        "scene": scene,
+        "command_ids": command_ids
+    })
+
+@app.route('/api/schedule')
+def get_schedule():
+    """课表调度：未来 hours 小时（默认24）内的场景切换、当前由课表设置的场景；entries=1 时附带全部条目"""
+    if not scene_scheduler:
+        return jsonify({"success": False, "error": "课表调度未初始化"})
+    room = request.args.get('room')
+    result = {
+        "success": True,
+        "upcoming": scene_scheduler.upcoming(room, limit=request.args.get('limit', 50, type=int),
+                                             hours=request.args.get('hours', 24, type=float)),
+        "active": scene_scheduler.active_scenes(),
+    }
+    if request.args.get('entries', '0') == '1':
+        result["entries"] = scene_scheduler.entries(room)
+    return jsonify(result)
+
+@app.route('/api/schedule', methods=['POST'])
+def add_schedule():
+    """增加课表条目：{room, scene, start, end, date（一次性）或 day（每周）, lead_minutes}"""
+    if not scene_scheduler:
+        return jsonify({"success": False, "error": "课表调度未初始化"})
+    try:
+        data = request.json or {}
+        entry_id = scene_scheduler.add(data.get('room', DEFAULT_ROOM), data['scene'], data['start'],
+                                       data['end'], weekday=data.get('day'), date=data.get('date'),
+                                       lead_minutes=data.get('lead_minutes'))
+    except (KeyError, ValueError, TypeError) as e:
+        return jsonify({"success": False, "error": f"课表条目无效: {e}"}), 400
+    return jsonify({"success": True, "id": entry_id}), 201
+
+@app.route('/api/schedule/<int:entry_id>', methods=['DELETE'])
+def delete_schedule(entry_id):
+    """取消课表条目（正在生效时恢复默认场景）"""
+    if not scene_scheduler or not scene_scheduler.cancel(entry_id):
+        return jsonify({"success": False, "error": "课表条目不存在"}), 404
+    return jsonify({"success": True})
+
+@app.route('/api/sensor_health')
+def get_sensor_health():
+    """传感器健康状态（所有读数来源的异常检测），unhealthy=1 时只返回被隔离的传感器"""
+    if not sensor_health:
+        return jsonify({"success": False, "error": "异常检测未初始化"})
+    device_id = request.args.get('device_id')
+    if device_id:
+        status = sensor_health.status(device_id)
+        if status is None:
+            return jsonify({"success": False, "error": "没有该传感器的读数"}), 404
+        return jsonify({"success": True, "sensors": [status]})
+    sensors = sensor_health.report(only_unhealthy=request.args.get('unhealthy', '0') == '1',
+                                   limit=request.args.get('limit', 1000, type=int))
+    return jsonify({
+        "success": True,
+        "quarantined": sensor_health.quarantined_count(),
+        "sensors": sensors
+    })
+
+@app.route('/api/rules')
+def get_rules():
+    """每条控制规则的评估/命中次数"""
+    if not control_logic:
+        return jsonify({"success": False, "error": "控制逻辑未初始化"})
+    return jsonify({
+        "success": True,
+        "rules": control_logic.rules.stats()
+    })
+
+@app.route('/api/rules/reload', methods=['POST'])
+def reload_rules():
+    """立即从配置文件重新加载规则"""
+    if not rule_reloader:
+        return jsonify({"success": False, "error": "控制逻辑未初始化"})
+    if not rule_reloader.reload():
+        return jsonify({"success": False, "error": "规则编译失败，继续使用旧规则"})
+    return jsonify({
+        "success": True,
+        "rules": len(control_logic.rules.stats())
     })
 
+HISTORY_COLUMNS = ("id", "timestamp", "device_id", "sensor_type", "value", "unit")
+HISTORY_MAX_PAGE = 10000
+
+def encode_cursor(row):
+    """把一行的 (timestamp, id) 编码成不透明的分页游标"""
+    raw = json.dumps([row[1], row[0]]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+def decode_cursor(cursor):
+    timestamp, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    return timestamp, int(row_id)
+
+def _epoch(timestamp):
+    return datetime.fromisoformat(timestamp).timestamp()
+
+def _check_time(name, value):
+    """查询参数中的时间必须是ISO格式；在开始流式输出之前检查，错误时返回JSON错误而不是截断的响应"""
+    if value is None:
+        return None
+    try:
+        datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"{name} 不是有效的ISO时间: {value}")
+    return value
+
+def iter_downsampled(sensor_type, device_id, start, end, mode, max_points):
+    """逐个序列 (device_id, sensor_type) 流式降采样，每个序列产出一个紧凑对象：
+    {"device_id", "sensor_type", "points": [[毫秒时间戳, 值], ...]}，每个序列最多 max_points 个点"""
+    reducer = downsample.lttb if mode == "lttb" else downsample.minmax
+    t0, t1 = _epoch(start), _epoch(end) + 1e-6
+    for series_device, series_type in db.list_series(sensor_type, device_id, start, end):
+        rows = db.iter_history(sensor_type=series_type, device_id=series_device or None,
+                               start=start, end=end)
+        points = ((_epoch(row[1]), row[4]) for row in rows if row[4] is not None)
+        yield {
+            "device_id": series_device,
+            "sensor_type": series_type,
+            "points": [[int(t * 1000), v] for t, v in reducer(points, t0, t1, max_points)],
+        }
+
 @app.route('/api/history')
 def get_history():
-    """获取历史数据"""
+    """获取历史数据（流式输出）
+    参数：sensor_type, device_id, start, end 过滤；limit + cursor 键集分页；
+    order=asc|desc；format=json|ndjson；downsample=lttb|minmax 与 points 限制每个序列的点数
+    （降采样模式下每个元素是一个序列）"""
+    if not db:
+        return jsonify({
+            "success": False,
+            "error": "数据库未初始化"
+        })
     try:
-        if db:
-            data = db.get_recent_data(limit=50)
-            return jsonify({
-                "success": True,
-                "data": data
-            })
+        args = request.args
+        sensor_type = args.get('sensor_type')
+        device_id = args.get('device_id')
+        start = _check_time('start', args.get('start'))
+        end = _check_time('end', args.get('end'))
+        output = args.get('format', 'json')
+        mode = args.get('downsample')
+        if output not in ('json', 'ndjson'):
+            raise ValueError(f"不支持的格式: {output}")
+        
+        if mode:
+            if mode not in ('lttb', 'minmax'):
+                raise ValueError(f"不支持的降采样模式: {mode}")
+            points = min(args.get('points', 500, type=int), HISTORY_MAX_PAGE)
+            if points <= 0:
+                raise ValueError(f"points 必须是正整数: {points}")
+            first, last = db.time_bounds(sensor_type, device_id, start, end)
+            rows = iter_downsampled(sensor_type, device_id, start or first, end or last, mode, points) \
+                if first else iter(())
+            limit = None
         else:
-            return jsonify({
-                "success": False,
-                "error": "数据库未初始化"
+            limit = min(args.get('limit', 50, type=int), HISTORY_MAX_PAGE)
+            if limit <= 0:
+                raise ValueError(f"limit 必须是正整数: {limit}")
+            cursor = args.get('cursor')
+            rows = db.iter_history(sensor_type=sensor_type, device_id=device_id, start=start, end=end,
+                                   after=decode_cursor(cursor) if cursor else None,
+                                   order=args.get('order', 'desc'), limit=limit)
+    except Exception as e:
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        })
+    
+    def generate():
+        count = 0
+        last = None
+        if output == 'json':
+            yield '{"success": true, "data": ['
+        for row in rows:
+            item = json.dumps(row if mode else dict(zip(HISTORY_COLUMNS, row)), ensure_ascii=False)
+            if output == 'json':
+                yield item if count == 0 else ',' + item
+            else:
+                yield item + '\n'
+            count += 1
+            last = row
+        # 满页时返回下一页游标；降采样模式不分页
+        next_cursor = encode_cursor(last) if limit and count == limit else None
+        meta = {"count": count, "next_cursor": next_cursor}
+        if output == 'json':
+            yield '], ' + json.dumps(meta)[1:]
+        else:
+            yield json.dumps(meta) + '\n'
+    
+    mimetype = 'application/json' if output == 'json' else 'application/x-ndjson'
+    return Response(generate(), mimetype=mimetype)
+
+def _recent_from_db(device_id, start):
+    """缓冲区不完整时从数据库读取 start 之后的数据"""
+    times, values = [], []
+    for row in db.iter_history(device_id=device_id, start=datetime.fromtimestamp(start), order="asc"):
+        if row[4] is not None:
+            times.append(_epoch(row[1]))
+            values.append(row[4])
+    return times, values
+
+@app.route('/api/recent')
+def get_recent():
+    """最近数据（图表用）：参数 sensor_type / device_id，minutes 时间窗口（默认60），
+    last 只取最后N个点，points 降采样后的最大点数；每个序列附带 count/min/max/avg。
+    数据来自内存环形缓冲区，窗口超出缓冲区范围时查询数据库"""
+    try:
+        args = request.args
+        device_ids = recent_series.select(args.get('sensor_type'), args.get('device_id'))
+        last = args.get('last', type=int)
+        start = time.time() - args.get('minutes', 60, type=float) * 60
+        points = min(args.get('points', 500, type=int), HISTORY_MAX_PAGE)
+        source = "memory"
+        if last is None and not recent_series.covers(start, device_ids):
+            if not db:
+                raise ValueError("请求的时间窗口超出内存缓冲区范围")
+            source = "database"
+        
+        series = []
+        for device_id in device_ids:
+            if last is not None:
+                times, values = recent_series.last(device_id, last)
+            elif source == "memory":
+                times, values = recent_series.window(device_id, start)
+            else:
+                times, values = _recent_from_db(device_id, start)
+            pairs = zip(times, values)
+            if last is None and len(times) > points:
+                pairs = downsample.minmax(pairs, start, time.time(), points)
+            series.append({
+                "device_id": device_id,
+                "sensor_type": recent_series.sensor_type(device_id),
+                "points": [[int(t * 1000), v] for t, v in pairs],
+                "stats": summarize(values),
             })
+        return jsonify({"success": True, "source": source, "series": series})
+    except Exception as e:
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        })
+
+@app.route('/api/summary')
+def get_summary():
+    """获取每日摘要（读取天汇总表）"""
+    try:
+        if not db:
+            return jsonify({"success": False, "error": "数据库未初始化"})
+        date = request.args.get('date')
+        rows = db_reads.get_daily_summary(date)
+        return jsonify({
+            "success": True,
+            "data": [
+                {"sensor_type": r[0], "count": r[1], "avg_value": r[2],
+                 "min_value": r[3], "max_value": r[4]}
+                for r in rows
+            ]
+        })
     except Exception as e:
         return jsonify({
             "success": False,
             "error": str(e)
         })
 
+@app.route('/api/rollup')
+def get_rollup():
+    """获取图表用的汇总数据（分钟/小时/天）"""
+    try:
+        if not db:
+            return jsonify({"success": False, "error": "数据库未初始化"})
+        data = db_reads.query_rollup(
+            granularity=request.args.get('granularity', 'minute'),
+            sensor_type=request.args.get('sensor_type'),
+            start=request.args.get('start'),
+            end=request.args.get('end'),
+            limit=request.args.get('limit', 120, type=int)
+        )
+        return jsonify({
+            "success": True,
+            "data": data
+        })
+    except Exception as e:
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        })
+
+@app.route('/api/energy')
+def get_energy():
+    """按教室/日期的能耗统计（Wh），by_device=1 时按设备细分"""
+    try:
+        if not db:
+            return jsonify({"success": False, "error": "数据库未初始化"})
+        start = request.args.get('start')
+        end = request.args.get('end')
+        room = request.args.get('room')
+        by_device = request.args.get('by_device', '0') == '1'
+        query = functools.partial(db.query_energy, start=start, end=end, room=room, by_device=by_device)
+        if energy and end is None:
+            # 查询包含当前时刻时合并内存中尚未写库的累计值（写库仍由后台线程定时完成）
+            data, unflushed = energy.query(query)
+            data = merge_totals(data, unflushed, start=start, room=room, by_device=by_device)
+        else:
+            data = query()
+        return jsonify({
+            "success": True,
+            "data": data,
+            "total_wh": sum(row["energy_wh"] or 0 for row in data)
+        })
+    except Exception as e:
+        return jsonify({
+            "success": False,
+            "error": str(e)
+        })
+
+@app.route('/api/export', methods=['POST'])
+def start_export():
+    """启动列式导出任务（按天/传感器类型分区的 Parquet 或 npz），返回任务id"""
+    if not export_jobs:
+        return jsonify({"success": False, "error": "数据库未初始化"})
+    data = request.json or {}
+    fmt = data.get('format', 'auto')
+    if fmt != 'auto' and fmt not in available_formats():
+        return jsonify({"success": False,
+                        "error": f"不支持的导出格式: {fmt}（可用: {', '.join(available_formats())}）"}), 400
+    try:
+        chunk_size = int(data.get('chunk_size', 100000))
+    except (TypeError, ValueError):
+        chunk_size = 0
+    if chunk_size <= 0 or isinstance(data.get('chunk_size'), bool):
+        return jsonify({"success": False, "error": "chunk_size 必须是正整数"}), 400
+    job = export_jobs.submit(
+        start=data.get('start'),
+        end=data.get('end'),
+        sensor_type=data.get('sensor_type'),
+        fmt=fmt,
+        chunk_size=min(chunk_size, 1000000)
+    )
+    return jsonify({"success": True, "job": job}), 202
+
+@app.route('/api/export/<job_id>')
+def get_export(job_id):
+    """查询导出任务状态"""
+    job = export_jobs.get(job_id) if export_jobs else None
+    if job is None:
+        return jsonify({"success": False, "error": "导出任务不存在"}), 404
+    return jsonify({"success": True, "job": job})
+
 # ============ 后台任务 ============
+_sensor_ids = {}  # (room, sensor_type) -> 传感器设备id
+
+def sensor_device_id(room, sensor_type):
+    """教室中某类传感器的设备id（注册表中没有时按 <教室>-<类型> 命名，与压测负载一致）"""
+    key = (room, sensor_type)
+    device_id = _sensor_ids.get(key)
+    if device_id is None:
+        device = next((device for device in device_registry.by_room(room)
+                       if device.kind == "sensor" and device.type == sensor_type), None)
+        device_id = _sensor_ids[key] = device.id if device is not None else f"{room}-{sensor_type}"
+    return device_id
+
+def screen_readings(room, values, now=None):
+    """异常检测（与MQTT接入路径相同）：返回通过检查的读数；
+    被隔离的读数照常写库，但不进入实时状态、校园汇总和自动控制"""
+    if not sensor_health:
+        return values
+    now = time.time() if now is None else now
+    accepted = {}
+    for sensor_type, value in values.items():
+        if not isinstance(value, (int, float)) or \
+                sensor_health.check(sensor_device_id(room, sensor_type), sensor_type, value, now):
+            accepted[sensor_type] = value
+    return accepted
+
+def update_current_data(sensor_data):
+    """更新当前显示数据，只推送变化的字段，返回变化的字段"""
+    changed = state_store.update(DEFAULT_ROOM, sensor_data)
+    if changed:
+        campus.update_room(DEFAULT_ROOM, changed)
+        event_hub.publish("sensor", changed)
+    return changed
+
+def apply_auto_control(sensor_data, changed=None):
+    """执行自动控制逻辑，只处理真正改变设备状态的命令，返回命令数；
+    changed 为变化的读数时只评估依赖这些传感器的规则"""
+    if not control_logic or control_logic.scene_mode != "auto":
+        return 0
+    
+    # 只处理真正改变设备状态的命令，重复命令不写库
+    commands = control_logic.auto_control_changes(sensor_data, changed=changed)
+    COMMANDS_TOTAL.labels(source="auto").inc(len(commands))
+    
+    # 执行控制命令
+    for cmd in commands:
+        print(f"🔄 自动控制: {cmd['device']} -> {cmd['command']} ({cmd.get('reason', '')})")
+        
+        # 交给分发器发布，设备状态在命令发出后更新
+        dispatch_command(cmd["device"], cmd["command"], cmd.get("params"), cmd.get("reason"))
+        
+        # 保存控制记录
+        if db:
+            db.save_control_command(
+                cmd["device"], 
+                cmd["command"], 
+                cmd.get("reason", "自动控制")
+            )
+    return len(commands)
+
+def handle_ingested_readings(room, changed):
+    """MQTT接入服务的回调（接入服务已更新 state_store）：更新校园汇总，推送增量并执行自动控制"""
+    campus.update_room(room, changed)
+    if room != DEFAULT_ROOM:
+        return
+    event_hub.publish("sensor", changed)
+    apply_auto_control(dict(state_store.get(room)), changed)
+
+def start_mqtt_ingest(mqtt_config):
+    """连接MQTT Broker并在独立线程中运行异步接入服务"""
+    from ingest_service import IngestService, run_in_thread
+    
+    client = MQTTClient(registry=device_registry,
+                        host=mqtt_config.get("host", "localhost"),
+                        port=mqtt_config.get("port", 1883))
+    service = IngestService(client, db=db, on_readings=handle_ingested_readings,
+                            queue_size=mqtt_config.get("queue_size", 10000),
+                            state_store=state_store, health=sensor_health,
+                            recent=recent_series)
+    run_in_thread(service)
+    # 命令发布到设备主题，设备在 <主题>/ack 上确认
+    if dispatcher:
+        dispatcher.publish = client.publish
+        for topic in client.ack_topic_filters(ACK_SUFFIX):
+            client.add_topic_handler(topic, dispatcher.handle_message)
+            client.subscribe(topic)
+    client.connect()
+    return service
+
 def background_simulation():
     """后台模拟任务：生成模拟数据并执行自动控制"""
     while True:
+        tick_started = time.perf_counter()
         try:
             # 1. 生成模拟传感器数据
             simulated_data = {
@@ -173,63 +882,110 @@ def background_simulation():
                 "pir": random.choice([0, 0, 0, 1])  # 25%概率有人
             }
             
-            # 2. 更新当前显示数据
-            global current_sensor_data
-            current_sensor_data.update(simulated_data)
+            # 2. 异常检测后更新当前显示数据，只推送变化的字段（被隔离的读数保持上一个正常值）
+            changed = update_current_data(screen_readings(DEFAULT_ROOM, simulated_data))
             
-            # 3. 保存到数据库
-            if db:
-                # 保存各个传感器的数据
-                db.save_sensor_data("temp1", "temperature", simulated_data["temperature"], "°C")
-                db.save_sensor_data("humi1", "humidity", simulated_data["humidity"], "%")
-                db.save_sensor_data("light_sensor1", "light", simulated_data["light"], "lux")
-                db.save_sensor_data("co2_sensor1", "co2", simulated_data["co2"], "ppm")
-                db.save_sensor_data("pir1", "pir", simulated_data["pir"], "")
+            # 3. 保存到数据库（按配置的存储布局）
+            if storage:
+                storage.write_snapshots([(datetime.now(), DEFAULT_ROOM, simulated_data)])
+            recent_series.append_snapshot(DEFAULT_ROOM, simulated_data)
             
-            # 4. 执行自动控制逻辑
-            if control_logic:
-                if control_logic.scene_mode == "auto":
-                    commands = control_logic.auto_control_logic(simulated_data)
-                    
-                    # 执行控制命令
-                    for cmd in commands:
-                        print(f"🔄 自动控制: {cmd['device']} -> {cmd['command']} ({cmd.get('reason', '')})")
-                        
-                        # 更新设备状态
-                        for actuator in DEVICES_CONFIG["actuators"]:
-                            if actuator["id"] == cmd["device"]:
-                                actuator["status"] = cmd["command"]
-                                break
-                        
-                        # 保存控制记录
-                        if db:
-                            db.save_control_command(
-                                cmd["device"], 
-                                cmd["command"], 
-                                cmd.get("reason", "自动控制")
-                            )
+            # 4. 按通过检查的实时状态执行自动控制逻辑
+            COMMANDS_PER_TICK.observe(apply_auto_control(dict(state_store.get(DEFAULT_ROOM)), changed))
             
-            # 5. 等待5秒
-            time.sleep(5)
+            # 5. 记录tick耗时，超过周期时告警；等待到下一个周期
+            elapsed = time.perf_counter() - tick_started
+            TICK_SECONDS.observe(elapsed)
+            if elapsed > TICK_INTERVAL:
+                TICK_OVERRUNS.inc()
+                print(f"⚠️ 后台任务超时: 本次tick耗时 {elapsed:.2f}s，超过周期 {TICK_INTERVAL}s")
+            time.sleep(max(0, TICK_INTERVAL - elapsed))
             
         except Exception as e:
             print(f"后台任务出错: {e}")
             time.sleep(10)
 
+def handle_shard_result(room, values, commands):
+    """分片调度器的回调（主进程）：各教室读数经异常检测后计入校园汇总；
+    仪表盘教室的读数和命令同步到显示、设备状态和数据库（非 auto 模式时不执行分片的自动命令）"""
+    accepted = screen_readings(room, values)
+    if room != DEFAULT_ROOM:
+        campus.update_room(room, accepted)
+        return
+    changed = update_current_data(accepted)
+    if control_logic and control_logic.scene_mode != "auto":
+        commands = ()
+    elif len(accepted) < len(values):
+        # 分片按原始读数计算的命令可能来自被隔离的读数：丢弃，按通过检查的实时状态重新评估
+        commands = ()
+        apply_auto_control(dict(state_store.get(room)), changed)
+    if storage:
+        storage.write_snapshots([(datetime.now(), room, values)])
+    recent_series.append_snapshot(room, values)
+    for cmd in commands:
+        dispatch_command(cmd["device"], cmd["command"], cmd.get("params"), cmd.get("reason"))
+        # 分片已在子进程中记录了自己的设备状态，主进程的去重和迟滞也要看到这条命令
+        if control_logic:
+            control_logic.record_command(cmd["device"], cmd["command"])
+        if db:
+            db.save_control_command(cmd["device"], cmd["command"], cmd.get("reason", "自动控制"))
+    COMMANDS_TOTAL.labels(source="auto").inc(len(commands))
+
+def run_sharded_scheduler(scheduler):
+    """在后台线程中按周期运行分片调度器，结果交给 handle_shard_result"""
+    scheduler.on_result = handle_shard_result
+    threading.Thread(target=scheduler.run_forever, daemon=True).start()
+    print(f"分片调度器已启动: {len(scheduler.rooms)} 个教室，{scheduler.shards} 个分片")
+
 # ============ 启动应用 ============
 if __name__ == '__main__':
-    # 启动后台模拟线程
-    sim_thread = threading.Thread(target=background_simulation, daemon=True)
-    sim_thread.start()
+    if retention:
+        retention.start()
+    if energy:
+        energy.start()
+    if rule_reloader:
+        rule_reloader.start()
+    if scene_scheduler:
+        scene_scheduler.start()
+    
+    mqtt_config = load_config().get("mqtt", {})
+    scheduler_config = load_config().get("scheduler", {})
+    if mqtt_config.get("enabled"):
+        # 接入真实传感器数据
+        start_mqtt_ingest(mqtt_config)
+    elif scheduler_config.get("enabled"):
+        # 多进程分片模拟大量教室（分片进程已在模块初始化之前启动；重载监视进程中不启动）
+        if sharded_scheduler:
+            run_sharded_scheduler(sharded_scheduler)
+    else:
+        # 启动后台模拟线程
+        sim_thread = threading.Thread(target=background_simulation, daemon=True)
+        sim_thread.start()
     
     print("智慧教室监控系统启动中...")
     print("访问地址: http://localhost:5000")
     print("API接口:")
     print("  GET  /api/sensor_data    # 获取传感器数据")
     print("  GET  /api/devices        # 获取设备列表")
+    print("  GET  /api/stream         # SSE实时推送")
     print("  POST /api/control        # 控制设备")
+    print("  GET  /api/control/<id>   # 查询命令分发状态")
     print("  POST /api/scene          # 设置场景模式")
+    print("  GET  /api/schedule       # 课表场景切换计划")
+    print("  POST /api/schedule       # 增加课表条目")
+    print("  GET  /api/campus         # 校园/楼栋/楼层汇总")
+    print("  GET  /api/campus/<id>    # 某个楼栋/楼层/教室的汇总")
     print("  GET  /api/history        # 获取历史数据")
+    print("  GET  /api/summary        # 获取每日摘要")
+    print("  GET  /api/rollup         # 获取汇总图表数据")
+    print("  GET  /api/recent         # 最近数据（内存环形缓冲区）")
+    print("  GET  /api/energy         # 按教室/日期的能耗统计")
+    print("  POST /api/export         # 启动列式导出任务")
+    print("  GET  /api/export/<id>    # 查询导出任务状态")
+    print("  GET  /api/sensor_health  # 传感器健康状态")
+    print("  GET  /api/rules          # 控制规则评估统计")
+    print("  POST /api/rules/reload   # 重新加载控制规则")
+    print("  GET  /metrics            # 运行指标（Prometheus格式）")
     
     # 启动Flask服务器
-    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    app.run(debug=True, host='0.0.0.0', port=5000, threaded=True, use_reloader=USE_RELOADER)
\ No newline at end of file